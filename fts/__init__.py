@@ -1,6 +1,9 @@
 __all__ = ('backend', 'SearchableModel', 'SearchableManager',
            'SimpleSearchableModel', 'SimpleSearchableManager',
            'DummySearchableModel', 'DummySearchableManager',
+           'MemorySearchableModel', 'MemorySearchableManager',
+           'SegmentSearchableModel', 'SegmentSearchableManager',
+           'BlocksSearchableModel', 'BlocksSearchableManager',
            'MysqlSearchableModel', 'MysqlSearchableManager',
            'PgsqlSearchableModel', 'PgsqlSearchableManager',
            'SphinxSearchableModel', 'SphinxSearchableManager',
@@ -22,6 +25,9 @@ BACKENDS = {
     'xapian': 'xapian',
     'simple': 'simple',
     'dummy': 'dummy',
+    'memory': 'memory',
+    'segment': 'segment',
+    'blocks': 'blocks',
 }
 
 def get_fts(backend_uri):
@@ -50,6 +56,9 @@ def get_fts(backend_uri):
 SearchableModel, SearchManager = None, None
 SimpleSearchableModel, SimpleSearchManager = None, None
 DummySearchableModel, DummySearchManager = None, None
+MemorySearchableModel, MemorySearchManager = None, None
+SegmentSearchableModel, SegmentSearchManager = None, None
+BlocksSearchableModel, BlocksSearchManager = None, None
 MysqlSearchableModel, MysqlSearchManager = None, None
 PgsqlSearchableModel, PgsqlSearchManager = None, None
 SphinxSearchableModel, SphinxSearchManager = None, None
@@ -75,6 +84,37 @@ if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('dummy://'):
         if FTS_BACKEND.startswith('dummy://'):
             raise
     
+if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('memory://'):
+    try:
+        _fts, MemorySearchableModel, MemorySearchManager = get_fts('memory://')
+        if FTS_BACKEND.startswith('memory://'):
+            SearchableModel, SearchManager = MemorySearchableModel, MemorySearchManager
+            backend = _fts.backend
+    except InvalidFtsBackendError:
+        if FTS_BACKEND.startswith('memory://'):
+            raise
+    
+if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('segment://'):
+    try:
+        # the path of the URI is the directory of the indexes
+        _fts, SegmentSearchableModel, SegmentSearchManager = get_fts(FTS_BACKEND.startswith('segment://') and FTS_BACKEND or 'segment://')
+        if FTS_BACKEND.startswith('segment://'):
+            SearchableModel, SearchManager = SegmentSearchableModel, SegmentSearchManager
+            backend = _fts.backend
+    except InvalidFtsBackendError:
+        if FTS_BACKEND.startswith('segment://'):
+            raise
+    
+if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('blocks://'):
+    try:
+        _fts, BlocksSearchableModel, BlocksSearchManager = get_fts('blocks://')
+        if FTS_BACKEND.startswith('blocks://'):
+            SearchableModel, SearchManager = BlocksSearchableModel, BlocksSearchManager
+            backend = _fts.backend
+    except InvalidFtsBackendError:
+        if FTS_BACKEND.startswith('blocks://'):
+            raise
+    
 if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('mysql://'):
     try:
         _fts, MysqlSearchableModel, MysqlSearchManager = get_fts('mysql://')
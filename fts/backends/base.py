@@ -1,14 +1,77 @@
 "Base Fts class."
+import threading
+import heapq
 
-from django.db import transaction
+from django.core import signals
+from django.db import connection, transaction
 from django.db import models
 from django.conf import settings
 
 from django.core.exceptions import ImproperlyConfigured
 
+from fts.settings import FTS_CHUNK_SIZE, FTS_RESULT_CACHE, FTS_INDEX_QUEUE, FTS_MAX_RESULTS
+from fts import results, queue
+from fts.words.analyzer import Analyzer
+
+qn = connection.ops.quote_name
+
+WEIGHTS = {
+    'A' : 10,
+    'B' : 4,
+    'C' : 2,
+    'D' : 1
+}
+
 class InvalidFtsBackendError(ImproperlyConfigured):
     pass
 
+# Fixes http://code.google.com/p/django-fts/issues/detail?id=7
+# Using http://djangosnippets.org/snippets/1725/
+# So we'll no longer use
+# from snippets.decorators import commit_on_success_unless_managed
+
+try:
+    from functools import wraps
+except ImportError:
+    from django.utils.functional import wraps  # Python 2.3, 2.4 fallback.
+
+def commit_on_success_unless_managed(func):
+    """
+    If the decorated function runs successfully, a commit is made, unless the
+    transactions are being managed; if the function produces an exception,
+    a rollback is made, again unless transactions are being managed somewhere
+    else.
+    """
+    def _commit_on_success_unless_managed(*args, **kw):
+        try:
+            if transaction.is_managed():
+                forced_managed = False
+            else:
+                transaction.enter_transaction_management()
+                forced_managed = True
+            
+            try:
+                res = func(*args, **kw)
+            except:
+                # All exceptions must be handled here (even string ones).
+                if transaction.is_dirty():
+                    if forced_managed:
+                        transaction.rollback()
+                    else:
+                        transaction.rollback_unless_managed()
+                raise
+            else:
+                if transaction.is_dirty():
+                    if forced_managed:
+                        transaction.commit()
+                    else:
+                        transaction.commit_unless_managed()
+            return res
+        finally:
+            if forced_managed:
+                transaction.leave_transaction_management()
+    return wraps(func)(_commit_on_success_unless_managed)
+
 class BaseClass(object):
     class Meta:
         abstract = True
@@ -17,6 +80,17 @@ class BaseManager(models.Manager):
     class Meta:
         abstract = True
 
+    # whether a full update can start after a given pk (since_pk), to resume it
+    resumable = False
+    # whether its index can be rebuilt by fts.backends.simple.dump_indexes
+    dumpable = False
+    # whether the database updates the index of an instance when it is saved, so saves
+    # (and deletes) leave it alone (see the pgsql backend's trigger)
+    updated_on_save = False
+    # whether the index is kept apart from the model's table, so deleted instances
+    # must be removed from it
+    separate_index = False
+
     def __init__(self, **kwargs):
         super(BaseManager, self).__init__()
         self.fields = kwargs.get('fields')
@@ -27,18 +101,23 @@ class BaseManager(models.Manager):
         if not self.language_code:
             from django.utils import translation
             self.language_code = translation.get_language().split('-',1)[0].lower()
-        
+        self.chunk_size = kwargs.get('chunk_size', FTS_CHUNK_SIZE)
+        # None, 'local' or 'django' (see fts.results)
+        self.cache_results = kwargs.get('cache_results', FTS_RESULT_CACHE)
+
     def __call__(self, query=None, **kwargs):
         if query is None:
             return self # template variable resolver expects the object itself (no arguments)
         return self.search(query, **kwargs)
 
     def contribute_to_class(self, cls, name):
-        # Instances need to get to us to update their indexes.
-        search_managers = getattr(cls, '_search_managers', [])
+        # Instances need to get to us to update their indexes (each model has its own
+        # list, the managers of abstract models are copied to their subclasses).
+        search_managers = cls.__dict__.get('_search_managers', [])
         search_managers.append(self)
         setattr(cls, '_search_managers', search_managers)
         super(BaseManager, self).contribute_to_class(cls, name)
+        self.name = name
 
         if not self.fields:
             self.fields = self._find_text_fields()
@@ -56,53 +135,427 @@ class BaseManager(models.Manager):
     def _search(self, query, **kwargs):
         raise NotImplementedError
     
-    @transaction.commit_on_success
-    def update_index(self, pk=None):
+    def update_index(self, pk=None, **kwargs):
         """
         Updates the full-text index for one, many, or all instances of this manager's model.
+        Any other keyword arguments are passed on to the backend's _update_index.
         """
-        return self._update_index(pk)
+        try:
+            return transaction.commit_on_success(self._update_index)(pk, **kwargs)
+        finally:
+            # once committed, so the results cached from the old index are not used any more:
+            self._index_changed()
     
     def search(self, query, **kwargs):
+        if self.cache_results:
+            return results.CachedSearch(self, query, kwargs)
         return self._search(query, **kwargs)
     
+    def _get_cache_query(self, query):
+        """
+        Returns query normalized, so the searches it gives the same results as share
+        their cache entries.
+        """
+        return ' '.join(query.lower().split())
+    
+    def _index_changed(self):
+        """
+        Starts a new generation of the cached results of the model (in the manager's
+        namespace), if any of its managers caches them. Must be called once the changes
+        are committed: before, a search run in between would cache the old results again
+        under the new generation (see _changed_on_commit).
+        """
+        if [sm for sm in get_search_managers(self.model) if sm.cache_results]:
+            opts = self.model._meta
+            results.bump_generation('%s.%s' % (opts.app_label, opts.module_name), getattr(self, 'namespace', None))
+    
+    def _iter_chunks(self, since_pk=None):
+        """
+        Walks all the instances of this manager's model in primary key order, yielding
+        lists of at most chunk_size instances. Each chunk is fetched with its own keyset
+        query (pk > last pk seen) bypassing the result cache, so only one chunk is kept
+        in memory at a time. If since_pk is given the walk starts right after it.
+        """
+        last_pk = since_pk
+        while True:
+            qs = self.get_query_set().order_by('pk')
+            if last_pk is not None:
+                qs = qs.filter(pk__gt=last_pk)
+            chunk = list(qs[:self.chunk_size].iterator())
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) < self.chunk_size:
+                break
+            last_pk = chunk[-1].pk
+    
+    def _pk_ranges(self, since_pk=None):
+        """
+        Returns a list of (lo, hi) tuples splitting the instances with pk > since_pk in
+        ranges (lo < pk <= hi) of chunk_size instances, reading only primary keys.
+        """
+        ranges = []
+        lo = since_pk
+        while True:
+            qs = self.get_query_set().order_by('pk')
+            if lo is not None:
+                qs = qs.filter(pk__gt=lo)
+            pks = list(qs.values_list('pk', flat=True)[self.chunk_size-1:self.chunk_size])
+            if not pks:
+                pks = list(qs.order_by('-pk').values_list('pk', flat=True)[:1])
+                if pks:
+                    ranges.append((lo, pks[0]))
+                return ranges
+            ranges.append((lo, pks[0]))
+            lo = pks[0]
+    
+    def _commit_chunk(self):
+        """
+        Commits the work done for the last chunk of a full index rebuild, so an
+        interrupted rebuild can be resumed from the last pk indexed.
+        """
+        if transaction.is_dirty():
+            transaction.commit()
+    
     def _find_text_fields(self):
         """
         Return the names of all CharField and TextField fields defined for this manager's model.
         """
         return [f.name for f in self.model._meta.fields if isinstance(f, (models.CharField, models.TextField))]
 
+class AnalyzingManager(BaseManager):
+    """
+    Base for the managers of the backends that analyze the text themselves (simple,
+    memory...): it decides which words are indexed for an instance and which ones
+    are looked for when searching.
+    """
+    separate_index = True
+
+    def __init__(self, **kwargs):
+        super(AnalyzingManager, self).__init__(**kwargs)
+        # For autocomplete, generally you'd want:
+        #   full_index=True and stem_words=False (full_index implies exact_search)
+        # or, for a much smaller index matching only the beginning of words:
+        #   prefix_index=True and stem_words=False (prefixes of min_gram to max_gram letters)
+        # For regular Fulltext search, you'd want:
+        #   full_index=False, steam_words=True and exact_search=True
+        self.full_index = kwargs.get('full_index', False)
+        self.prefix_index = kwargs.get('prefix_index', False)
+        self.min_gram = kwargs.get('min_gram', 1)
+        self.max_gram = kwargs.get('max_gram', 20)
+        self.stem_words = kwargs.get('stem_words', True)
+        self.exact_search = kwargs.get('exact_search', True)
+        self.analyzer = Analyzer(self.language_code, stem_words=self.stem_words)
+
+    def _get_grams(self, word, minlen=0):
+        """
+        Returns the words indexed for word: its substrings with full_index, its
+        prefixes with prefix_index (the word itself if shorter than min_gram), or just
+        the word.
+        """
+        if self.full_index:
+            # Find all the substrings of the word (all digit words treated differently):
+            return [ word[i:j] for i in not word.isdigit() and range(len(word)) or (0,) for j in range(i+1, len(word)+1) if j-i > minlen ]
+        if self.prefix_index:
+            # Only the leading substrings (edge n-grams) of the word:
+            if len(word) < self.min_gram:
+                return len(word) > minlen and [word] or []
+            return [ word[:j] for j in range(max(self.min_gram, minlen+1), min(len(word), self.max_gram)+1) ]
+        return [word]
+
+    def _get_idx_words(self, line, minlen=0):
+        words = self._get_words(line, minlen)
+        if self.full_index or self.prefix_index:
+            words = set( gram for word in words for gram in self._get_grams(word, minlen) )
+        return words
+    
+    def _get_idx_counts(self, line, minlen=0):
+        """
+        Returns a dictionary mapping the words indexed for line to the number of times
+        they occur, and the number of words in line.
+        """
+        counts = self.analyzer.count(line, minlen)
+        length = sum(counts.values())
+        if self.full_index or self.prefix_index:
+            grams = {}
+            for word, count in counts.items():
+                for gram in set(self._get_grams(word, minlen)):
+                    grams[gram] = grams.get(gram, 0) + count
+            counts = grams
+        return counts, length
+    
+    def _get_words(self, line, minlen=0):
+        return self.analyzer.analyze(line, minlen)
+    
+    def _get_item_texts(self, item):
+        """
+        Returns a list of (text, weight) tuples for the indexed fields of item.
+        """
+        texts = []
+        for field, weight in self._fields.items():
+            if callable(field):
+                words = field(item)
+            else:
+                words = item
+                for col in field.split('__'):
+                    words = getattr(words, col)
+            texts.append((words, weight))
+        return texts
+    
+    def _get_item_words(self, item):
+        """
+        Returns a dictionary mapping every word to index for item to the best
+        (lowest letter) weight of the fields it was found in.
+        """
+        item_words = {}
+        for words, weight in self._get_item_texts(item):
+            # get all the possible substrings for words
+            for word in self._get_idx_words(words):
+                if ord(weight) < ord(item_words.get(word, 'Z')):
+                    item_words[word] = weight
+        return item_words
+    
+    def _get_item_terms(self, item):
+        """
+        Like _get_item_words, but also returns a dictionary mapping every word to the
+        number of times it occurs in item (its term frequency) and the number of words
+        in item (its length).
+        """
+        item_words = {}
+        tf = {}
+        length = 0
+        for words, weight in self._get_item_texts(item):
+            counts, field_length = self._get_idx_counts(words)
+            length += field_length
+            for word, count in counts.items():
+                tf[word] = tf.get(word, 0) + count
+                if ord(weight) < ord(item_words.get(word, 'Z')):
+                    item_words[word] = weight
+        return item_words, tf, length
+    
+    def _get_query_words(self, query):
+        """
+        Returns a list of (word, exact) tuples for the words of query: an exact word
+        must have been indexed as it is, otherwise it is the beginning of the words
+        to look for.
+        """
+        query_words = []
+        for word in self._get_words(query):
+            exact = self.full_index or self.exact_search
+            if self.prefix_index:
+                # longer words were indexed by their first max_gram letters, and
+                # shorter ones than min_gram are the beginning of the words indexed
+                # (whole, if shorter than min_gram too, or by their prefixes):
+                word = word[:self.max_gram]
+                exact = len(word) >= self.min_gram
+            query_words.append((word, exact))
+        return query_words
+    
+    def _get_cache_query(self, query):
+        return sorted(set(self._get_query_words(query)))
+    
+    def _ranked_query_set(self, ranks, rank_field=None, limit=None):
+        """
+        Returns the instances whose (integer) primary keys are in ranks, a dictionary
+        mapping them to their rank, for the backends that search outside the database.
+        Only the limit (FTS_MAX_RESULTS by default) best ranked are kept, as their
+        primary keys are written in the query. With rank_field the rank is selected as
+        that field and the best come first.
+        """
+        qs = self.get_query_set()
+        if not ranks:
+            return qs.none()
+        if limit is None:
+            limit = FTS_MAX_RESULTS
+        if len(ranks) > limit:
+            ranks = dict(heapq.nlargest(limit, ranks.iteritems(), key=lambda (pk, rank): (rank, -pk)))
+        pk_column = '%s.%s' % (qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+        qs = qs.extra(where=['%s IN (%s)' % (pk_column, ', '.join([str(int(pk)) for pk in ranks]))])
+        if rank_field is not None:
+            cases = ' '.join(['WHEN %d THEN %d' % (pk, rank) for pk, rank in ranks.items()])
+            qs = qs.extra(select={ rank_field: 'CASE %s %s END' % (pk_column, cases) }, order_by=['-%s' % rank_field])
+        return qs
+
+def get_search_managers(model):
+    """
+    Returns the search managers of model and of the models it inherits from with
+    multi-table inheritance, whose rows are saved and deleted with its instances.
+    Each model has its own list of managers (see BaseManager.contribute_to_class).
+    """
+    managers = list(model.__dict__.get('_search_managers', []))
+    for parent in model._meta.parents:
+        managers.extend([sm for sm in get_search_managers(parent) if sm not in managers])
+    return managers
+
+_local = threading.local()
+
+def _changed_on_commit(managers):
+    """
+    Records that the indexes of managers were changed by the current transaction, for
+    _commit_index_changes to start new generations of their cached results once it is
+    committed.
+    """
+    changed = getattr(_local, 'changed', None)
+    if changed is None:
+        changed = _local.changed = []
+    changed.extend([sm for sm in managers if sm not in changed])
+
+def _commit_index_changes():
+    """
+    Starts new generations of the cached results of the managers recorded by
+    _changed_on_commit. Called right after the commits of BaseModel.save and delete
+    and, for the changes committed elsewhere (e.g. the deletes of query sets, or the
+    transactions managed by the caller), when the request finishes (after the
+    transaction middleware commits).
+    """
+    if getattr(_local, 'deleting', None):
+        _flush_deleted()
+    queue.flush_full()
+    changed = getattr(_local, 'changed', None)
+    _local.changed = []
+    for sm in changed or []:
+        sm._index_changed()
+
+def _request_finished(sender, **kwargs):
+    _commit_index_changes()
+
+signals.request_finished.connect(_request_finished)
+
+def _update_instance_indexes(model, pk, deleted=False):
+    """
+    Updates the indexes of the instance of model with primary key pk, or of the ones
+    with the primary keys in a list pk (removing them from the indexes if they no
+    longer exist), or queues them with FTS_INDEX_QUEUE. Once deleted, only the managers
+    with a separate index have anything to update. The generations of their cached
+    results change once the transaction is committed.
+    """
+    queued = False
+    changed = []
+    for sm in get_search_managers(model):
+        if deleted and not sm.separate_index:
+            continue
+        if sm.updated_on_save:
+            changed.append(sm)
+        elif FTS_INDEX_QUEUE:
+            queued = True
+        else:
+            sm._update_index(pk=pk)
+            changed.append(sm)
+    _changed_on_commit(changed)
+    if queued:
+        if not isinstance(pk, (set,list,tuple)):
+            pk = [pk]
+        for object_id in pk:
+            queue.enqueue(model, object_id)
+
+def _deleting():
+    deleting = getattr(_local, 'deleting', None)
+    if deleting is None:
+        deleting = _local.deleting = {}
+    return deleting
+
+def _will_delete(sender, instance, **kwargs):
+    """
+    Records the instances about to be deleted: Django sends pre_delete for all the
+    instances of a model it deletes together before any post_delete, so
+    _remove_deleted knows when the last one is gone.
+    """
+    if getattr(instance, '_auto_reindex', True) and get_search_managers(sender):
+        _deleting().setdefault(sender, (set(), []))[0].add(instance.pk)
+
+def _remove_deleted(sender, instance, **kwargs):
+    """
+    Removes deleted instances from the indexes, however they were deleted (including
+    the deletes of query sets and the ones cascading from other objects): the instances
+    of a model deleted together are removed with one update of each index, once the
+    last of them is deleted.
+    """
+    if not getattr(instance, '_auto_reindex', True) or not get_search_managers(sender):
+        return
+    deleting = _deleting()
+    pending, deleted = deleting.setdefault(sender, (set(), []))
+    pending.discard(instance.pk)
+    deleted.append(instance.pk)
+    if not pending:
+        del deleting[sender]
+        _update_instance_indexes(sender, deleted, deleted=True)
+
+@commit_on_success_unless_managed
+def _flush_deleted():
+    """
+    Updates the indexes of the instances still recorded by _will_delete and
+    _remove_deleted, left behind by a delete that failed part-way through (the ones
+    that still exist are just reindexed).
+    """
+    deleting = _deleting()
+    _local.deleting = {}
+    for sender, (pending, deleted) in deleting.items():
+        _update_instance_indexes(sender, list(pending) + deleted)
+
+models.signals.pre_delete.connect(_will_delete)
+models.signals.post_delete.connect(_remove_deleted)
+
+@transaction.commit_on_success
+def _update_indexes(managers, pk):
+    for sm in managers:
+        sm._update_index(pk=pk)
+
 class BaseModel(models.Model):
     """
     A convience Model wrapper that provides an update_index method for object instances,
     as well as automatic index updating. The index is stored as a tsvector column on the
     model's table. A model may specify a boolean class variable, _auto_reindex, to control
-    whether the index is automatically updated when save is called.
+    whether the index is automatically updated when save is called (and deleted instances
+    removed from it). With FTS_INDEX_QUEUE the update is queued instead (see fts.queue).
     """
     class Meta:
         abstract = True
     
-    @transaction.commit_on_success
     def update_index(self):
         """
         Update the index.
         """
-        for sm in getattr(self.__class__, '_search_managers', []):
-            sm._update_index(pk=self.pk)
+        managers = get_search_managers(self.__class__)
+        try:
+            _update_indexes(managers, self.pk)
+        finally:
+            for sm in managers:
+                sm._index_changed()
 
     @classmethod
-    @transaction.commit_on_success
     def update_indexes(cls):
         """
         Update the index.
         """
-        for sm in getattr(cls, '_search_managers', []):
-            sm._update_index(None)
+        managers = get_search_managers(cls)
+        try:
+            _update_indexes(managers, None)
+        finally:
+            for sm in managers:
+                sm._index_changed()
     
-    @transaction.commit_on_success
     def save(self, *args, **kwargs):
+        managed = transaction.is_managed()
+        try:
+            self._save_and_index(*args, **kwargs)
+        finally:
+            # once committed, so the results cached from the old indexes are not used any
+            # more (the transactions managed by the caller, when the request finishes):
+            if not managed:
+                _commit_index_changes()
+    
+    @commit_on_success_unless_managed
+    def _save_and_index(self, *args, **kwargs):
         update_index = kwargs.pop('update_index', True)
         super(BaseModel, self).save(*args, **kwargs)
         if update_index and getattr(self, '_auto_reindex', True):
-            for sm in getattr(self.__class__, '_search_managers', []):
-                sm._update_index(pk=self.pk)
+            _update_instance_indexes(self.__class__, self.pk)
+    
+    def delete(self):
+        managed = transaction.is_managed()
+        try:
+            commit_on_success_unless_managed(super(BaseModel, self).delete)()
+        finally:
+            # the indexes were updated by _remove_deleted, before the commit
+            if not managed:
+                _commit_index_changes()
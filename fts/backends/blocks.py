@@ -0,0 +1,413 @@
+"Blocks Fts backend"
+import sys
+import time
+import bisect
+from array import array
+
+from django.db import connection, transaction
+from django.core.exceptions import ImproperlyConfigured
+
+from fts.backends.base import BaseClass, BaseModel, WEIGHTS
+from fts.backends import simple
+from fts.backends.simple import commit_on_success_unless_managed, _postings_where, _prefix_range
+from fts.models import Word, Namespace, PostingBlock, BlockDocument
+from fts.segments import encode_ids, decode_ids
+from fts.loaders import bulk_insert, _chunks, MAX_PARAMS, ENGINE
+from fts.settings import FTS_BLOCK_SIZE, FTS_PREFIX_EXPANSIONS
+
+qn = connection.ops.quote_name
+
+# the DB-API module of the database, to pass blobs as query parameters
+Binary = sys.modules[connection.__class__.__module__].Database.Binary
+
+def encode_postings(ids, weights):
+    """
+    Returns the ascending ids, delta varint encoded (see fts.segments), followed by
+    their weights, one byte each.
+    """
+    out = []
+    encode_ids(ids, out)
+    return ''.join(out) + array('B', weights).tostring()
+
+def decode_postings(blob, count):
+    """
+    Returns the list of the count ids encoded by encode_postings in blob and the array
+    of their weights.
+    """
+    blob = str(blob)
+    ids, pos = decode_ids(blob, 0, count)
+    return ids, array('B', blob[pos:pos+count])
+
+def _in(column, values):
+    return ('%s IN (%s)' % (column, ', '.join(['%s'] * len(values))), list(values))
+
+class SearchClass(BaseClass):
+    def __init__(self, server, params):
+        self.backend = 'blocks'
+
+class SearchManager(simple.SearchManager):
+    """
+    Stores the postings of each word for the objects of the model (in the manager's
+    namespace) as blobs of up to block_size (FTS_BLOCK_SIZE) postings, delta encoded
+    with their weights (fts.models.PostingBlock), instead of one fts_index row each;
+    the words of each object are kept the same way (fts.models.BlockDocument), to
+    rewrite only the blocks of the words that changed when it is updated. Words,
+    namespaces and prefixes are looked up like in the simple backend, but searches
+    intersect the decoded posting lists in Python and only rank by weights.
+    """
+    resumable = False
+    dumpable = False
+
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        if self.ranking != 'weights':
+            raise ImproperlyConfigured, "The blocks backend only ranks by weights, not by %s" % self.ranking
+        self.block_size = kwargs.get('block_size', FTS_BLOCK_SIZE)
+
+    def _get_scope(self, create=False):
+        """
+        Returns the content type id and namespace id of the postings of this manager,
+        creating the namespace if asked to.
+        """
+        from django.contrib.contenttypes.models import ContentType
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is None and self.namespace and create:
+            namespace_id = Namespace.objects.create(slug=self.namespace).id
+        return ContentType.objects.get_for_model(self.model).id, namespace_id
+
+    def _get_docs(self, items, iw):
+        """
+        Returns a dictionary mapping the pks of items to dictionaries mapping the ids of
+        their words to their weights.
+        """
+        items = [(item.pk, self._get_item_words(item)) for item in items]
+        words = set()
+        for item_pk, item_words in items:
+            words.update(item_words)
+        ids = self._get_word_ids(words, iw)
+        docs = {}
+        for item_pk, item_words in items:
+            docs[item_pk] = dict([(ids[word], WEIGHTS[weight]) for word, weight in item_words.items()])
+        return docs
+
+    @commit_on_success_unless_managed
+    def _update_index(self, pk, progress=None):
+        """
+        Updates the postings of the given instances (deleting the ones of the instances
+        that no longer exist) or, with pk=None, rebuilds the index of the model in one
+        transaction, walking the table in chunks of chunk_size instances; progress, if
+        given, is called with the last pk indexed and the size of the chunk. A full
+        update returns a dictionary with the number of documents, postings and blocks
+        written, the seconds taken and the documents per second.
+        """
+        if self.model._meta.abstract:
+            return # skip abstract class updates
+        content_type_id, namespace_id = self._get_scope(create=True)
+        iw = {}
+        if pk is not None:
+            if not isinstance(pk, (set,list,tuple)):
+                pk = [pk]
+            for pks in _chunks(pk, self.batch_size):
+                docs = dict([(p, {}) for p in pks])
+                docs.update(self._get_docs(self.filter(pk__in=pks), iw))
+                self._write_docs(docs, content_type_id, namespace_id)
+            return
+
+        stats = { 'documents': 0, 'postings': 0, 'blocks': 0 }
+        start = time.time()
+        cursor = connection.cursor()
+        where, params = _postings_where(('1 = 1', []), content_type_id, namespace_id)
+        cursor.execute('DELETE FROM %s WHERE %s' % (qn(PostingBlock._meta.db_table), where), params)
+        cursor.execute('DELETE FROM %s WHERE %s' % (qn(BlockDocument._meta.db_table), where), params)
+        transaction.set_dirty()
+        # the postings of the last block of each word, written once full: the instances
+        # come in pk order, so they are appended in order
+        tails = {}
+        for chunk in self._iter_chunks():
+            docs = self._get_docs(chunk, iw)
+            doc_rows = []
+            block_rows = []
+            for item in chunk:
+                doc = docs[item.pk]
+                if not doc:
+                    continue
+                word_ids = sorted(doc)
+                doc_rows.append((content_type_id, namespace_id, item.pk, len(doc),
+                                 Binary(encode_postings(word_ids, [doc[w] for w in word_ids]))))
+                for word_id in word_ids:
+                    ids, weights = tails.setdefault(word_id, ([], []))
+                    ids.append(item.pk)
+                    weights.append(doc[word_id])
+                    if len(ids) >= self.block_size:
+                        block_rows.append(self._block_row(word_id, content_type_id, namespace_id, ids, weights))
+                        del tails[word_id]
+                stats['documents'] += 1
+                stats['postings'] += len(doc)
+            bulk_insert(BlockDocument._meta.db_table, ('content_type_id', 'namespace_id', 'object_id', 'count', 'words'), doc_rows)
+            self._insert_blocks(block_rows)
+            stats['blocks'] += len(block_rows)
+            if progress is not None:
+                progress(chunk[-1].pk, len(chunk))
+        block_rows = [self._block_row(word_id, content_type_id, namespace_id, ids, weights)
+                      for word_id, (ids, weights) in sorted(tails.items())]
+        self._insert_blocks(block_rows)
+        stats['blocks'] += len(block_rows)
+        stats['seconds'] = time.time() - start
+        stats['documents_per_second'] = stats['documents'] / (stats['seconds'] or 1)
+        return stats
+
+    def _block_row(self, word_id, content_type_id, namespace_id, ids, weights):
+        return (word_id, content_type_id, namespace_id, ids[0], ids[-1], len(ids), Binary(encode_postings(ids, weights)))
+
+    def _insert_blocks(self, rows):
+        bulk_insert(PostingBlock._meta.db_table, ('word_id', 'content_type_id', 'namespace_id', 'first_id',
+                                                  'last_id', 'count', 'postings'), rows)
+
+    def _write_docs(self, docs, content_type_id, namespace_id):
+        """
+        Updates the index of the objects in docs, a dictionary mapping their pks to
+        dictionaries mapping the ids of their words to their weights (empty for the
+        objects to remove), rewriting the blocks of the postings that changed.
+        """
+        doc_table = qn(BlockDocument._meta.db_table)
+        cursor = connection.cursor()
+        where, params = _postings_where(_in('object_id', docs), content_type_id, namespace_id)
+        cursor.execute('SELECT id, object_id, count, words FROM %s WHERE %s' % (doc_table, where), params)
+        old = {}
+        old_ids = {}
+        for id, object_id, count, words in cursor.fetchall():
+            word_ids, weights = decode_postings(words, count)
+            old[object_id] = dict(zip(word_ids, weights))
+            old_ids[object_id] = id
+
+        # word id -> { pk: new weight, or None to remove the posting }
+        changes = {}
+        for pk, doc in docs.items():
+            previous = old.get(pk, {})
+            for word_id, weight in doc.items():
+                if previous.get(word_id) != weight:
+                    changes.setdefault(word_id, {})[pk] = weight
+            for word_id in previous:
+                if word_id not in doc:
+                    changes.setdefault(word_id, {})[pk] = None
+        if not changes:
+            return
+        self._write_blocks(changes, content_type_id, namespace_id)
+
+        new_rows = []
+        for pk, doc in docs.items():
+            if doc == old.get(pk, {}):
+                continue
+            if not doc:
+                cursor.execute('DELETE FROM %s WHERE id = %%s' % doc_table, [old_ids[pk]])
+                continue
+            word_ids = sorted(doc)
+            words = Binary(encode_postings(word_ids, [doc[w] for w in word_ids]))
+            if pk in old_ids:
+                cursor.execute('UPDATE %s SET count = %%s, words = %%s WHERE id = %%s' % doc_table, [len(doc), words, old_ids[pk]])
+            else:
+                new_rows.append((content_type_id, namespace_id, pk, len(doc), words))
+        bulk_insert(BlockDocument._meta.db_table, ('content_type_id', 'namespace_id', 'object_id', 'count', 'words'), new_rows)
+        transaction.set_dirty()
+
+    def _write_blocks(self, changes, content_type_id, namespace_id):
+        """
+        Applies changes, a dictionary mapping word ids to dictionaries mapping pks to
+        their new weight (None to remove the posting), to the blocks of the words. A
+        posting goes to the block whose range holds its pk or else to the last block
+        starting before it (the first one if none does); blocks growing past block_size
+        are split and the empty ones deleted.
+        """
+        block_table = qn(PostingBlock._meta.db_table)
+        cursor = connection.cursor()
+        blocks = {}
+        for chunk in _chunks(changes.keys(), MAX_PARAMS - 2):
+            where, params = _postings_where(_in('word_id', chunk), content_type_id, namespace_id)
+            cursor.execute('SELECT first_id, last_id, id, word_id FROM %s WHERE %s' % (block_table, where), params)
+            for first_id, last_id, id, word_id in cursor.fetchall():
+                blocks.setdefault(word_id, []).append((first_id, last_id, id))
+
+        # block id -> { pk: new weight or None }, and the postings of the words without blocks
+        touched = {}
+        new = {}
+        for word_id, postings in changes.items():
+            word_blocks = sorted(blocks.get(word_id, []))
+            if not word_blocks:
+                new[word_id] = dict([(pk, weight) for pk, weight in postings.items() if weight is not None])
+                continue
+            firsts = [first_id for first_id, last_id, id in word_blocks]
+            for pk, weight in postings.items():
+                # blocks written concurrently can overlap: the posting is removed from
+                # all the blocks that may hold it, and kept in the first one
+                holding = [id for first_id, last_id, id in word_blocks if first_id <= pk <= last_id]
+                if not holding:
+                    holding = [word_blocks[max(bisect.bisect_right(firsts, pk) - 1, 0)][2]]
+                touched.setdefault(holding[0], {})[pk] = weight
+                for id in holding[1:]:
+                    touched.setdefault(id, {})[pk] = None
+
+        rows = []
+        lock = ENGINE != 'sqlite3' and ' FOR UPDATE' or ''
+        for chunk in _chunks(touched.keys(), MAX_PARAMS):
+            where, params = _in('id', chunk)
+            cursor.execute('SELECT id, word_id, count, postings FROM %s WHERE %s%s' % (block_table, where, lock), params)
+            for id, word_id, count, blob in cursor.fetchall():
+                ids, weights = decode_postings(blob, count)
+                postings = dict(zip(ids, weights))
+                for pk, weight in touched[id].items():
+                    if weight is None:
+                        postings.pop(pk, None)
+                    else:
+                        postings[pk] = weight
+                if not postings:
+                    cursor.execute('DELETE FROM %s WHERE id = %%s' % block_table, [id])
+                    continue
+                pieces = self._split(postings)
+                ids, weights = pieces[0]
+                cursor.execute('UPDATE %s SET first_id = %%s, last_id = %%s, count = %%s, postings = %%s WHERE id = %%s' % block_table,
+                               [ids[0], ids[-1], len(ids), Binary(encode_postings(ids, weights)), id])
+                rows.extend([self._block_row(word_id, content_type_id, namespace_id, ids, weights) for ids, weights in pieces[1:]])
+        for word_id, postings in new.items():
+            if postings:
+                rows.extend([self._block_row(word_id, content_type_id, namespace_id, ids, weights) for ids, weights in self._split(postings)])
+        self._insert_blocks(rows)
+        transaction.set_dirty()
+
+    def _split(self, postings):
+        """
+        Returns a list of (ids, weights) tuples splitting postings, a dictionary mapping
+        pks to weights, in pk order into as few blocks of equal size as fit block_size.
+        """
+        pks = sorted(postings)
+        count = (len(pks) + self.block_size - 1) // self.block_size
+        size = (len(pks) + count - 1) // count
+        return [(pks[i:i+size], [postings[pk] for pk in pks[i:i+size]]) for i in range(0, len(pks), size)]
+
+    def _fetch_postings(self, word_ids, content_type_id, namespace_id, lo=None, hi=None):
+        """
+        Returns a dictionary mapping the pks of the postings of the words (between lo
+        and hi, if given) to their best weight, fetched in one query.
+        """
+        scores = {}
+        cursor = connection.cursor()
+        for chunk in _chunks(word_ids, MAX_PARAMS - 4):
+            where, params = _postings_where(_in('word_id', chunk), content_type_id, namespace_id)
+            if lo is not None:
+                where += ' AND last_id >= %s AND first_id <= %s'
+                params.extend([lo, hi])
+            cursor.execute('SELECT count, postings FROM %s WHERE %s' % (qn(PostingBlock._meta.db_table), where), params)
+            for count, blob in cursor.fetchall():
+                ids, weights = decode_postings(blob, count)
+                for pk, weight in zip(ids, weights):
+                    if weight > scores.get(pk, 0):
+                        scores[pk] = weight
+        return scores
+
+    def _expand_prefix(self, prefix):
+        """
+        Returns the ids of the words starting with prefix, like the simple backend, but
+        the most frequent ones are the ones with the most postings in the blocks of this
+        manager: Word.doc_count is only kept up to date by the simple backend.
+        """
+        start, end = _prefix_range(prefix)
+        content_type_id, namespace_id = self._get_scope()
+        word_table = qn(Word._meta.db_table)
+        block_table = qn(PostingBlock._meta.db_table)
+        where, params = _postings_where(('%s.word >= %%s' % word_table, [start]), content_type_id, namespace_id)
+        if end is not None:
+            where += ' AND %s.word < %%s' % word_table
+            params.append(end)
+        cursor = connection.cursor()
+        cursor.execute('SELECT %s.id, %s.word FROM %s JOIN %s ON %s.word_id = %s.id WHERE %s '
+                       'GROUP BY %s.id, %s.word ORDER BY SUM(%s.count) DESC LIMIT %d' % (word_table, word_table,
+                       word_table, block_table, block_table, word_table, where, word_table, word_table, block_table,
+                       FTS_PREFIX_EXPANSIONS), params)
+        # the bounds are compared with the database's collation, the prefix is not:
+        return [id for id, word in cursor.fetchall() if word.startswith(prefix)]
+
+    def _word_ids_df(self, word_ids):
+        """
+        Returns a dictionary mapping those of word_ids with postings in the blocks of
+        this manager to their number of postings.
+        """
+        content_type_id, namespace_id = self._get_scope()
+        df = {}
+        cursor = connection.cursor()
+        for chunk in _chunks(list(word_ids), MAX_PARAMS - 2):
+            where, params = _postings_where(_in('word_id', chunk), content_type_id, namespace_id)
+            cursor.execute('SELECT word_id, SUM(count) FROM %s WHERE %s GROUP BY word_id' % (qn(PostingBlock._meta.db_table), where), params)
+            df.update(cursor.fetchall())
+        return df
+
+    def word_stats(self, words):
+        """
+        Returns a dictionary mapping each of words (as indexed, e.g. stemmed) with
+        postings in the blocks of this manager to the number of objects indexed with it.
+        """
+        ids = self._find_word_ids(words)
+        df = self._word_ids_df(ids.values())
+        return dict([(word, df[id]) for word, id in ids.items() if id in df])
+
+    def index_stats(self):
+        """
+        Returns the number of 'documents' (objects) of this manager's model in the index,
+        of their 'postings' and of the 'blocks' holding them.
+        """
+        content_type_id, namespace_id = self._get_scope()
+        where, params = _postings_where(('1 = 1', []), content_type_id, namespace_id)
+        cursor = connection.cursor()
+        cursor.execute('SELECT COUNT(*), SUM(count) FROM %s WHERE %s' % (qn(BlockDocument._meta.db_table), where), params)
+        documents, postings = cursor.fetchone()
+        cursor.execute('SELECT COUNT(*) FROM %s WHERE %s' % (qn(PostingBlock._meta.db_table), where), params)
+        return { 'documents': documents, 'postings': postings or 0, 'blocks': cursor.fetchone()[0] }
+
+    def plan(self, query):
+        """
+        Returns how a search for query is run, like the simple backend (see
+        simple.SearchManager.plan), with the document frequencies counted in the blocks
+        of this manager and the strategy 'blocks' instead of 'joins' or 'intersect':
+        the blocks of the words are decoded and intersected, starting with the rarest.
+        """
+        plan = super(SearchManager, self).plan(query)
+        if plan['strategy'] not in ('all', 'empty'):
+            plan['strategy'] = 'blocks'
+        return plan
+
+    def _search(self, query, **kwargs):
+        ranking = kwargs.get('ranking', self.ranking)
+        if ranking != 'weights':
+            raise ValueError, "The blocks backend only ranks by weights, not by %s" % ranking
+        query_words = self._get_query_words(query)
+        if not query_words:
+            return self.get_query_set()
+        content_type_id, namespace_id = self._get_scope()
+        exact = self._find_word_ids([word for word, is_exact in query_words if is_exact])
+        groups = []
+        for word, is_exact in query_words:
+            if is_exact:
+                groups.append(word in exact and [exact[word]] or [])
+            else:
+                groups.append(self._expand_prefix(word))
+            if not groups[-1]:
+                return self.get_query_set().none()
+
+        # intersect starting by the words with the fewest postings, only fetching the
+        # blocks of the next ones in the range of the objects found so far
+        counts = self._word_ids_df(set([id for ids in groups for id in ids]))
+        groups.sort(key=lambda ids: sum([counts.get(id, 0) for id in ids]))
+        ranks = None
+        for ids in groups:
+            if ranks is None:
+                ranks = self._fetch_postings(ids, content_type_id, namespace_id)
+            else:
+                scores = self._fetch_postings(ids, content_type_id, namespace_id, min(ranks), max(ranks))
+                ranks = dict([(pk, rank + scores[pk]) for pk, rank in ranks.items() if pk in scores])
+            if not ranks:
+                break
+        return self._ranked_query_set(ranks, kwargs.get('rank_field'), kwargs.get('limit'))
+
+class SearchableModel(BaseModel):
+    class Meta:
+        abstract = True
+
+    objects = SearchManager()
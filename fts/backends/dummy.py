@@ -3,31 +3,28 @@
 from fts.backends.base import BaseClass, BaseModel, BaseManager
 from django.db.models import Q
 
-from fts.words.stop import FTS_STOPWORDS
-
-try:
-    from fts.words.snowball import Stemmer
-except ImportError:
-    from fts.words.porter import Stemmer
+from fts.words.analyzer import Analyzer
 
 class SearchClass(BaseClass):
     def __init__(self, server, params):
         self.backend = 'dummy'
 
 class SearchManager(BaseManager):
-    def update_index(self, pk=None):
-        pass
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        # the search runs on the stored text, so accents must be kept
+        self.analyzer = Analyzer(self.language_code, strip_accents=False)
+
+    def _update_index(self, pk, **kwargs):
+        pass # the search runs on the model's table, there is no index to update
 
     def search(self, query, **kwargs):
         qs = self.get_query_set()
         
         params = Q()
-        for w in set(query.lower().split(' ')):
-            if w and w not in FTS_STOPWORDS[self.language_code]:
-                p = Stemmer(self.language_code)
-                w = p(w)
-                for field in self._fields.keys():
-                    params &= Q(**{'%s__icontains' % field: w})
+        for w in self.analyzer.analyze(query):
+            for field in self._fields.keys():
+                params &= Q(**{'%s__icontains' % field: w})
         
         return qs.filter(params)
 
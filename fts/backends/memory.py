@@ -0,0 +1,266 @@
+"In-memory Fts backend"
+import os
+import time
+import bisect
+import threading
+import cPickle as pickle
+from array import array
+from itertools import izip
+
+from fts.backends.base import BaseClass, BaseModel, AnalyzingManager, WEIGHTS
+
+SNAPSHOT_VERSION = 1
+
+class SearchClass(BaseClass):
+    def __init__(self, server, params):
+        self.backend = 'memory'
+
+class MemoryIndex(object):
+    """
+    A process local inverted index: every word maps to its posting list, an array of
+    object ids kept sorted and a parallel array of their weights. The words of each
+    object are also kept, so an object can be reindexed or removed incrementally.
+    """
+    def __init__(self):
+        self.words = {}
+        self.docs = {}
+        self._vocabulary = None # sorted words, for prefix searches
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self.words = {}
+            self.docs = {}
+            self._vocabulary = None
+        finally:
+            self._lock.release()
+
+    def _add(self, pk, word, weight):
+        try:
+            ids, weights = self.words[word]
+        except KeyError:
+            ids, weights = self.words[word] = (array('l'), array('B'))
+            self._vocabulary = None
+        i = bisect.bisect_left(ids, pk)
+        if i < len(ids) and ids[i] == pk:
+            weights[i] = weight
+        else:
+            ids.insert(i, pk)
+            weights.insert(i, weight)
+
+    def _remove(self, pk, word):
+        ids, weights = self.words[word]
+        i = bisect.bisect_left(ids, pk)
+        if i < len(ids) and ids[i] == pk:
+            del ids[i]
+            del weights[i]
+            if not ids:
+                del self.words[word]
+                self._vocabulary = None
+
+    def update(self, pk, item_words):
+        """
+        Makes the postings of object pk match item_words, a dictionary mapping its
+        words to their weight letter; only the postings that changed are touched.
+        """
+        new = dict([(word, WEIGHTS[weight]) for word, weight in item_words.items()])
+        self._lock.acquire()
+        try:
+            old = self.docs.get(pk, {})
+            for word in old:
+                if word not in new:
+                    self._remove(pk, word)
+            for word, weight in new.items():
+                if old.get(word) != weight:
+                    self._add(pk, word, weight)
+            if new:
+                self.docs[pk] = new
+            else:
+                self.docs.pop(pk, None)
+        finally:
+            self._lock.release()
+
+    def remove(self, pk):
+        self.update(pk, {})
+
+    def _prefixed(self, prefix):
+        """
+        Returns the words starting with prefix.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.words)
+        vocabulary = self._vocabulary
+        words = []
+        for i in xrange(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            words.append(vocabulary[i])
+        return words
+
+    def search(self, query_words):
+        """
+        Returns a dictionary mapping the ids of the objects matching all of query_words,
+        a list of (word, exact) tuples (see AnalyzingManager._get_query_words), to their
+        rank: the sum of the weights of each query word (the best one among the words
+        starting with it, if not exact).
+        """
+        self._lock.acquire()
+        try:
+            postings = []
+            for word, exact in query_words:
+                if exact:
+                    words = word in self.words and [word] or []
+                else:
+                    words = self._prefixed(word)
+                postings.append([self.words[w] for w in words])
+            # intersect starting by the shortest posting lists:
+            postings.sort(key=lambda lists: sum([len(ids) for ids, weights in lists]))
+            ranks = None
+            for lists in postings:
+                scores = {}
+                for ids, weights in lists:
+                    for pk, weight in izip(ids, weights):
+                        if (ranks is None or pk in ranks) and weight > scores.get(pk, 0):
+                            scores[pk] = weight
+                if ranks is not None:
+                    for pk in scores:
+                        scores[pk] += ranks[pk]
+                ranks = scores
+                if not ranks:
+                    break
+            return ranks or {}
+        finally:
+            self._lock.release()
+
+    def save(self, path):
+        """
+        Writes a snapshot of the index to path (replacing it atomically).
+        """
+        self._lock.acquire()
+        try:
+            words = dict([(word, (ids.tostring(), weights.tostring())) for word, (ids, weights) in self.words.items()])
+        finally:
+            self._lock.release()
+        tmp = '%s.tmp' % path
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump({ 'version': SNAPSHOT_VERSION, 'itemsize': array('l').itemsize, 'words': words }, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    def load(self, path):
+        """
+        Replaces the contents of the index with the snapshot written to path by save().
+        """
+        f = open(path, 'rb')
+        try:
+            snapshot = pickle.load(f)
+        finally:
+            f.close()
+        if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('itemsize') != array('l').itemsize:
+            raise ValueError, "%s is not a compatible index snapshot" % path
+        words = {}
+        docs = {}
+        for word, (ids, weights) in snapshot['words'].items():
+            ids = array('l', ids)
+            weights = array('B', weights)
+            words[word] = (ids, weights)
+            for pk, weight in izip(ids, weights):
+                docs.setdefault(pk, {})[word] = weight
+        self._lock.acquire()
+        try:
+            self.words = words
+            self.docs = docs
+            self._vocabulary = None
+        finally:
+            self._lock.release()
+
+class SearchManager(AnalyzingManager):
+    """
+    Keeps the index of the model in memory (see MemoryIndex), so searching does not
+    touch the fts tables. The index lives as long as the process: build it with
+    update_index() or load a snapshot saved with save_index(). Given a snapshot path,
+    the index is loaded from it when first used, if it exists.
+    """
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        self.snapshot = kwargs.get('snapshot', None)
+
+    def contribute_to_class(self, cls, name):
+        super(SearchManager, self).contribute_to_class(cls, name)
+        # every model (managers are copied to the subclasses of abstract models) gets its own index
+        self._index = MemoryIndex()
+        self._loaded = False
+
+    def get_index(self):
+        if not self._loaded:
+            self._loaded = True
+            if self.snapshot and os.path.exists(self.snapshot):
+                self._index.load(self.snapshot)
+        return self._index
+
+    def save_index(self, path=None):
+        self.get_index().save(path or self.snapshot)
+
+    def load_index(self, path=None):
+        self._loaded = True
+        self._index.load(path or self.snapshot)
+
+    def _update_index(self, pk, progress=None):
+        """
+        Updates the index of the given instances (removing the ones that no longer
+        exist) or, with pk=None, builds a new index of all of them, walking the table
+        in chunks of chunk_size instances; progress, if given, is called with the last
+        pk indexed and the size of the chunk. A full update returns a dictionary with
+        the number of documents and postings indexed, the seconds taken and the
+        documents per second.
+        """
+        if self.model._meta.abstract:
+            return # skip abstract class updates
+        if pk is not None:
+            if not isinstance(pk, (set,list,tuple)):
+                pk = [pk]
+            index = self.get_index()
+            found = set()
+            for item in self.filter(pk__in=pk):
+                index.update(item.pk, self._get_item_words(item))
+                found.add(item.pk)
+            for missing in set(pk) - found:
+                index.remove(missing)
+            return
+
+        # the new index replaces the current one once complete:
+        index = MemoryIndex()
+        stats = { 'documents': 0, 'postings': 0 }
+        start = time.time()
+        for chunk in self._iter_chunks():
+            for item in chunk:
+                item_words = self._get_item_words(item)
+                index.update(item.pk, item_words)
+                stats['documents'] += 1
+                stats['postings'] += len(item_words)
+            if progress is not None:
+                progress(chunk[-1].pk, len(chunk))
+        self._index = index
+        self._loaded = True
+        stats['seconds'] = time.time() - start
+        stats['documents_per_second'] = stats['documents'] / (stats['seconds'] or 1)
+        return stats
+
+    def _search(self, query, **kwargs):
+        query_words = self._get_query_words(query)
+        if not query_words:
+            return self.get_query_set()
+        ranks = self.get_index().search(query_words)
+        return self._ranked_query_set(ranks, kwargs.get('rank_field'), kwargs.get('limit'))
+
+class SearchableModel(BaseModel):
+    class Meta:
+        abstract = True
+
+    objects = SearchManager()
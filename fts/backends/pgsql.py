@@ -1,15 +1,19 @@
 "Pgsql Fts backend"
+import warnings
 import django
 DJANGO_VERSION = django.VERSION
 from django.db import connection, transaction
 from django.db.models.fields import FieldDoesNotExist
 
 from fts.backends.base import InvalidFtsBackendError
-from fts.backends.base import BaseClass, BaseModel, BaseManager
+from fts.backends.base import BaseClass, BaseModel, BaseManager, get_search_managers
+from fts.loaders import _chunks
+from fts.settings import FTS_PGSQL_TRIGGER
 
 qn = connection.ops.quote_name
 
 from django.db import models
+from django.db.models import get_models
 LANGUAGES = {
     '' : 'simple',
     'da' : 'danish',
@@ -54,10 +58,33 @@ class SearchClass(BaseClass):
         self.backend = 'pgsql'
 
 class SearchManager(BaseManager):
+    resumable = True
+
     def __init__(self, **kwargs):
         super(SearchManager, self).__init__(**kwargs)
         self.language = LANGUAGES[self.language_code]
+        # whether updates leave alone the rows whose vector would not change, so they
+        # are not rewritten (and the table does not bloat) when refreshing it
+        self.skip_unchanged = kwargs.get('skip_unchanged', False)
+        # whether the vectors are computed by a BEFORE INSERT OR UPDATE trigger of the
+        # table (see create_db_objects) instead of being updated when saving
+        self.trigger = kwargs.get('trigger', FTS_PGSQL_TRIGGER)
+        self.updated_on_save = self.trigger
         self._vector_field_cache = None
+        # whether verify has checked the database objects of the manager
+        self._verified = False
+
+    def contribute_to_class(self, cls, name):
+        super(SearchManager, self).contribute_to_class(cls, name)
+        if self.trigger and not cls._meta.abstract:
+            # the fields of the model may not all be there yet
+            models.signals.class_prepared.connect(self._check_trigger_fields, sender=cls, weak=False)
+
+    def _check_trigger_fields(self, sender, **kwargs):
+        columns = [f.name for f in sender._meta.fields]
+        invalid = [getattr(f, '__name__', f) for f in self._fields if callable(f) or f not in columns]
+        if invalid:
+            raise InvalidFtsBackendError("The trigger of %s can only index its own columns, not %s" % (sender._meta.object_name, ', '.join(invalid)))
 
     def _vector_field(self):
         """
@@ -86,7 +113,112 @@ class SearchManager(BaseManager):
         except FieldDoesNotExist:
             return ("setweight(to_tsvector('%s', %%s), '%s')" % (self.language, weight), [field])
 
-    def _update_index_update(self, pk=None):
+    def _db_object_names(self):
+        """
+        Returns the names of the GIN index on the vector column and of the trigger (and
+        its function).
+        """
+        prefix = '%s_%s' % (self.model._meta.db_table, self.vector_field.column)
+        return '%s_gin' % prefix, '%s_update' % prefix
+
+    def _trigger_body(self):
+        clauses = []
+        for field, weight in self._fields.items():
+            column = qn(self.model._meta.get_field(field).column)
+            clauses.append("setweight(to_tsvector('%s', coalesce(NEW.%s,'')), '%s')" % (self.language, column, weight))
+        return '\nBEGIN\n    NEW.%s := %s;\n    RETURN NEW;\nEND\n' % (qn(self.vector_field.column), ' || '.join(clauses))
+
+    def missing_db_objects(self):
+        """
+        Returns the names of the database objects this manager needs that are missing
+        (or outdated, for the trigger function): the GIN index and, with trigger, the
+        trigger and its function.
+        """
+        from fts.indexes import existing_indexes
+        index_name, trigger_name = self._db_object_names()
+        missing = []
+        if index_name not in existing_indexes(self.model._meta.db_table):
+            missing.append(index_name)
+        if self.trigger:
+            cursor = connection.cursor()
+            cursor.execute('SELECT prosrc FROM pg_proc WHERE proname = %s', [trigger_name])
+            row = cursor.fetchone()
+            cursor.execute('SELECT 1 FROM pg_trigger t JOIN pg_class c ON c.oid = t.tgrelid WHERE c.relname = %s AND t.tgname = %s',
+                           [self.model._meta.db_table, trigger_name])
+            # PostgreSQL keeps the body as it was given, compare it regardless of whitespace
+            if row is None or row[0].split() != self._trigger_body().split() or cursor.fetchone() is None:
+                missing.append(trigger_name)
+        return missing
+
+    def verify(self):
+        """
+        Warns (RuntimeWarning) about the missing database objects (see
+        missing_db_objects) and returns their names. Without its trigger the vectors
+        of a manager with trigger are never updated, so searches return stale results.
+        """
+        self._verified = True
+        missing = self.missing_db_objects()
+        if missing:
+            warnings.warn("%s.%s is missing %s, run fts_pgsql --create" % (self.model._meta.object_name, self.name, ', '.join(missing)),
+                          RuntimeWarning)
+        return missing
+
+    def create_sql(self, online=False):
+        """
+        Returns the statements creating the missing database objects (see
+        missing_db_objects), the index without blocking writes if online.
+        """
+        from fts.indexes import create_sql
+        index_name, trigger_name = self._db_object_names()
+        table = self.model._meta.db_table
+        missing = self.missing_db_objects()
+        statements = []
+        if index_name in missing:
+            statements.extend(create_sql(index_name, table, (self.vector_field.column,), online, using='gin'))
+        if trigger_name in missing:
+            statements.append('CREATE OR REPLACE FUNCTION %s() RETURNS trigger AS $$%s$$ LANGUAGE plpgsql' % (qn(trigger_name), self._trigger_body()))
+            statements.append('DROP TRIGGER IF EXISTS %s ON %s' % (qn(trigger_name), qn(table)))
+            statements.append('CREATE TRIGGER %s BEFORE INSERT OR UPDATE ON %s FOR EACH ROW EXECUTE PROCEDURE %s()' % (qn(trigger_name), qn(table), qn(trigger_name)))
+        return statements
+
+    def drop_sql(self):
+        """
+        Returns the statements dropping the GIN index, the trigger and its function.
+        """
+        index_name, trigger_name = self._db_object_names()
+        return ['DROP TRIGGER IF EXISTS %s ON %s' % (qn(trigger_name), qn(self.model._meta.db_table)),
+                'DROP FUNCTION IF EXISTS %s()' % qn(trigger_name),
+                'DROP INDEX IF EXISTS %s' % qn(index_name)]
+
+    def create_db_objects(self, online=False):
+        """
+        Creates the missing database objects (see create_sql). Returns their names.
+        """
+        from fts import indexes
+        missing = self.missing_db_objects()
+        indexes.execute(self.create_sql(online), online)
+        return missing
+
+    def drop_db_objects(self):
+        from fts import indexes
+        indexes.execute(self.drop_sql())
+
+    def _unchanged_sql(self, vector_sql, params):
+        """
+        Returns the condition (and its parameters) leaving out the rows whose vector is
+        already vector_sql, if skip_unchanged.
+        """
+        if not self.skip_unchanged:
+            return '', []
+        return ' AND %s.%s IS DISTINCT FROM (%s)' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql), list(params)
+
+    def _update_index_update(self, pk=None, since_pk=None, progress=None):
+        """
+        Updates the vectors of the given instances, chunk_size of them at a time, or,
+        with pk=None, of the whole table (after since_pk) in ranges of chunk_size pks,
+        committing each chunk or range; progress, if given, is called with the last pk of each
+        range and the number of instances in it.
+        """
         # Build a list of SQL clauses that generate tsvectors for each specified field.
         clauses = []
         params = []
@@ -95,62 +227,111 @@ class SearchManager(BaseManager):
             clauses.append(v[0])
             params.extend(v[1])
         vector_sql = ' || '.join(clauses)
+        unchanged, unchanged_params = self._unchanged_sql(vector_sql, params)
+        pk_column = qn(self.model._meta.pk.column)
+        cursor = connection.cursor()
+        def update(where, where_params):
+            sql = 'UPDATE %s SET %s = %s WHERE %s%s' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql, where, unchanged)
+            cursor.execute(sql, tuple(params + where_params + unchanged_params))
+            transaction.set_dirty()
         
-        where = ''
-        # If one or more pks are specified, tack a WHERE clause onto the SQL.
         if pk is not None:
-            if isinstance(pk, (list,tuple)):
-                ids = ','.join(str(v) for v in pk)
-                where = ' WHERE %s IN (%s)' % (qn(self.model._meta.pk.column), ids)
+            if not isinstance(pk, (list,tuple)):
+                pk = [pk]
+            for pks in _chunks(pk, self.chunk_size):
+                update('%s IN (%s)' % (pk_column, ', '.join(['%s'] * len(pks))), pks)
+                self._commit_chunk()
+            return
+        # Update the whole table one range of pks at a time, committing after each range:
+        ranges = self._pk_ranges(since_pk)
+        for lo, hi in ranges:
+            qs = self.filter(pk__lte=hi)
+            if lo is None:
+                update('%s <= %%s' % pk_column, [hi])
             else:
-                where = ' WHERE %s = %d' % (qn(self.model._meta.pk.column), pk)
-        sql = 'UPDATE %s SET %s = %s%s' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql, where)
-        cursor = connection.cursor()
-        cursor.execute(sql, tuple(params))
-        transaction.set_dirty()
+                update('%s > %%s AND %s <= %%s' % (pk_column, pk_column), [lo, hi])
+                qs = qs.filter(pk__gt=lo)
+            self._commit_chunk()
+            if progress is not None:
+                # every range but the last one has chunk_size instances
+                if (lo, hi) == ranges[-1]:
+                    count = qs.count()
+                else:
+                    count = self.chunk_size
+                progress(hi, count)
 
-    def _update_index_walking(self, pk=None):
+    def _update_index_walking(self, pk=None, since_pk=None, progress=None):
+        """
+        Updates the vectors of the given instances, or of the whole table (after since_pk),
+        chunk_size of them at a time, committing each chunk;
+        progress, if given, is called with the last pk and the size of each chunk.
+        """
         if pk is not None:
-            if isinstance(pk, (list,tuple)):
-                items = self.filter(pk__in=pk)
+            if not isinstance(pk, (list,tuple)):
+                pk = [pk]
+            for pks in _chunks(pk, self.chunk_size):
+                self._update_index_items(list(self.filter(pk__in=pks)))
+                self._commit_chunk()
+            return
+        # Walk the whole table one chunk at a time, committing after each chunk:
+        for items in self._iter_chunks(since_pk):
+            self._update_index_items(items)
+            self._commit_chunk()
+            if progress is not None:
+                progress(items[-1].pk, len(items))
+    
+    def _update_index_items(self, items):
+        """
+        Updates the vectors of items with a single UPDATE ... FROM (VALUES ...) statement:
+        the texts of the callable fields and of the fields spanning relations are computed
+        in Python and sent along with the pks, the other fields are read from the table.
+        """
+        if not items:
+            return
+        clauses = []
+        params = []
+        computed = []
+        for field, weight in self._fields.items():
+            if callable(field) or '__' in field:
+                clauses.append("setweight(to_tsvector('%s', coalesce(fts_values.fts_%d::text,'')), '%s')" % (self.language, len(computed), weight))
+                computed.append(field)
             else:
-                items = self.filter(pk=pk)
-        else:
-            items = self.all()
-        
-        IW = {}
+                v = self._vector_sql(field, weight)
+                clauses.append(v[0])
+                params.extend(v[1])
+        vector_sql = ' || '.join(clauses)
+        unchanged, unchanged_params = self._unchanged_sql(vector_sql, params)
+        rows = []
         for item in items:
-            clauses = []
-            params = []
-            for field, weight in self._fields.items():
+            rows.append('(%s)' % ', '.join(['%s'] * (len(computed) + 1)))
+            params.append(item.pk)
+            for field in computed:
                 if callable(field):
                     words = field(item)
-                elif '__' in field:
+                else:
                     words = item
                     for col in field.split('__'):
                         words = getattr(words, col)
-                else:
-                    words = field
-                v = self._vector_sql(words, weight)
-                clauses.append(v[0])
-                params.extend(v[1])
-            vector_sql = ' || '.join(clauses)
-            sql = 'UPDATE %s SET %s = %s WHERE %s = %d' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql, qn(self.model._meta.pk.column), item.pk)
-            cursor = connection.cursor()
-            cursor.execute(sql, tuple(params))
+                params.append(words)
+        columns = ', '.join(['fts_pk'] + ['fts_%d' % i for i in range(len(computed))])
+        table = qn(self.model._meta.db_table)
+        sql = 'UPDATE %s SET %s = %s FROM (VALUES %s) AS fts_values (%s) WHERE %s.%s = fts_values.fts_pk%s' % (table,
+            qn(self.vector_field.column), vector_sql, ', '.join(rows), columns, table, qn(self.model._meta.pk.column), unchanged)
+        cursor = connection.cursor()
+        cursor.execute(sql, tuple(params + unchanged_params))
         transaction.set_dirty()
     
     @transaction.commit_on_success
-    def _update_index(self, pk=None):
+    def _update_index(self, pk=None, since_pk=None, progress=None):
         index_walking = False
         for field, weight in self._fields.items():
             if callable(field) or '__' in field:
                 index_walking = True
                 break
         if index_walking:
-            self._update_index_walking(pk)
+            self._update_index_walking(pk, since_pk, progress)
         else:
-            self._update_index_update(pk)
+            self._update_index_update(pk, since_pk, progress)
     
     def _search(self, query, **kwargs):
         """
@@ -161,6 +342,9 @@ class SearchManager(BaseManager):
         For possible rank_normalization values, refer to:
         http://www.postgresql.org/docs/8.3/static/textsearch-controls.html#TEXTSEARCH-RANKING
         """
+        if self.trigger and not self._verified:
+            # once per process: with its trigger missing, the results would be stale
+            self.verify()
         rank_field = kwargs.get('rank_field')
         rank_normalization = kwargs.get('rank_normalization', 32)
         qs = self.get_query_set()
@@ -176,6 +360,18 @@ class SearchManager(BaseManager):
         
         return qs.extra(select=select, where=[where], order_by=order)
 
+def get_managers(models=None):
+    """
+    Returns the pgsql managers of the given models (of all the installed ones by default).
+    """
+    if models is None:
+        models = get_models()
+    managers = []
+    for model in models:
+        if not model._meta.abstract:
+            managers.extend([sm for sm in get_search_managers(model) if isinstance(sm, SearchManager) and sm.model is model])
+    return managers
+
 class SearchableModel(BaseModel):
     class Meta:
         abstract = True
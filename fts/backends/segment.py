@@ -0,0 +1,108 @@
+"Segment Fts backend"
+import os
+import time
+
+from fts.backends.base import BaseClass, BaseModel, AnalyzingManager, InvalidFtsBackendError, WEIGHTS
+from fts.segments import SegmentIndex
+from fts.settings import FTS_SEGMENT_DIR, FTS_SEGMENT_MERGE_FACTOR, FTS_SEGMENT_BUFFER_SIZE
+
+# the directory of the indexes of the managers without a directory of their own:
+# the path of the segment:// backend URI or else FTS_SEGMENT_DIR
+_SEGMENT_DIR = FTS_SEGMENT_DIR
+
+class SearchClass(BaseClass):
+    def __init__(self, server, params):
+        global _SEGMENT_DIR
+        self.backend = 'segment'
+        # segment:///var/lib/fts (or segment://?directory=/var/lib/fts)
+        self.directory = params.get('directory', server) or FTS_SEGMENT_DIR
+        _SEGMENT_DIR = self.directory
+
+class SearchManager(AnalyzingManager):
+    """
+    Keeps the index of the model in its own directory of on-disk segments (see
+    fts.segments), by default <app label>.<model>.<manager name> in the path of the
+    segment:// URI (or FTS_SEGMENT_DIR), so searching does not touch the database
+    until the matching instances are fetched by primary key.
+    """
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        self.directory = kwargs.get('directory', None)
+        self.merge_factor = kwargs.get('merge_factor', FTS_SEGMENT_MERGE_FACTOR)
+        self.background_merge = kwargs.get('background_merge', True)
+
+    def contribute_to_class(self, cls, name):
+        super(SearchManager, self).contribute_to_class(cls, name)
+        # every model (managers are copied to the subclasses of abstract models) gets its own index
+        self._index = None
+
+    def get_index(self):
+        if self._index is None:
+            directory = self.directory
+            if directory is None:
+                if not _SEGMENT_DIR:
+                    raise InvalidFtsBackendError, "The segment backend needs a directory: segment:///path, FTS_SEGMENT_DIR or one for each manager"
+                opts = self.model._meta
+                directory = os.path.join(_SEGMENT_DIR, '%s.%s.%s' % (opts.app_label, opts.module_name, self.name))
+            self._index = SegmentIndex(directory, self.merge_factor, self.background_merge)
+        return self._index
+
+    def _get_doc(self, item):
+        return dict([(word, WEIGHTS[weight]) for word, weight in self._get_item_words(item).items()])
+
+    def _update_index(self, pk, progress=None):
+        """
+        Writes the given instances to a new segment (deleting the ones that no longer
+        exist) or, with pk=None, replaces the index with a new one built walking the
+        table in chunks of chunk_size instances, writing a segment every
+        FTS_SEGMENT_BUFFER_SIZE postings; progress, if given, is called with the last
+        pk indexed and the size of the chunk. A full update returns a dictionary with
+        the number of documents and postings indexed, the seconds taken and the
+        documents per second.
+        """
+        if self.model._meta.abstract:
+            return # skip abstract class updates
+        if pk is not None:
+            if not isinstance(pk, (set,list,tuple)):
+                pk = [pk]
+            docs = {}
+            for item in self.filter(pk__in=pk):
+                docs[item.pk] = self._get_doc(item)
+            self.get_index().write(docs, [p for p in pk if p not in docs])
+            return
+
+        stats = { 'documents': 0, 'postings': 0 }
+        start = time.time()
+        def batches():
+            docs = {}
+            postings = 0
+            for chunk in self._iter_chunks():
+                for item in chunk:
+                    doc = docs[item.pk] = self._get_doc(item)
+                    postings += len(doc)
+                    stats['documents'] += 1
+                    stats['postings'] += len(doc)
+                if postings >= FTS_SEGMENT_BUFFER_SIZE:
+                    yield docs
+                    docs = {}
+                    postings = 0
+                if progress is not None:
+                    progress(chunk[-1].pk, len(chunk))
+            yield docs
+        self.get_index().rebuild(batches())
+        stats['seconds'] = time.time() - start
+        stats['documents_per_second'] = stats['documents'] / (stats['seconds'] or 1)
+        return stats
+
+    def _search(self, query, **kwargs):
+        query_words = self._get_query_words(query)
+        if not query_words:
+            return self.get_query_set()
+        ranks = self.get_index().search(query_words)
+        return self._ranked_query_set(ranks, kwargs.get('rank_field'), kwargs.get('limit'))
+
+class SearchableModel(BaseModel):
+    class Meta:
+        abstract = True
+
+    objects = SearchManager()
@@ -1,99 +1,281 @@
 "Simple Fts backend"
 import re
 import os
+import sys
+import math
+import time
 import datetime
+import threading
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
-from django.db import connection, transaction
-from django.db.models import Q, Max
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q, Max, Sum, get_model
 from django.core.cache import cache
 
-# Fixes http://code.google.com/p/django-fts/issues/detail?id=7
-# Using http://djangosnippets.org/snippets/1725/
-# So we'll no longer use
-# from snippets.decorators import commit_on_success_unless_managed
-
-from fts.backends.base import BaseClass, BaseModel, BaseManager
-from fts.models import Word, Index, Namespace
-
-import unicodedata
-from fts.words.stop import FTS_STOPWORDS
-try:
-    from fts.words.snowball import Stemmer
-except ImportError:
-    from fts.words.porter import Stemmer
+from fts.backends.base import BaseClass, BaseModel, AnalyzingManager, WEIGHTS, commit_on_success_unless_managed
+from fts.models import Word, Index, Namespace, WordStat, IndexStat, DocumentLength
+from fts.settings import FTS_BATCH_SIZE, FTS_JOIN_DF_LIMIT, FTS_PREFIX_EXPANSIONS, FTS_BM25_K1, FTS_BM25_B, \
+     FTS_WORD_ID_CACHE_SIZE, FTS_WORD_ID_CACHE_WARM, FTS_VACUUM_BATCH_SIZE
+from fts.loaders import FileLoader, get_loader, bulk_insert, _chunks, MAX_PARAMS, ENGINE
+from fts.words.analyzer import SEP
+from fts.lru import LRUCache
 
 qn = connection.ops.quote_name
 
-WEIGHTS = {
-    'A' : 10,
-    'B' : 4,
-    'C' : 2,
-    'D' : 1
-}
-SEP = re.compile(r'[\s,.()\[\]|]')
-
 _NAMESPACES_CACHE = {}
 _NAMESPACES_CACHE_SYNC = {}
 
-try:
-    from functools import wraps
-except ImportError:
-    from django.utils.functional import wraps  # Python 2.3, 2.4 fallback.
+# Word ids never change, so they are cached for the whole process (see _cache_word_ids),
+# until vacuum deletes words (see _check_word_ids):
+_WORD_IDS = LRUCache(FTS_WORD_ID_CACHE_SIZE)
+_WORD_IDS_WARMED = []
+_WORD_IDS_SYNC = {}
+_WORD_IDS_LOCAL = threading.local()
 
-def commit_on_success_unless_managed(func):
+def _range_scope(lo, hi):
     """
-    If the decorated function runs successfully, a commit is made, unless the
-    transactions are being managed; if the function produces an exception,
-    a rollback is made, again unless transactions are being managed somewhere
-    else.
+    Returns the scope (see SearchManager._write_postings) of the objects with lo < pk <= hi,
+    either bound being optional.
     """
-    def _commit_on_success_unless_managed(*args, **kw):
-        try:
-            if transaction.is_managed():
-                forced_managed = False
-            else:
-                transaction.enter_transaction_management()
-                forced_managed = True
-            
+    where = []
+    params = []
+    if lo is not None:
+        where.append('object_id > %s')
+        params.append(lo)
+    if hi is not None:
+        where.append('object_id <= %s')
+        params.append(hi)
+    return ' AND '.join(where) or '1 = 1', params
+
+def _open_pool(processes):
+    """
+    Returns a pool of processes to analyze instances. Pending work is committed and
+    the database connection closed first, so no worker shares the parent's connection.
+    """
+    import multiprocessing
+    if transaction.is_dirty():
+        transaction.commit()
+    connection.close()
+    return multiprocessing.Pool(processes)
+
+def _analyze_range(args):
+    """
+    Pool worker: analyzes the instances with lo < pk <= hi of a model's search manager.
+    """
+    app_label, object_name, manager_name, lo, hi = args
+    manager = getattr(get_model(app_label, object_name), manager_name)
+    items = manager.get_query_set().filter(pk__lte=hi).order_by('pk')
+    if lo is not None:
+        items = items.filter(pk__gt=lo)
+    return hi, [(item.pk,) + manager._get_item_terms(item) for item in items.iterator()]
+
+def _prefix_range(prefix):
+    """
+    Returns the bounds of the words starting with prefix, prefix <= word < end, as
+    (prefix, end); end is None if there is no upper bound.
+    """
+    prefix = unicode(prefix)
+    while prefix and ord(prefix[-1]) == sys.maxunicode:
+        prefix = prefix[:-1]
+    if not prefix:
+        return prefix, None
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+def _created_words():
+    """
+    Returns the set of the words created by the transaction of this thread, if still
+    open: until committed their ids could be rolled back, so they are not cached.
+    """
+    created = getattr(_WORD_IDS_LOCAL, 'created', None)
+    if created is None or not transaction.is_dirty():
+        created = _WORD_IDS_LOCAL.created = set()
+    return created
+
+def _cache_word_ids(ids):
+    """
+    Adds ids, a dictionary mapping words to their Word id, to the process wide cache.
+    """
+    created = _created_words()
+    for word, id in ids.items():
+        if word not in created:
+            _WORD_IDS.set(word, id)
+
+def _words_deleted():
+    """
+    Tells every process (sharing Django's cache) that words were deleted, so they
+    empty their word id cache (see _check_word_ids).
+    """
+    cache.set('fts-words-last-deleted', datetime.datetime.now())
+
+def _check_word_ids():
+    """
+    Empties the process wide word id cache if words were deleted (by vacuum, in any
+    process) since it was last checked: their ids must not be used any more.
+    """
+    last_deleted = cache.get('fts-words-last-deleted')
+    if last_deleted != _WORD_IDS_SYNC.get('last-deleted'):
+        _WORD_IDS.clear()
+        del _WORD_IDS_WARMED[:]
+        _WORD_IDS_SYNC['last-deleted'] = last_deleted
+
+def warm_word_ids(count=None):
+    """
+    Loads the ids of the count (by default FTS_WORD_ID_CACHE_WARM) words indexed for
+    the most objects into the process wide cache, e.g. when the process starts.
+    """
+    if count is None:
+        count = FTS_WORD_ID_CACHE_WARM
+    _WORD_IDS_WARMED.append(True)
+    if count:
+        _cache_word_ids(dict(Word.objects.order_by('-doc_count').values_list('word', 'id')[:count]))
+
+def word_ids_stats():
+    """
+    Returns the statistics of the process wide word id cache.
+    """
+    return _WORD_IDS.stats()
+
+def _stats_delta(c, content_type_id, namespace_id):
+    """
+    Returns the changes to the statistics (see fts.models.WordStat and IndexStat) of
+    a content type and namespace accumulated in the dumping context c.
+    """
+    stats = c.setdefault('stats', {})
+    try:
+        return stats[(content_type_id, namespace_id)]
+    except KeyError:
+        delta = stats[(content_type_id, namespace_id)] = { 'words': {}, 'documents': 0, 'postings': 0, 'length': 0 }
+        return delta
+
+def _stats_where(content_type_id, namespace_id):
+    # the statistics keep no namespace as 0, not NULL (see fts.models.WordStat)
+    return 'content_type_id = %s AND namespace_id = %s', [content_type_id, namespace_id or 0]
+
+def _insert_or_update(table, columns, rows, update):
+    """
+    Inserts rows (tuples of values for columns) into table under a savepoint. If some
+    of them were inserted by another transaction meanwhile (the unique constraint of
+    the table fails), each row is instead updated with update, a function given the
+    row and returning the number of rows it updated, or inserted if still missing.
+    """
+    sid = transaction.savepoint()
+    try:
+        bulk_insert(table, columns, rows)
+    except IntegrityError:
+        # Some of the rows were created concurrently, go the slow way:
+        transaction.savepoint_rollback(sid)
+        for row in rows:
+            if update(row):
+                continue
+            sid = transaction.savepoint()
             try:
-                res = func(*args, **kw)
-            except:
-                # All exceptions must be handled here (even string ones).
-                if transaction.is_dirty():
-                    if forced_managed:
-                        transaction.rollback()
-                    else:
-                        transaction.rollback_unless_managed()
-                raise
+                bulk_insert(table, columns, [row])
+            except IntegrityError:
+                # inserted (and committed) by another transaction since the update
+                transaction.savepoint_rollback(sid)
+                update(row)
             else:
-                if transaction.is_dirty():
-                    if forced_managed:
-                        transaction.commit()
-                    else:
-                        transaction.commit_unless_managed()
-            return res
-        finally:
-            if forced_managed:
-                transaction.leave_transaction_management()
-    return wraps(func)(_commit_on_success_unless_managed)
+                transaction.savepoint_commit(sid)
+    else:
+        transaction.savepoint_commit(sid)
+
+def _apply_stats(stats):
+    """
+    Adds stats, a dictionary mapping (content type id, namespace id) tuples to the
+    changes in their number of 'documents', 'postings' and words ('length') and in
+    the number of documents of each word id ('words'), to the statistics tables and
+    Word.doc_count. The existing rows are updated in place, the missing ones inserted
+    (see _insert_or_update).
+    """
+    cursor = connection.cursor()
+    word_table = qn(Word._meta.db_table)
+    stat_table = qn(WordStat._meta.db_table)
+    index_stat_table = qn(IndexStat._meta.db_table)
+    for (content_type_id, namespace_id), delta in stats.items():
+        where, params = _stats_where(content_type_id, namespace_id)
+        by_count = {}
+        for word_id, count in delta['words'].items():
+            if count:
+                by_count.setdefault(count, []).append(word_id)
+        for count, word_ids in by_count.items():
+            def update_word_stat(row):
+                cursor.execute('UPDATE %s SET doc_count = doc_count + %%s WHERE %s AND word_id = %%s' % (stat_table, where), [count] + params + [row[0]])
+                return cursor.rowcount
+            for chunk in _chunks(word_ids, MAX_PARAMS - 3):
+                ids = ', '.join(['%s'] * len(chunk))
+                cursor.execute('UPDATE %s SET doc_count = doc_count + %%s WHERE id IN (%s)' % (word_table, ids), [count] + chunk)
+                cursor.execute('SELECT word_id FROM %s WHERE %s AND word_id IN (%s)' % (stat_table, where, ids), params + chunk)
+                found = set([row[0] for row in cursor.fetchall()])
+                if found:
+                    cursor.execute('UPDATE %s SET doc_count = doc_count + %%s WHERE %s AND word_id IN (%s)' % (stat_table, where, ', '.join(['%s'] * len(found))), [count] + params + list(found))
+                new = [(word_id,) + tuple(params) + (count,) for word_id in chunk if word_id not in found]
+                if new:
+                    _insert_or_update(WordStat._meta.db_table, ('word_id', 'content_type_id', 'namespace_id', 'doc_count'), new, update_word_stat)
+        if delta['documents'] or delta['postings'] or delta['length']:
+            values = [delta['documents'], delta['postings'], delta['length']]
+            def update_index_stat(row=None):
+                cursor.execute('UPDATE %s SET documents = documents + %%s, postings = postings + %%s, length = length + %%s WHERE %s' % (index_stat_table, where), values + params)
+                return cursor.rowcount
+            if not update_index_stat():
+                _insert_or_update(IndexStat._meta.db_table, ('content_type_id', 'namespace_id', 'documents', 'postings', 'length'),
+                                  [tuple(params + values)], update_index_stat)
+    transaction.set_dirty()
+
+def _postings_where(scope, content_type_id, namespace_id):
+    """
+    Returns the condition (and its parameters) on the postings (or lengths) of the
+    objects in scope of a content type and namespace.
+    """
+    where = ['content_type_id = %s']
+    params = [content_type_id]
+    if namespace_id is None:
+        where.append('namespace_id IS NULL')
+    else:
+        where.append('namespace_id = %s')
+        params.append(namespace_id)
+    where.append(scope[0])
+    params.extend(scope[1])
+    return ' AND '.join(where), params
+
+def _delete_postings(scope, c, content_type_id, namespace_id):
+    """
+    Deletes the postings (and lengths) of the objects in scope, discounting them
+    from the statistics to be written when the dumping context c is finished.
+    """
+    index_table = qn(Index._meta.db_table)
+    length_table = qn(DocumentLength._meta.db_table)
+    where, params = _postings_where(scope, content_type_id, namespace_id)
+    cursor = connection.cursor()
+    stats = _stats_delta(c, content_type_id, namespace_id)
+    words = stats['words']
+    cursor.execute('SELECT word_id, COUNT(*) FROM %s WHERE %s GROUP BY word_id' % (index_table, where), params)
+    for word_id, count in cursor.fetchall():
+        words[word_id] = words.get(word_id, 0) - count
+        stats['postings'] -= count
+    cursor.execute('SELECT COUNT(DISTINCT object_id) FROM %s WHERE %s' % (index_table, where), params)
+    stats['documents'] -= cursor.fetchone()[0]
+    cursor.execute('SELECT COALESCE(SUM(length), 0) FROM %s WHERE %s' % (length_table, where), params)
+    stats['length'] -= cursor.fetchone()[0]
+    cursor.execute('DELETE FROM %s WHERE %s' % (index_table, where), params)
+    cursor.execute('DELETE FROM %s WHERE %s' % (length_table, where), params)
+    transaction.set_dirty()
 
 class SearchClass(BaseClass):
     def __init__(self, server, params):
         self.backend = 'simple'
 
-class SearchManager(BaseManager):
+class SearchManager(AnalyzingManager):
+    resumable = True
+    dumpable = True
+
     def __init__(self, **kwargs):
         super(SearchManager, self).__init__(**kwargs)
-        # For autocomplete, generally you'd want:
-        #   full_index=True and stem_words=False (full_index implies exact_search)
-        # For regular Fulltext search, you'd want:
-        #   full_index=False, steam_words=True and exact_search=True
-        self.full_index = kwargs.get('full_index', False)
-        self.stem_words = kwargs.get('stem_words', True)
-        self.exact_search = kwargs.get('exact_search', True)
         self.namespace = kwargs.get('namespace', None)
+        self.batch_size = kwargs.get('batch_size', FTS_BATCH_SIZE)
+        # 'weights' ranks by the sum of the weights of the words found, 'bm25' by their
+        # BM25 score (term frequency, document length and rarity), boosted by their weights
+        self.ranking = kwargs.get('ranking', 'weights')
 
     def _get_namespace_id(self, namespace):
         _k_ = namespace
@@ -127,167 +309,539 @@ class SearchManager(BaseManager):
 
         return namespace_id
 
-    def _get_idx_words(self, line, minlen=0):
-        words = self._get_words(line, minlen)
-        if self.full_index:
-            # Find all the substrings of the word (all digit words treated differently):
-            words = set( word[i:j] for word in words for i in not word.isdigit() and range(len(word)) or (0,) for j in range(i+1, len(word)+1) if j-i > minlen )
-        return words
-    
-    def _get_words(self, line, minlen=0):
-        # Remove accents
-        line = ''.join((c for c in unicodedata.normalize('NFD', unicode(line)) if unicodedata.category(c) != 'Mn'))
-        # Lowercase and split in a set of words
-        words = set(SEP.split(line.lower()))
-        # Stemmer function
-        if self.stem_words:
-            stem = Stemmer(self.language_code)
-        else:
-            stem = lambda w: w
-        # Get stemmed set of words not in the list of stop words and with a minimum of a minlen length
-        return set( stem(word) for word in words if word and word not in FTS_STOPWORDS[self.language_code] and len(word) > minlen and len(word) <= 100)
-        
     @commit_on_success_unless_managed
-    def _update_index(self, pk, dumping=None):
+    def _update_index(self, pk, dumping=None, since_pk=None, progress=None, processes=None):
         """
             Index Update (Live or Dumping)
             For Dumping update (recommended method):
+                dump_indexes([Entity.autocomplete, GeonameAlternateName.autocomplete,
+                              TagLabel.autocomplete])
+                rebuilds the indexes of all the managers sharing one dumping context,
+                loading the rows straight into the database (see fts.loaders).
+                The context can also be passed by hand:
                 dumping = {}  # use to pass and keep context for multiple calls
                 Entity.autocomplete._update_index(None, dumping)
-                GeonameAlternateName.autocomplete._update_index(None, dumping)
                 TagLabel.autocomplete._update_index(None, dumping)
-                then in Sqlite3:
+                finish_dumping(dumping)
+                with no 'loader' in dumping, fts_word.txt and fts_index.txt are written
+                to the current directory, then in Sqlite3:
                     .separator "\t"
                     .import fts_word.txt fts_word
                     .import fts_index.txt fts_index
                 ...or in PostgreSQL:
                     COPY fts_word FROM 'fts_word.txt';
                     COPY fts_index FROM 'fts_index.txt';
-            For Live update (very slow compared to dumping update):
+            For Live update (only the postings that changed are written, in bulk
+            every batch_size items):
                 TagLabel.autocomplete.update_index()
+            When updating all the instances (pk=None) the table is walked in chunks
+            of chunk_size instances, committing after each chunk. progress, if given,
+            is called with the last pk committed and the size of the chunk; pass that
+            pk as since_pk to resume an interrupted update.
+            With processes, the chunks are analyzed by a pool of that many processes
+            (pending work is committed and the connection closed before forking):
+                TagLabel.autocomplete.update_index(processes=8)
+            A dumping context passed by hand must bring its own 'pool' instead, as
+            opening one would commit the dump part-way through (see dump_indexes).
+            A full update returns a dictionary with the number of documents and
+            postings written, the seconds taken and the documents per second.
             Usage:
                 TagLabel.autocomplete.search('label')
         """
         if self.model._meta.abstract:
             return # skip abstract class updates
+        if processes and dumping is not None and dumping.get('pool') is None:
+            raise ValueError, "A dumping update can only use processes with the context's pool (see dump_indexes)"
         namespace_id = self._get_namespace_id(self.namespace)
         if not namespace_id and self.namespace:
             ns = Namespace.objects.create(slug=self.namespace)
             namespace_id = ns.id
         ctype = ContentType.objects.get_for_model(self.model)
-        filter = { 'content_type__pk': ctype.pk }
-        if namespace_id: filter['namespace'] = namespace_id
-        if pk is not None:
-            if isinstance(pk, (set,list,tuple)):
-                filter['object_id__in'] = pk
-                items = self.filter(pk__in=pk)
-            else:
-                filter['object_id'] = pk
-                items = self.filter(pk=pk)
-        else:
-            items = self.all()
-        cursor = connection.cursor()
-        cursor.execute('DELETE FROM'+str(Index.objects.filter(**filter).query).split('FROM')[1])
-        transaction.set_dirty()
         if dumping is None:
             c = { 'IW': {} }
         else:
             c = dumping
-            c['fw'] = c.get('fw') or open('fts_word.txt', 'wt')
-            c['fi'] = c.get('fi') or open('fts_index.txt', 'wt')
+            if not c.get('loader'):
+                c['loader'] = FileLoader()
+                c['loader'].open([Word, Index, DocumentLength])
             c['IW'] = c.get('IW')
             if not c['IW']:
                 c['IW'] = {}
                 c['widx'] = 0
                 c['iidx'] = (Index.objects.aggregate(Max('id'))['id__max'] or 0) + 1
-                for iw in Word.objects.all():
-                    if iw.id > c['widx']:
-                        c['widx'] = iw.id
-                    c['IW'][iw.word] = iw.id
+                c['didx'] = (DocumentLength.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+                for word, id in Word.objects.values_list('word', 'id').iterator():
+                    if id > c['widx']:
+                        c['widx'] = id
+                    c['IW'][word] = id
                 c['widx'] += 1
-        for item in items:
-            item_words = {}
-            for field, weight in self._fields.items():
-                if callable(field):
-                    words = field(item)
-                else:
-                    words = item
-                    for col in field.split('__'):
-                        words = getattr(words, col)
-                # get all the possible substrings for words
-                idx_words = self._get_idx_words(words)
-                if dumping is None:
-                    # of all those substrings, retrieve the missing ones in our c['IW'] dictionary
-                    idx_words_to_get = [w for w in idx_words if w not in c['IW']]
-                if len(idx_words_to_get):
-                    for iw in Word.objects.filter(word__in=idx_words_to_get):
-                            c['IW'][iw.word] = iw
-                # finally, for each substring to index, build the index in item_words:
-                for word in idx_words:
-                    try:
-                        iw = c['IW'][word];
-                    except KeyError:
-                        if dumping is not None:
-                            print >>c['fw'], u'\t'.join([unicode(w) or '' for w in (c['widx'], word)]).encode('utf8')
-                            iw = c['IW'][word] = c['widx']
-                            c['widx'] += 1
-                        else:
-                            iw = Word.objects.get_or_create(word=word)[0]
-                            c['IW'][word] = iw
-                    if ord(weight) < ord(item_words.get(iw, 'Z')):
-                        item_words[iw] = weight
-            for iw, weight in item_words.items():
+        if pk is not None:
+            if not isinstance(pk, (set,list,tuple)):
+                pk = [pk]
+            for pks in _chunks(pk, self.batch_size):
+                batch = [(item.pk,) + self._get_item_terms(item) for item in self.filter(pk__in=pks)]
+                scope = ('object_id IN (%s)' % ', '.join(['%s'] * len(pks)), pks)
                 if dumping is not None:
-                    print >>c['fi'], u'\t'.join([unicode(w) or '' for w in (c['iidx'], iw, WEIGHTS[weight], namespace_id, ctype.pk, item.pk)]).encode('utf8')
-                    c['iidx'] += 1
+                    _delete_postings(scope, c, ctype.pk, namespace_id)
+                self._write_postings(batch, scope, c, dumping, ctype.pk, namespace_id)
+            if dumping is not None:
+                c['loader'].flush()
+            return
+
+        # Walk the whole table one chunk (range of primary keys) at a time, analyzing
+        # the instances here or, given a process pool, in the pool's workers:
+        pool = c.get('pool')
+        if processes and pool is None:
+            pool = _open_pool(processes)
+        if pool is not None:
+            chunks = self._analyze_parallel(pool, since_pk)
+        else:
+            chunks = self._analyze_chunks(since_pk)
+        if dumping is not None:
+            # a dumping update replaces all the postings at once, in one transaction:
+            _delete_postings(_range_scope(since_pk, None), c, ctype.pk, namespace_id)
+        stats = { 'documents': 0, 'postings': 0 }
+        start = time.time()
+        last_pk = since_pk
+        try:
+            for hi, pairs in chunks:
+                batches = list(_chunks(pairs, self.batch_size)) or [[]]
+                for i, batch in enumerate(batches):
+                    if i < len(batches) - 1:
+                        scope = _range_scope(last_pk, batch[-1][0])
+                        last_pk = batch[-1][0]
+                    else:
+                        scope = _range_scope(last_pk, hi)
+                        last_pk = hi
+                    self._write_postings(batch, scope, c, dumping, ctype.pk, namespace_id)
+                    stats['documents'] += len(batch)
+                    stats['postings'] += sum([len(item_words) for pk, item_words, tf, length in batch])
+                if dumping is None:
+                    self._commit_chunk()
+                if progress is not None:
+                    progress(last_pk, len(pairs))
+        finally:
+            if pool is not None and pool is not c.get('pool'):
+                pool.terminate()
+        if dumping is None:
+            # the postings of objects past the last one are stale:
+            self._write_postings([], _range_scope(last_pk, None), c, dumping, ctype.pk, namespace_id)
+        else:
+            c['loader'].flush()
+        stats['seconds'] = time.time() - start
+        stats['documents_per_second'] = stats['documents'] / (stats['seconds'] or 1)
+        return stats
+
+    def _analyze_chunks(self, since_pk=None):
+        """
+        Yields (last pk, [(pk, item_words, tf, length), ...]) for every chunk of instances
+        (see _get_item_terms).
+        """
+        for chunk in self._iter_chunks(since_pk):
+            yield chunk[-1].pk, [(item.pk,) + self._get_item_terms(item) for item in chunk]
+
+    def _analyze_parallel(self, pool, since_pk=None):
+        """
+        Like _analyze_chunks, but each range of pks is analyzed by a worker of pool.
+        Results come back in pk order, so they are written (and word ids allocated)
+        by this process only.
+        """
+        opts = self.model._meta
+        tasks = [(opts.app_label, opts.object_name, self.name, lo, hi) for lo, hi in self._pk_ranges(since_pk)]
+        for hi, pairs in pool.imap(_analyze_range, tasks):
+            yield hi, pairs
+
+    def _write_postings(self, batch, scope, c, dumping, content_type_id, namespace_id):
+        """
+        Writes the postings of batch, a list of (pk, item_words, tf, length) tuples. A live update
+        makes the postings stored for the objects in scope (a tuple with an SQL
+        condition on object_id and its parameters) match batch; a dumping update
+        adds the rows to the dumping context's loader, allocating the ids of new words
+        from the context.
+        """
+        if dumping is None:
+            self._sync_postings(batch, scope, c['IW'], content_type_id, namespace_id)
+            return
+        loader = c['loader']
+        stats = _stats_delta(c, content_type_id, namespace_id)
+        words = stats['words']
+        for pk, item_words, tf, length in batch:
+            for word, weight in item_words.items():
+                try:
+                    iw = c['IW'][word]
+                except KeyError:
+                    loader.add(Word, (c['widx'], word, 0))
+                    iw = c['IW'][word] = c['widx']
+                    c['widx'] += 1
+                loader.add(Index, (c['iidx'], iw, WEIGHTS[weight], namespace_id, content_type_id, pk, tf[word]))
+                c['iidx'] += 1
+                words[iw] = words.get(iw, 0) + 1
+            if item_words:
+                loader.add(DocumentLength, (c['didx'], namespace_id, content_type_id, pk, length))
+                c['didx'] += 1
+                stats['documents'] += 1
+                stats['postings'] += len(item_words)
+                stats['length'] += length
+
+    def _get_word_ids(self, words, iw):
+        """
+        Returns a dictionary mapping each of words to its Word id. Ids already in the iw
+        dictionary are reused, the rest are found with _find_word_ids and the ones still
+        missing are created in bulk. iw is updated with the new ids.
+        """
+        ids = {}
+        missing = []
+        for word in words:
+            try:
+                ids[word] = iw[word]
+            except KeyError:
+                missing.append(word)
+        if missing:
+            found = self._find_word_ids(missing)
+            new = [w for w in missing if w not in found]
+            if new:
+                transaction.set_dirty()
+                _created_words().update(new)
+                sid = transaction.savepoint()
+                try:
+                    bulk_insert(Word._meta.db_table, ('word',), [(w,) for w in new])
+                except IntegrityError:
+                    # Some of the words were created concurrently, go the slow way:
+                    transaction.savepoint_rollback(sid)
+                    for w in new:
+                        found[w] = Word.objects.get_or_create(word=w)[0].id
                 else:
-                    Index.objects.create(content_object=item, word=iw, weight=WEIGHTS[weight], namespace_id=namespace_id)
+                    transaction.savepoint_commit(sid)
+                    found.update(self._lookup_word_ids(new))
+            iw.update(found)
+            ids.update(found)
+        return ids
+
+    def _find_word_ids(self, words):
+        """
+        Returns a dictionary mapping those of words with a Word row to their id, taken
+        from the process wide cache or looked up (and cached).
+        """
+        _check_word_ids()
+        if not _WORD_IDS_WARMED:
+            warm_word_ids()
+        ids = {}
+        missing = []
+        for word in words:
+            id = _WORD_IDS.get(word)
+            if id is None:
+                missing.append(word)
+            else:
+                ids[word] = id
+        if missing:
+            found = self._lookup_word_ids(missing)
+            _cache_word_ids(found)
+            ids.update(found)
+        return ids
+
+    def _lookup_word_ids(self, words):
+        found = {}
+        for chunk in _chunks(words, MAX_PARAMS):
+            found.update(Word.objects.filter(word__in=chunk).values_list('word', 'id'))
+        return found
+
+    def _sync_postings(self, batch, scope, iw, content_type_id, namespace_id):
+        """
+        Makes the postings (and lengths) stored for the objects in scope match the
+        (pk, item_words, tf, length) tuples in batch. Instead of deleting and reinserting
+        all of them, the stored postings are read back and only the ones that differ are
+        deleted, inserted or have their weight and term frequency updated. Objects in
+        scope missing from batch lose all their postings.
+        """
+        words = set()
+        for pk, item_words, tf, length in batch:
+            words.update(item_words)
+        ids = self._get_word_ids(words, iw)
+        postings = {}
+        for pk, item_words, tf, length in batch:
+            for word, weight in item_words.items():
+                postings[(pk, ids[word])] = (WEIGHTS[weight], tf[word])
+
+        index_table = qn(Index._meta.db_table)
+        where, params = _postings_where(scope, content_type_id, namespace_id)
+        cursor = connection.cursor()
+        cursor.execute('SELECT id, object_id, word_id, weight, tf FROM %s WHERE %s' % (index_table, where), params)
+        deletes = []
+        updates = {}
+        stats = { 'words': {}, 'documents': 0, 'postings': len(postings) }
+        words = stats['words']
+        documents = set()
+        for id, object_id, word_id, weight, tf in cursor.fetchall():
+            documents.add(object_id)
+            try:
+                new = postings.pop((object_id, word_id))
+            except KeyError:
+                deletes.append(id)
+                words[word_id] = words.get(word_id, 0) - 1
+                stats['postings'] -= 1
+                continue
+            stats['postings'] -= 1
+            if new != (weight, tf):
+                updates.setdefault(new, []).append(id)
+        stats['documents'] = len([pk for pk, item_words, tf, length in batch if item_words]) - len(documents)
+        stats['length'] = self._sync_lengths(batch, scope, content_type_id, namespace_id)
+        for pk, word_id in postings:
+            words[word_id] = words.get(word_id, 0) + 1
+
+        for chunk in _chunks(deletes, MAX_PARAMS):
+            cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (index_table, ', '.join(['%s'] * len(chunk))), chunk)
+        for (weight, tf), update_ids in updates.items():
+            for chunk in _chunks(update_ids, MAX_PARAMS - 2):
+                cursor.execute('UPDATE %s SET weight = %%s, tf = %%s WHERE id IN (%s)' % (index_table, ', '.join(['%s'] * len(chunk))), [weight, tf] + chunk)
+        rows = [(word_id, weight, namespace_id, content_type_id, pk, tf) for (pk, word_id), (weight, tf) in postings.items()]
+        bulk_insert(Index._meta.db_table, ('word_id', 'weight', 'namespace_id', 'content_type_id', 'object_id', 'tf'), rows)
+        _apply_stats({ (content_type_id, namespace_id): stats })
+        transaction.set_dirty()
+
+    def _sync_lengths(self, batch, scope, content_type_id, namespace_id):
+        """
+        Makes the lengths stored for the objects in scope match batch, like _sync_postings.
+        Returns the change in their total length.
+        """
+        length_table = qn(DocumentLength._meta.db_table)
+        where, params = _postings_where(scope, content_type_id, namespace_id)
+        cursor = connection.cursor()
+        cursor.execute('SELECT id, object_id, length FROM %s WHERE %s' % (length_table, where), params)
+        lengths = dict([(pk, length) for pk, item_words, tf, length in batch if item_words])
+        delta = sum(lengths.values())
+        deletes = []
+        updates = {}
+        for id, object_id, length in cursor.fetchall():
+            delta -= length
+            try:
+                new_length = lengths.pop(object_id)
+            except KeyError:
+                deletes.append(id)
+                continue
+            if new_length != length:
+                updates.setdefault(new_length, []).append(id)
+        for chunk in _chunks(deletes, MAX_PARAMS):
+            cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (length_table, ', '.join(['%s'] * len(chunk))), chunk)
+        for length, update_ids in updates.items():
+            for chunk in _chunks(update_ids, MAX_PARAMS - 1):
+                cursor.execute('UPDATE %s SET length = %%s WHERE id IN (%s)' % (length_table, ', '.join(['%s'] * len(chunk))), [length] + chunk)
+        rows = [(namespace_id, content_type_id, pk, length) for pk, length in lengths.items()]
+        bulk_insert(DocumentLength._meta.db_table, ('namespace_id', 'content_type_id', 'object_id', 'length'), rows)
+        return delta
+
+    def word_stats(self, words):
+        """
+        Returns a dictionary mapping each of words (as indexed, e.g. stemmed) with
+        statistics to the number of objects of this manager's model indexed with it.
+        """
+        namespace_id = self._get_namespace_id(self.namespace)
+        ctype = ContentType.objects.get_for_model(self.model)
+        stats = {}
+        for chunk in _chunks(words, MAX_PARAMS):
+            qs = WordStat.objects.filter(content_type=ctype, namespace=namespace_id or 0, word__word__in=chunk)
+            stats.update(qs.values_list('word__word', 'doc_count'))
+        return stats
+
+    def index_stats(self):
+        """
+        Returns the number of 'documents' (objects) of this manager's model in the index,
+        of their 'postings' and their total 'length' (number of words).
+        """
+        namespace_id = self._get_namespace_id(self.namespace)
+        ctype = ContentType.objects.get_for_model(self.model)
+        stats = IndexStat.objects.filter(content_type=ctype, namespace=namespace_id or 0).aggregate(
+            documents=Sum('documents'), postings=Sum('postings'), length=Sum('length'))
+        return dict([(key, value or 0) for key, value in stats.items()])
+
+    def _word_ids_df(self, word_ids):
+        """
+        Returns a dictionary mapping word_ids to their document frequency, from the
+        statistics or, for the words without them, counting their postings.
+        """
+        df = {}
+        namespace_id = self._get_namespace_id(self.namespace)
+        ctype = ContentType.objects.get_for_model(self.model)
+        for chunk in _chunks(word_ids, MAX_PARAMS):
+            qs = WordStat.objects.filter(content_type=ctype, namespace=namespace_id or 0, word__in=chunk)
+            df.update(qs.values_list('word', 'doc_count'))
+        missing = [id for id in word_ids if id not in df]
+        if missing:
+            where, params = self._search_where(missing)
+            cursor = connection.cursor()
+            cursor.execute('SELECT word_id, COUNT(*) FROM %s WHERE %s GROUP BY word_id' % (qn(Index._meta.db_table), where), params)
+            df.update(cursor.fetchall())
+        return df
+
+    def _expand_prefix(self, prefix):
+        """
+        Returns the ids of the words starting with prefix (at most FTS_PREFIX_EXPANSIONS
+        of them, the most frequent ones), looked up as a range of the words index
+        instead of with LIKE.
+        """
+        start, end = _prefix_range(prefix)
+        qs = Word.objects.filter(word__gte=start)
+        if end is not None:
+            qs = qs.filter(word__lt=end)
+        qs = qs.order_by('-doc_count').values_list('id', 'word')[:FTS_PREFIX_EXPANSIONS]
+        # the bounds are compared with the database's collation, the prefix is not:
+        return [id for id, word in qs if word.startswith(prefix)]
+
+    def plan(self, query):
+        """
+        Returns how a search for query is run, as a dictionary with:
+            words       a dictionary for each word of the query with the 'word', whether
+                        it is 'exact' (or the beginning of the words to look for), the
+                        'ids' of the Word rows it matches (see _expand_prefix), its
+                        document frequency 'df'
+                        (see word_stats) and the one of each of its ids ('dfs');
+                        rarest first, the order they are used
+            strategy    'all' for a query without words, 'empty' if any of its words
+                        is not indexed (nothing is searched), 'joins' to join the index
+                        once per word, starting with the rarest, or 'intersect' to
+                        intersect the objects of each word, when even the rarest one is
+                        found in more than FTS_JOIN_DF_LIMIT postings.
+        """
+        words = [{ 'word': word, 'exact': exact, 'ids': [], 'df': 0, 'dfs': {} } for word, exact in set(self._get_query_words(query))]
+        if not words:
+            return { 'words': words, 'strategy': 'all' }
+        exact = dict([(w['word'], w) for w in words if w['exact']])
+        for word, id in self._find_word_ids(exact.keys()).items():
+            exact[word]['ids'].append(id)
+        for w in words:
+            if not w['exact']:
+                w['ids'] = self._expand_prefix(w['word'])
+        ids = [id for w in words for id in w['ids']]
+        if ids:
+            df = self._word_ids_df(ids)
+            for w in words:
+                w['dfs'] = dict([(id, df.get(id, 0)) for id in w['ids']])
+                w['df'] = sum(w['dfs'].values())
+        words.sort(key=lambda w: w['df'])
+        if not words[0]['df']:
+            strategy = 'empty'
+        elif words[0]['df'] <= FTS_JOIN_DF_LIMIT:
+            strategy = 'joins'
+        else:
+            strategy = 'intersect'
+        return { 'words': words, 'strategy': strategy }
+
+    def _search_where(self, word_ids, alias=None):
+        """
+        Returns the condition (and its parameters) on the postings of this manager's
+        model with the given word ids; word ids are integers from the database, so they
+        are written in the SQL instead of passed as (too many) parameters.
+        """
+        prefix = alias and '%s.' % alias or ''
+        where = ['%scontent_type_id = %%s' % prefix]
+        params = [ContentType.objects.get_for_model(self.model).id]
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is not None:
+            where.append('%snamespace_id = %%s' % prefix)
+            params.append(namespace_id)
+        if len(word_ids) == 1:
+            where.append('%sword_id = %d' % (prefix, word_ids[0]))
+        else:
+            where.append('%sword_id IN (%s)' % (prefix, ', '.join([str(int(id)) for id in word_ids])))
+        return ' AND '.join(where), params
+
+    def _bm25_score(self, dfs, alias, length, stats):
+        """
+        Returns the SQL expression of the BM25 score of the postings aliased alias of
+        the word ids in dfs (a dictionary mapping them to their document frequency),
+        boosted by their weight. length is the SQL expression of the length of the
+        document and stats the index_stats() of the model.
+        """
+        n = stats['documents']
+        idf = [(id, math.log(1 + (n - df + 0.5) / (df + 0.5))) for id, df in dfs.items()]
+        if len(idf) == 1:
+            idf_sql = repr(idf[0][1])
+        else:
+            idf_sql = 'CASE %s.word_id %s END' % (alias, ' '.join(['WHEN %d THEN %r' % (id, value) for id, value in idf]))
+        avgdl = n and float(stats['length']) / n or 1.0
+        norm = '%r * (%r + %r * COALESCE(%s, %r) / %r)' % (FTS_BM25_K1, 1 - FTS_BM25_B, FTS_BM25_B, length, avgdl, avgdl or 1.0)
+        return '%s * %s.weight * %s.tf * %r / (%s.tf + %s)' % (idf_sql, alias, alias, FTS_BM25_K1 + 1, alias, norm)
+
+    def _word_score(self, w, bm25, stats, length):
+        """
+        Returns the SQL expression of the score of the postings aliased i of query word
+        w (a word of the plan); length is the SQL expression of the document length.
+        """
+        if bm25:
+            return self._bm25_score(w['dfs'], 'i', length, stats)
+        return 'i.weight'
+
+    def _length_where(self, pk_column, alias=None):
+        prefix = alias and '%s.' % alias or ''
+        where = '%sobject_id = %s AND %scontent_type_id = %d' % (prefix, pk_column, prefix, ContentType.objects.get_for_model(self.model).id)
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is None:
+            return '%s AND %snamespace_id IS NULL' % (where, prefix)
+        return '%s AND %snamespace_id = %d' % (where, prefix, namespace_id)
 
     def _search(self, query, **kwargs):
         rank_field = kwargs.get('rank_field')
+        bm25 = rank_field is not None and kwargs.get('ranking', self.ranking) == 'bm25'
         qs = self.get_query_set()
+        plan = self.plan(query)
+        if plan['strategy'] == 'all':
+            return qs
+        if plan['strategy'] == 'empty':
+            return qs.none()
         
-        joins = []
+        table_name = self.model._meta.db_table
+        index_table_name = qn(Index._meta.db_table)
+        length_table_name = qn(DocumentLength._meta.db_table)
+        pk_column = '%s.%s' % (qn(table_name), qn(self.model._meta.pk.column))
+        stats = bm25 and self.index_stats() or None
         weights = []
-        joins_params = []
-        namespace_id = self._get_namespace_id(self.namespace)
-        for idx, word in enumerate(self._get_words(query)):
-            if self.full_index or self.exact_search:
-                joins_params.append("'%s'" % word.replace("'", "''"))
-                if namespace_id is not None:
-                    joins_params.append(namespace_id)
-                    namespace_sql = u'AND i%(idx)d.namespace_id = %%%%d' % { 'idx':idx }
+        if plan['strategy'] == 'joins':
+            joins = []
+            joins_params = []
+            for idx, w in enumerate(plan['words']):
+                alias = 'i%d' % idx
+                if len(w['ids']) == 1:
+                    where, params = self._search_where(w['ids'], alias)
+                    joins.append('INNER JOIN %s AS %s ON (%s.object_id = %s AND %s)' % (index_table_name, alias, alias, pk_column, where))
+                    if bm25:
+                        weights.append(self._bm25_score(w['dfs'], alias, 'dl.length', stats))
+                    else:
+                        weights.append('%s.weight' % alias)
                 else:
-                    namespace_sql = u''
-                joins.append(u"INNER JOIN %%(words_table_name)s AS w%(idx)d ON (w%(idx)d.word = %%%%s) INNER JOIN %%(index_table_name)s AS i%(idx)d ON (w%(idx)d.id = i%(idx)d.word_id AND i%(idx)d.content_type_id = %%(content_type_id)s AND i%(idx)d.object_id = %%(table_name)s.id %(namespace_sql)s)" % { 'idx':idx, 'namespace_sql': namespace_sql })
+                    # a prefix joins one row per object, with the best score of its words
+                    where, params = self._search_where(w['ids'], 'i')
+                    tables = '%s AS i' % index_table_name
+                    if bm25:
+                        tables += ' LEFT OUTER JOIN %s AS l ON (%s)' % (length_table_name, self._length_where('i.object_id', 'l'))
+                    score = self._word_score(w, bm25, stats, 'l.length')
+                    joins.append('INNER JOIN (SELECT i.object_id AS object_id, MAX(%s) AS score FROM %s WHERE %s GROUP BY i.object_id) AS %s ON (%s.object_id = %s)' % (score, tables, where, alias, alias, pk_column))
+                    weights.append('%s.score' % alias)
+                joins_params.extend(params)
+            # these params should be set as FROM params to be returned by get_from_clause() but it doesn't support FROM params
+            joins = ' '.join(joins).replace('%s', '%d') % tuple(joins_params)
+            if bm25 and [w for w in plan['words'] if len(w['ids']) == 1]:
+                joins += ' LEFT OUTER JOIN %s AS dl ON (%s)' % (length_table_name, self._length_where(pk_column, 'dl'))
+            
+            # monkey patch the query set:
+            qs.query.table_alias(table_name) # create alias
+            qs.query.alias_map[table_name] = (table_name, joins, None, None, None, None, None) # map the joins to the alias
+        else:
+            subqueries = []
+            params = []
+            for w in plan['words']:
+                where, where_params = self._search_where(w['ids'])
+                subqueries.append('SELECT object_id FROM %s WHERE %s' % (index_table_name, where))
+                params.extend(where_params)
+            if ENGINE == 'mysql':
+                # no INTERSECT in MySQL
+                qs = qs.extra(where=['%s IN (%s)' % (pk_column, subquery) for subquery in subqueries], params=params)
             else:
-                joins_params.append("'%s%%%%'" % word.replace("'", "''"))
-                if namespace_id is not None:
-                    joins_params.append(namespace_id)
-                    namespace_sql = u'AND i%(idx)d.namespace_id = %%%%d' % { 'idx':idx }
-                else:
-                    namespace_sql = u''
-                joins.append(u"INNER JOIN %%(words_table_name)s AS w%(idx)d ON (w%(idx)d.word LIKE %%%%s) INNER JOIN %%(index_table_name)s AS i%(idx)d ON (w%(idx)d.id = i%(idx)d.word_id AND i%(idx)d.content_type_id = %%(content_type_id)s AND i%(idx)d.object_id = %%(table_name)s.id %(namespace_sql)s)" % { 'idx':idx, 'namespace_sql': namespace_sql })
-                qs.query.distinct = True
-            weights.append("i%(idx)d.weight" % { 'idx':idx })
-        
-        table_name = self.model._meta.db_table
-        words_table_name = qn(Word._meta.db_table)
-        index_table_name = qn(Index._meta.db_table)
-        
-        ctype = ContentType.objects.get_for_model(self.model)
-        joins = ' '.join(joins) % {
-            'table_name': qn(table_name),
-            'words_table_name': words_table_name,
-            'index_table_name': index_table_name,
-            'content_type_id': ctype.id,
-        }
-        # these params should be set as FROM params to be returned by get_from_clause() but it doesn't support FROM params
-        joins = joins % tuple(joins_params)
-        
-        # monkey patch the query set:
-        qs.query.table_alias(table_name) # create alias
-        qs.query.alias_map[table_name] = (table_name, joins, None, None, None, None, None) # map the joins to the alias
+                qs = qs.extra(where=['%s IN (%s)' % (pk_column, ' INTERSECT '.join(subqueries))], params=params)
+            length = '(SELECT length FROM %s WHERE %s)' % (length_table_name, self._length_where(pk_column))
+            for w in plan['words']:
+                # the best score of the words of a prefix
+                where, params = self._search_where(w['ids'], 'i')
+                score = self._word_score(w, bm25, stats, length)
+                weights.append('(SELECT MAX(%s) FROM %s AS i WHERE i.object_id = %s AND %s)' % (score, index_table_name, pk_column, where.replace('%s', '%d') % tuple(params)))
         
         if rank_field is not None:
             select = {}
@@ -298,6 +852,163 @@ class SearchManager(BaseManager):
         
         return qs
 
+def finish_dumping(dumping):
+    """
+    Closes the loader of a dumping context and updates the statistics (fts.models.WordStat,
+    IndexStat and Word.doc_count) with the changes the context accumulated. A FileLoader
+    only writes files, so after loading them the statistics must be rebuilt with
+    rebuild_stats() (manage.py fts_rebuild_stats).
+    """
+    dumping['loader'].close()
+    if not isinstance(dumping['loader'], FileLoader):
+        _apply_stats(dumping.get('stats', {}))
+    dumping['stats'] = {}
+
+@commit_on_success_unless_managed
+def rebuild_stats():
+    """
+    Recomputes all the statistics from the index, to correct any drift.
+    """
+    cursor = connection.cursor()
+    index_table = qn(Index._meta.db_table)
+    word_table = qn(Word._meta.db_table)
+    stat_table = qn(WordStat._meta.db_table)
+    index_stat_table = qn(IndexStat._meta.db_table)
+    cursor.execute('DELETE FROM %s' % stat_table)
+    cursor.execute('INSERT INTO %s (word_id, content_type_id, namespace_id, doc_count) '
+                   'SELECT word_id, content_type_id, COALESCE(namespace_id, 0), COUNT(DISTINCT object_id) FROM %s '
+                   'GROUP BY word_id, content_type_id, namespace_id' % (stat_table, index_table))
+    cursor.execute('UPDATE %s SET doc_count = COALESCE((SELECT SUM(doc_count) FROM %s WHERE word_id = %s.id), 0)' % (word_table, stat_table, word_table))
+    cursor.execute('DELETE FROM %s' % index_stat_table)
+    cursor.execute('INSERT INTO %s (content_type_id, namespace_id, documents, postings, length) '
+                   'SELECT content_type_id, COALESCE(namespace_id, 0), COUNT(DISTINCT object_id), COUNT(*), 0 FROM %s '
+                   'GROUP BY content_type_id, namespace_id' % (index_stat_table, index_table))
+    cursor.execute('UPDATE %s SET length = COALESCE((SELECT SUM(length) FROM %s d WHERE d.content_type_id = %s.content_type_id '
+                   'AND COALESCE(d.namespace_id, 0) = %s.namespace_id), 0)'
+                   % ((index_stat_table, qn(DocumentLength._meta.db_table)) + (index_stat_table,) * 2))
+    transaction.set_dirty()
+
+def _orphans(content_type_id, batch_size):
+    """
+    Returns (object id, namespace id) tuples for at most batch_size objects of a
+    content type with postings but no row in their model's table (or no model).
+    """
+    index_table = qn(Index._meta.db_table)
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    cursor = connection.cursor()
+    if model is None:
+        cursor.execute('SELECT DISTINCT object_id, namespace_id FROM %s WHERE content_type_id = %%s LIMIT %d' % (index_table, batch_size), [content_type_id])
+    else:
+        opts = model._meta
+        cursor.execute('SELECT DISTINCT i.object_id, i.namespace_id FROM %s i WHERE i.content_type_id = %%s '
+                       'AND NOT EXISTS (SELECT 1 FROM %s t WHERE t.%s = i.object_id) LIMIT %d'
+                       % (index_table, qn(opts.db_table), qn(opts.pk.column), batch_size), [content_type_id])
+    return cursor.fetchall()
+
+@commit_on_success_unless_managed
+def vacuum(batch_size=FTS_VACUUM_BATCH_SIZE, words=True):
+    """
+    Deletes the postings (and lengths) of the objects that no longer exist and, with
+    words, the words without postings, batch_size objects or words at a time, each
+    batch in its own transaction. Returns a dictionary with the number of 'documents',
+    'postings' and 'words' deleted and the 'seconds' taken.
+
+    The processes sharing Django's cache empty their word id cache (see
+    FTS_WORD_ID_CACHE_SIZE) once the words are deleted; vacuum the words while nothing
+    is being indexed, as an update running meanwhile could still use their ids.
+    """
+    start = time.time()
+    reclaimed = { 'documents': 0, 'postings': 0, 'words': 0 }
+    cursor = connection.cursor()
+    cursor.execute('SELECT DISTINCT content_type_id FROM %s' % qn(Index._meta.db_table))
+    for (content_type_id,) in cursor.fetchall():
+        while True:
+            orphans = _orphans(content_type_id, batch_size)
+            if not orphans:
+                break
+            by_namespace = {}
+            for object_id, namespace_id in orphans:
+                by_namespace.setdefault(namespace_id, []).append(object_id)
+            c = {}
+            for namespace_id, object_ids in by_namespace.items():
+                for chunk in _chunks(object_ids, MAX_PARAMS - 2):
+                    _delete_postings(('object_id IN (%s)' % ', '.join(['%s'] * len(chunk)), chunk), c, content_type_id, namespace_id)
+            for delta in c['stats'].values():
+                reclaimed['documents'] -= delta['documents']
+                reclaimed['postings'] -= delta['postings']
+            _apply_stats(c['stats'])
+            if transaction.is_dirty():
+                transaction.commit()
+
+    if words:
+        from fts import models
+        word_table = qn(Word._meta.db_table)
+        unused = 'NOT EXISTS (SELECT 1 FROM %s i WHERE i.word_id = w.id)' % qn(Index._meta.db_table)
+        if hasattr(models, 'PostingBlock'):
+            # the blocks backend shares the words
+            unused += ' AND NOT EXISTS (SELECT 1 FROM %s b WHERE b.word_id = w.id)' % qn(models.PostingBlock._meta.db_table)
+        while True:
+            cursor.execute('SELECT id FROM %s w WHERE %s LIMIT %d' % (word_table, unused, batch_size))
+            word_ids = [row[0] for row in cursor.fetchall()]
+            if not word_ids:
+                break
+            for chunk in _chunks(word_ids, MAX_PARAMS):
+                ids = ', '.join(['%s'] * len(chunk))
+                cursor.execute('DELETE FROM %s WHERE word_id IN (%s)' % (qn(WordStat._meta.db_table), ids), chunk)
+                cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (word_table, ids), chunk)
+            reclaimed['words'] += len(word_ids)
+            transaction.set_dirty()
+            transaction.commit()
+        if reclaimed['words']:
+            _words_deleted()
+        _WORD_IDS.clear()
+    reclaimed['seconds'] = time.time() - start
+    return reclaimed
+
+def dump_indexes(managers, loader=None, processes=None, progress=None):
+    """
+    Rebuilds the indexes of several simple backend managers sharing one dumping
+    context, so each new word is written once. Rows go through loader, by default
+    the fastest loader for the database (see fts.loaders.get_loader); everything
+    is done in one transaction, but see fts.loaders about dropping the indexes on
+    each database. With processes, instances are analyzed by a pool
+    of that many processes. progress, if given, is called with the manager, the
+    last pk analyzed and the size of the chunk. Returns the dumping context, with
+    the statistics returned by the update of each manager as 'updates'.
+    """
+    if loader is None:
+        loader = get_loader()
+    try:
+        dumping = _dump_indexes(managers, loader, processes, progress)
+    except:
+        _abort_loader(loader)
+        raise
+    # once committed, so the results cached from the old indexes are not used any more:
+    for manager in managers:
+        manager._index_changed()
+    return dumping
+
+@commit_on_success_unless_managed
+def _abort_loader(loader):
+    loader.abort()
+
+@commit_on_success_unless_managed
+def _dump_indexes(managers, loader, processes, progress):
+    pool = processes and _open_pool(processes) or None
+    try:
+        loader.open([Word, Index, DocumentLength])
+        dumping = { 'loader': loader, 'pool': pool, 'updates': [] }
+        for manager in managers:
+            manager_progress = None
+            if progress is not None:
+                manager_progress = lambda last_pk, count, manager=manager: progress(manager, last_pk, count)
+            dumping['updates'].append(manager._update_index(None, dumping, progress=manager_progress))
+        finish_dumping(dumping)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return dumping
+
 class SearchableModel(BaseModel):
     class Meta:
         abstract = True
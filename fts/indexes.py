@@ -0,0 +1,138 @@
+"""
+Composite indexes of the simple and blocks backends' tables. Django only creates single
+column indexes, but the queries on fts_index and fts_postingblock filter on several
+columns at once:
+
+    fts_index_word      (word_id, content_type_id, object_id, namespace_id, weight, tf)
+                        the joins and subqueries of the searches, which look for the
+                        postings of a word (for an object) and only read their weight
+                        and tf, so they are answered from the index alone
+    fts_index_object    (content_type_id, namespace_id, object_id)
+                        the postings of a range of objects, read, counted and deleted
+                        when their index is updated
+    fts_block_word      (word_id, content_type_id, namespace_id, first_id, last_id)
+                        the blocks of the words searched, or updated, by the blocks
+                        backend in fts_postingblock
+
+syncdb creates them with the tables. For the tables created before, fts_indexes lists
+the missing ones and creates them, without blocking writes where the database can
+(CREATE INDEX CONCURRENTLY in PostgreSQL, ALTER TABLE ... LOCK=NONE in MySQL 5.6):
+
+    python ./manage.py fts_indexes
+    python ./manage.py fts_indexes --create
+"""
+from django.db import connection, transaction
+
+from fts.loaders import ENGINE
+
+qn = connection.ops.quote_name
+
+def get_indexes():
+    """
+    Returns (name, table, columns) tuples for the indexes the tables should have.
+    """
+    from fts import models
+    indexes = []
+    if hasattr(models, 'Index'):
+        table = models.Index._meta.db_table
+        indexes.append(('fts_index_word', table, ('word_id', 'content_type_id', 'object_id', 'namespace_id', 'weight', 'tf')))
+        indexes.append(('fts_index_object', table, ('content_type_id', 'namespace_id', 'object_id')))
+    if hasattr(models, 'PostingBlock'):
+        indexes.append(('fts_block_word', models.PostingBlock._meta.db_table, ('word_id', 'content_type_id', 'namespace_id', 'first_id', 'last_id')))
+    return indexes
+
+def existing_indexes(table):
+    """
+    Returns the names of the (valid) indexes of table.
+    """
+    cursor = connection.cursor()
+    if ENGINE == 'sqlite3':
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [table])
+        return set([row[0] for row in cursor.fetchall()])
+    if ENGINE == 'mysql':
+        cursor.execute('SHOW INDEX FROM %s' % qn(table))
+        return set([row[2] for row in cursor.fetchall()])
+    # an interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    cursor.execute('SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                   'JOIN pg_class t ON t.oid = i.indrelid WHERE t.relname = %s AND i.indisvalid', [table])
+    return set([row[0] for row in cursor.fetchall()])
+
+def invalid_indexes(table):
+    """
+    Returns the names of the indexes of table left invalid by an interrupted CREATE
+    INDEX CONCURRENTLY (only PostgreSQL has them).
+    """
+    if ENGINE != 'postgresql_psycopg2':
+        return set()
+    cursor = connection.cursor()
+    cursor.execute('SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                   'JOIN pg_class t ON t.oid = i.indrelid WHERE t.relname = %s AND NOT i.indisvalid', [table])
+    return set([row[0] for row in cursor.fetchall()])
+
+def missing_indexes():
+    """
+    Returns the (name, table, columns) tuples of the indexes the tables do not have.
+    """
+    existing = {}
+    missing = []
+    for name, table, columns in get_indexes():
+        if table not in existing:
+            existing[table] = existing_indexes(table)
+        if name not in existing[table]:
+            missing.append((name, table, columns))
+    return missing
+
+def create_sql(name, table, columns, online=False, using=None):
+    """
+    Returns the statements creating an index (of the given type, e.g. 'gin' in
+    PostgreSQL), without blocking writes to the table if online (and the database can).
+    Online in PostgreSQL, an invalid index left by an interrupted attempt is dropped
+    first, concurrently too (a plain DROP INDEX would lock the table).
+    """
+    columns = ', '.join([qn(column) for column in columns])
+    if using:
+        columns = 'USING %s (%s)' % (using, columns)
+    else:
+        columns = '(%s)' % columns
+    if online and ENGINE == 'postgresql_psycopg2':
+        statements = []
+        if name in invalid_indexes(table):
+            statements.append('DROP INDEX CONCURRENTLY IF EXISTS %s' % qn(name))
+        statements.append('CREATE INDEX CONCURRENTLY %s ON %s %s' % (qn(name), qn(table), columns))
+        return statements
+    if online and ENGINE == 'mysql':
+        return ['ALTER TABLE %s ADD INDEX %s %s, ALGORITHM=INPLACE, LOCK=NONE' % (qn(table), qn(name), columns)]
+    return ['CREATE INDEX %s ON %s %s' % (qn(name), qn(table), columns)]
+
+def execute(statements, online=False):
+    """
+    Runs statements and commits them, outside of a transaction if online in PostgreSQL
+    (where CREATE INDEX CONCURRENTLY can not run in one).
+    """
+    autocommit = online and ENGINE == 'postgresql_psycopg2'
+    if autocommit:
+        transaction.commit_unless_managed()
+        connection.connection.set_isolation_level(0)
+    try:
+        cursor = connection.cursor()
+        for sql in statements:
+            cursor.execute(sql)
+    finally:
+        if autocommit:
+            connection.connection.set_isolation_level(1)
+    transaction.commit_unless_managed()
+
+def create_indexes(online=False, verbosity=1):
+    """
+    Creates the missing indexes (see create_sql). Returns their names.
+    """
+    missing = missing_indexes()
+    if not missing:
+        return []
+    statements = []
+    for name, table, columns in missing:
+        if verbosity > 0:
+            print "Creating index %s on %s" % (name, table)
+        statements.extend(create_sql(name, table, columns, online))
+    execute(statements, online)
+    return [name for name, table, columns in missing]
@@ -0,0 +1,266 @@
+"""
+Bulk loading of rows into the database, used by the simple backend to write
+its index (see fts.backends.simple.dump_indexes).
+
+A loader buffers the rows added for each model and writes them in bulk when the
+buffer is full, on flush() and on close():
+
+    FileLoader      writes tab separated files (PostgreSQL COPY text format),
+                    one per table, to be loaded by hand.
+    CopyLoader      streams the rows into PostgreSQL with COPY FROM STDIN.
+    InsertLoader    uses executemany (SQLite) or multi-row INSERT statements.
+
+Database loaders drop the secondary indexes of the models they load on open()
+and create them again on close(), so they are not maintained row by row (unless
+created with drop_indexes=False). How this mixes with the transaction of the load
+depends on the database:
+
+    PostgreSQL      DROP INDEX is transactional, but locks the tables until the
+                    load commits, so searches and saves wait for the whole load.
+    MySQL, SQLite   DROP INDEX and CREATE INDEX commit the current transaction,
+                    so the load is not atomic any more. If it fails, abort()
+                    creates the dropped indexes again after the rollback.
+"""
+import os
+import re
+from cStringIO import StringIO
+
+from django.db import connection, transaction
+from django.core.management.color import no_style
+
+from fts.settings import FTS_LOADER_BUFFER_SIZE
+
+qn = connection.ops.quote_name
+# Short name of the database backend in use ('sqlite3', 'postgresql_psycopg2', 'mysql', ...)
+ENGINE = connection.__class__.__module__.split('.')[-2]
+
+# Whether DROP INDEX and CREATE INDEX commit the current transaction (pysqlite commits before them)
+DDL_COMMITS = ENGINE in ('mysql', 'sqlite3')
+
+# Maximum number of parameters sent in a single statement (SQLite's limit is 999)
+MAX_PARAMS = 900
+
+CREATE_INDEX = re.compile(r'CREATE INDEX (\S+) ON')
+
+def _chunks(seq, size):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i+size]
+
+def bulk_insert(table, columns, rows):
+    """
+    Inserts the given rows (tuples of values for columns) into table using as few
+    statements as possible: executemany inside the current transaction for SQLite,
+    and multi-row INSERT statements for all other databases.
+    """
+    if not rows:
+        return
+    cursor = connection.cursor()
+    sql = 'INSERT INTO %s (%s) VALUES ' % (qn(table), ', '.join([qn(c) for c in columns]))
+    values = '(%s)' % ', '.join(['%s'] * len(columns))
+    if ENGINE == 'sqlite3':
+        cursor.executemany(sql + values, rows)
+    else:
+        for chunk in _chunks(rows, MAX_PARAMS // len(columns)):
+            cursor.execute(sql + ', '.join([values] * len(chunk)), [v for row in chunk for v in row])
+    transaction.set_dirty()
+
+def columns(model):
+    """
+    Returns the columns of model's table, in the order rows given to a loader must follow.
+    """
+    return [f.column for f in model._meta.fields]
+
+def secondary_indexes(model):
+    """
+    Returns a list of (name, sql) tuples for the indexes Django creates for model,
+    besides the ones backing its primary key and unique constraints, and for the
+    composite indexes of fts.indexes the table has.
+    """
+    from fts import indexes as composite
+    indexes = []
+    for sql in connection.creation.sql_indexes_for_model(model, no_style()):
+        m = CREATE_INDEX.match(sql)
+        if m:
+            indexes.append((m.group(1), sql))
+    table = model._meta.db_table
+    existing = None
+    for name, index_table, index_columns in composite.get_indexes():
+        if index_table == table:
+            if existing is None:
+                existing = composite.existing_indexes(table)
+            if name in existing:
+                indexes.append((qn(name), composite.create_sql(name, table, index_columns)[0]))
+    return indexes
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, basestring):
+        value = value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        return value
+    return str(value)
+
+def _copy_rows(rows):
+    return ''.join(['\t'.join([_copy_value(v) for v in row]) + '\n' for row in rows])
+
+class BaseLoader(object):
+    drop_indexes = False
+
+    def __init__(self, buffer_size=None, drop_indexes=None):
+        self.buffer_size = buffer_size or FTS_LOADER_BUFFER_SIZE
+        if drop_indexes is not None:
+            self.drop_indexes = drop_indexes
+        self.buffers = {}
+        self.models = []
+        self.dropped = []
+
+    def open(self, models):
+        """
+        Prepares the loader for loading rows of models.
+        """
+        for model in models:
+            if model not in self.models:
+                self.models.append(model)
+                self.buffers[model] = []
+        if self.drop_indexes:
+            cursor = connection.cursor()
+            for model in models:
+                for name, sql in secondary_indexes(model):
+                    if ENGINE == 'mysql':
+                        cursor.execute('DROP INDEX %s ON %s' % (name, qn(model._meta.db_table)))
+                    else:
+                        cursor.execute('DROP INDEX %s' % name)
+                    self.dropped.append(sql)
+            transaction.set_dirty()
+
+    def add(self, model, row):
+        """
+        Adds a row (a tuple with a value for each of the columns of model's table).
+        """
+        buf = self.buffers[model]
+        buf.append(row)
+        if len(buf) >= self.buffer_size:
+            self.write(model, buf)
+            del buf[:]
+
+    def flush(self):
+        for model in self.models:
+            buf = self.buffers[model]
+            if buf:
+                self.write(model, buf)
+                del buf[:]
+
+    def close(self):
+        """
+        Writes all the buffered rows and recreates the indexes dropped by open().
+        """
+        self.flush()
+        self.restore_indexes()
+
+    def restore_indexes(self):
+        if self.dropped:
+            cursor = connection.cursor()
+            while self.dropped:
+                cursor.execute(self.dropped[0])
+                del self.dropped[0]
+            transaction.set_dirty()
+
+    def abort(self):
+        """
+        Called, after the rollback, when the load failed: the buffered rows are thrown
+        away and, where dropping them was committed, the indexes are created again.
+        """
+        for model in self.models:
+            del self.buffers[model][:]
+        if DDL_COMMITS:
+            self.restore_indexes()
+        self.dropped = []
+
+    def write(self, model, rows):
+        raise NotImplementedError
+
+class FileLoader(BaseLoader):
+    """
+    Writes one <table name>.txt file per model to directory, to be loaded by hand.
+    In PostgreSQL:
+        COPY fts_word FROM '/path/to/fts_word.txt';
+    or in Sqlite3 (there NULL values are written as \\N):
+        .separator "\\t"
+        .import fts_word.txt fts_word
+    """
+    def __init__(self, directory='.', buffer_size=None):
+        super(FileLoader, self).__init__(buffer_size)
+        self.directory = directory
+        self.files = {}
+
+    def open(self, models):
+        super(FileLoader, self).open(models)
+        for model in models:
+            if model not in self.files:
+                self.files[model] = open(os.path.join(self.directory, '%s.txt' % model._meta.db_table), 'wb')
+
+    def write(self, model, rows):
+        self.files[model].write(_copy_rows(rows))
+
+    def flush(self):
+        super(FileLoader, self).flush()
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        super(FileLoader, self).close()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+class CopyLoader(BaseLoader):
+    """
+    Streams the rows into PostgreSQL (psycopg2) using COPY FROM STDIN.
+    """
+    drop_indexes = True
+
+    def write(self, model, rows):
+        cursor = connection.cursor()
+        cursor.copy_from(StringIO(_copy_rows(rows)), model._meta.db_table, columns=columns(model))
+        transaction.set_dirty()
+
+    def close(self):
+        super(CopyLoader, self).close()
+        reset_sequences(self.models)
+
+class InsertLoader(BaseLoader):
+    """
+    Inserts the rows with executemany (SQLite) or multi-row INSERT statements, all
+    of them inside the current transaction.
+    """
+    drop_indexes = True
+
+    def write(self, model, rows):
+        bulk_insert(model._meta.db_table, columns(model), rows)
+
+    def close(self):
+        super(InsertLoader, self).close()
+        reset_sequences(self.models)
+
+def reset_sequences(models):
+    """
+    Rows are loaded with explicit ids, so the sequences generating them must catch up.
+    """
+    cursor = connection.cursor()
+    for sql in connection.ops.sequence_reset_sql(no_style(), models):
+        cursor.execute(sql)
+    transaction.set_dirty()
+
+def get_loader(directory=None, buffer_size=None, drop_indexes=None):
+    """
+    Returns a FileLoader if directory is given, otherwise the fastest loader for the
+    database in use.
+    """
+    if directory is not None:
+        return FileLoader(directory, buffer_size)
+    if ENGINE == 'postgresql_psycopg2':
+        return CopyLoader(buffer_size, drop_indexes)
+    return InsertLoader(buffer_size, drop_indexes)
@@ -0,0 +1,96 @@
+"""
+A bounded, thread safe, least recently used mapping with hit and miss counters.
+"""
+import threading
+
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+class LRUCache(object):
+    """
+    Keeps at most maxsize items; storing an item beyond that evicts the least
+    recently used one. A maxsize of 0 disables the cache (nothing is stored).
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._map = {}
+        # circular doubly linked list of [prev, next, key, value] links, most recent last
+        self._root = root = []
+        root[:] = [root, root, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # move the link to the most recent end
+            link[PREV][NEXT] = link[NEXT]
+            link[NEXT][PREV] = link[PREV]
+            root = self._root
+            last = root[PREV]
+            last[NEXT] = root[PREV] = link
+            link[PREV] = last
+            link[NEXT] = root
+            return link[VALUE]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is not None:
+                link[VALUE] = value
+                return
+            root = self._root
+            if len(self._map) >= self.maxsize:
+                # reuse the least recently used link
+                oldest = root[NEXT]
+                del self._map[oldest[KEY]]
+                root[NEXT] = oldest[NEXT]
+                oldest[NEXT][PREV] = root
+            last = root[PREV]
+            link = [last, root, key, value]
+            last[NEXT] = root[PREV] = self._map[key] = link
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            link = self._map.pop(key, None)
+            if link is not None:
+                link[PREV][NEXT] = link[NEXT]
+                link[NEXT][PREV] = link[PREV]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._map.clear()
+            root = self._root
+            root[:] = [root, root, None, None]
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._map),
+            'maxsize': self.maxsize,
+        }
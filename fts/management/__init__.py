@@ -0,0 +1,35 @@
+from django.db.models import signals
+
+from fts import models as fts_models
+
+def create_indexes(sender, created_models, verbosity=1, **kwargs):
+    """
+    Creates the composite indexes of the fts tables (see fts.indexes) with them, and
+    warns about the ones missing from the tables created before.
+    """
+    from fts import indexes
+    tables = [getattr(fts_models, name, None) for name in ('Index', 'PostingBlock')]
+    if [model for model in created_models if model in tables]:
+        indexes.create_indexes(verbosity=int(verbosity) > 1 and 1 or 0)
+    elif indexes.get_indexes():
+        missing = indexes.missing_indexes()
+        if missing and int(verbosity) > 0:
+            print "Warning: the fts tables are missing the indexes %s, run fts_indexes --create" % ', '.join([name for name, table, columns in missing])
+
+signals.post_syncdb.connect(create_indexes, sender=fts_models)
+
+def create_pgsql_objects(sender, created_models, verbosity=1, **kwargs):
+    """
+    Creates the GIN indexes (and triggers) of the pgsql managers of the new tables, and
+    warns about the ones missing from the tables of the app created before.
+    """
+    from django.db.models import get_models
+    from fts.backends.pgsql import get_managers
+    for manager in get_managers(created_models):
+        for name in manager.create_db_objects():
+            if int(verbosity) > 1:
+                print "Created %s" % name
+    for manager in get_managers([model for model in get_models(sender) if model not in created_models]):
+        manager.verify()
+
+signals.post_syncdb.connect(create_pgsql_objects)
@@ -0,0 +1,30 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = "Lists the composite indexes missing from the fts tables (see fts.indexes), or creates them."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--create', dest='create', action='store_true', default=False,
+            help='Create the missing indexes, without blocking writes where the database can.'),
+        make_option('--sql', dest='sql', action='store_true', default=False,
+            help='Print the statements creating the missing indexes instead.'),
+    )
+
+    def handle_noargs(self, **options):
+        from fts import indexes
+        verbosity = int(options.get('verbosity', 1))
+        missing = indexes.missing_indexes()
+        if options['sql']:
+            for name, table, columns in missing:
+                for sql in indexes.create_sql(name, table, columns, online=True):
+                    print '%s;' % sql
+        elif options['create']:
+            indexes.create_indexes(online=True, verbosity=verbosity)
+        elif missing:
+            for name, table, columns in missing:
+                sys.stderr.write("Missing index %s on %s (%s)\n" % (name, table, ', '.join(columns)))
+            sys.exit(1)
+        elif verbosity > 0:
+            print "All the indexes exist"
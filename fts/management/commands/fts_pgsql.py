@@ -0,0 +1,41 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = ("Lists the GIN indexes and triggers missing for the pgsql backend's managers, "
+            "or creates or drops them.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--create', dest='create', action='store_true', default=False,
+            help='Create the missing indexes (without blocking writes) and triggers.'),
+        make_option('--drop', dest='drop', action='store_true', default=False,
+            help='Drop the indexes and triggers.'),
+        make_option('--sql', dest='sql', action='store_true', default=False,
+            help='Print the statements creating (or, with --drop, dropping) them instead.'),
+    )
+
+    def handle_noargs(self, **options):
+        from fts.backends.pgsql import get_managers
+        verbosity = int(options.get('verbosity', 1))
+        managers = get_managers()
+        if options['sql']:
+            for manager in managers:
+                for sql in options['drop'] and manager.drop_sql() or manager.create_sql(online=True):
+                    print '%s;' % sql
+        elif options['drop']:
+            for manager in managers:
+                manager.drop_db_objects()
+        elif options['create']:
+            for manager in managers:
+                for name in manager.create_db_objects(online=True):
+                    if verbosity > 0:
+                        print "Created %s" % name
+        else:
+            missing = [(manager, name) for manager in managers for name in manager.missing_db_objects()]
+            for manager, name in missing:
+                sys.stderr.write("Missing %s for %s.%s\n" % (name, manager.model._meta.object_name, manager.name))
+            if missing:
+                sys.exit(1)
+            if verbosity > 0:
+                print "All the indexes and triggers exist"
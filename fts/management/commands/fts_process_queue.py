@@ -0,0 +1,28 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from fts.settings import FTS_INDEX_QUEUE_BATCH
+
+class Command(NoArgsCommand):
+    help = "Updates the indexes of the instances queued in the fts_indexqueue table (FTS_INDEX_QUEUE = 'db')."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=FTS_INDEX_QUEUE_BATCH,
+            help='Number of queued instances updated at a time.'),
+        make_option('--loop', dest='loop', type='float', default=0,
+            help='Keep running, looking for new instances every LOOP seconds once the queue is empty.'),
+    )
+
+    def handle_noargs(self, **options):
+        from fts.queue import process_queue
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            count = 1
+            while count:
+                count = process_queue(options['batch_size'])
+                if count and verbosity > 0:
+                    print "%d queued updates processed" % count
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,8 @@
+from django.core.management.base import NoArgsCommand
+
+class Command(NoArgsCommand):
+    help = "Recomputes the word and index statistics of the simple backend from its index."
+
+    def handle_noargs(self, **options):
+        from fts.backends.simple import rebuild_stats
+        rebuild_stats()
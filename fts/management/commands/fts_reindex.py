@@ -0,0 +1,160 @@
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import get_models
+
+from fts.backends.base import get_search_managers
+
+def _label(manager):
+    opts = manager.model._meta
+    return '%s.%s.%s' % (opts.app_label, opts.object_name, manager.name)
+
+def _format_time(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+class Checkpoint(object):
+    """
+    The last pk indexed by each manager whose rebuild has not finished, kept in a
+    file with a 'app_label.Model.manager pk' line for each of them.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pks = {}
+        if os.path.exists(path):
+            for line in open(path):
+                label, pk = line.split()
+                self.pks[label] = int(pk)
+
+    def get(self, manager):
+        return self.pks.get(_label(manager))
+
+    def set(self, manager, pk):
+        if pk is None:
+            self.pks.pop(_label(manager), None)
+        else:
+            self.pks[_label(manager)] = pk
+        if not self.pks:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp = '%s.tmp' % self.path
+        f = open(tmp, 'w')
+        try:
+            for label, pk in sorted(self.pks.items()):
+                f.write('%s %d\n' % (label, pk))
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+class Progress(object):
+    """
+    Reports the progress of the rebuild of a manager's index, saving the last pk
+    indexed to the checkpoint (if any) and pausing after each chunk if asked to.
+    """
+    def __init__(self, manager, total, checkpoint=None, sleep=0, verbosity=1):
+        self.manager = manager
+        self.total = total
+        self.checkpoint = checkpoint
+        self.sleep = sleep
+        self.verbosity = verbosity
+        self.done = 0
+        self.start = time.time()
+
+    def __call__(self, last_pk, count):
+        self.done += count
+        if self.checkpoint is not None:
+            self.checkpoint.set(self.manager, last_pk)
+        if self.verbosity > 0:
+            elapsed = time.time() - self.start
+            rate = self.done / (elapsed or 1)
+            eta = rate and max(self.total - self.done, 0) / rate or 0
+            print '%s: %d/%d documents (pk %s), %.0f docs/s, ETA %s' % (_label(self.manager),
+                self.done, self.total, last_pk, rate, _format_time(eta))
+        if self.sleep:
+            time.sleep(self.sleep)
+
+    def report(self, stats):
+        if self.verbosity > 0:
+            elapsed = time.time() - self.start
+            documents = stats and stats.get('documents') or self.done
+            line = '%s: %d documents in %s, %.0f docs/s' % (_label(self.manager), documents,
+                _format_time(elapsed), documents / (elapsed or 1))
+            if stats and 'postings' in stats:
+                line += ', %d words, %.0f words/s' % (stats['postings'], stats['postings'] / (elapsed or 1))
+            print line
+
+class Command(BaseCommand):
+    help = ("Rebuilds the full-text indexes of the given apps (app_label), models (app_label.Model) "
+            "or managers (app_label.Model.manager), or of all of them. An interrupted live rebuild "
+            "resumes from the checkpoint it left.")
+    args = '[app_label[.Model[.manager]] ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=None,
+            help='Number of instances indexed (and committed) at a time (the chunk_size of the managers by default).'),
+        make_option('--since-pk', dest='since_pk', type='int', default=None,
+            help='Only index the instances after this pk (live mode only).'),
+        make_option('--sleep-between-batches', dest='sleep', type='float', default=0,
+            help='Seconds to pause after each batch, to throttle the rebuild.'),
+        make_option('--mode', dest='mode', type='choice', choices=['live', 'dump'], default='live',
+            help="live (the default) updates the indexes in place, committing each batch; dump rebuilds "
+                 "the simple backend indexes at once, in one transaction (see fts.backends.simple.dump_indexes)."),
+        make_option('--checkpoint', dest='checkpoint', default='fts_reindex.checkpoint',
+            help='File where the last pk indexed is saved (live mode), to resume from it.'),
+    )
+
+    def _get_managers(self, selectors):
+        managers = []
+        for model in get_models():
+            for manager in get_search_managers(model):
+                if manager.model is not model or model._meta.abstract:
+                    continue
+                label = _label(manager)
+                if not selectors or [s for s in selectors if label == s or label.startswith('%s.' % s)]:
+                    managers.append(manager)
+        for selector in selectors:
+            if not [m for m in managers if _label(m) == selector or _label(m).startswith('%s.' % selector)]:
+                raise CommandError("No full-text searchable model or manager matches %s" % selector)
+        return managers
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        managers = self._get_managers(args)
+        batch_size = options['batch_size']
+        if batch_size:
+            for manager in managers:
+                manager.chunk_size = batch_size
+
+        if options['mode'] == 'dump':
+            from fts.backends.simple import dump_indexes
+            if options['since_pk'] is not None:
+                raise CommandError("--since-pk only applies to live rebuilds")
+            for manager in managers:
+                if not manager.dumpable:
+                    raise CommandError("%s does not use the simple backend, which --mode=dump needs" % _label(manager))
+            progress = dict([(manager, Progress(manager, manager.count(), sleep=options['sleep'], verbosity=verbosity)) for manager in managers])
+            dumping = dump_indexes(managers, progress=lambda manager, last_pk, count: progress[manager](last_pk, count))
+            for manager, stats in zip(managers, dumping['updates']):
+                progress[manager].report(stats)
+            return
+
+        checkpoint = Checkpoint(options['checkpoint'])
+        for manager in managers:
+            since_pk = options['since_pk']
+            if since_pk is None:
+                since_pk = checkpoint.get(manager)
+            if since_pk is not None and not manager.resumable:
+                raise CommandError("The backend of %s can not resume a rebuild" % _label(manager))
+            kwargs = {}
+            qs = manager.get_query_set()
+            if since_pk is not None:
+                kwargs['since_pk'] = since_pk
+                qs = qs.filter(pk__gt=since_pk)
+                if verbosity > 0:
+                    print '%s: resuming after pk %s' % (_label(manager), since_pk)
+            progress = Progress(manager, qs.count(), manager.resumable and checkpoint or None, options['sleep'], verbosity)
+            stats = manager.update_index(None, progress=progress, **kwargs)
+            checkpoint.set(manager, None)
+            progress.report(stats)
@@ -0,0 +1,21 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from fts.settings import FTS_VACUUM_BATCH_SIZE
+
+class Command(NoArgsCommand):
+    help = ("Deletes the postings of the objects that no longer exist and the words no longer "
+            "indexed from the simple backend's tables.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=FTS_VACUUM_BATCH_SIZE,
+            help='Number of objects or words deleted at a time (each batch is committed).'),
+        make_option('--keep-words', dest='words', action='store_false', default=True,
+            help='Do not delete the words without postings.'),
+    )
+
+    def handle_noargs(self, **options):
+        from fts.backends.simple import vacuum
+        reclaimed = vacuum(options['batch_size'], options['words'])
+        if int(options.get('verbosity', 1)) > 0:
+            print "%(documents)d objects, %(postings)d postings and %(words)d words deleted in %(seconds).1fs" % reclaimed
@@ -9,9 +9,23 @@ from django.core.cache import cache
 
 from fts.settings import *
 
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('simple://'):
+class BlobField(models.Field):
+    """
+    A binary string (Django has no field for them), read and written with raw SQL.
+    """
+    def db_type(self):
+        from django.conf import settings
+        if settings.DATABASE_ENGINE.startswith('postgresql'):
+            return 'bytea'
+        if settings.DATABASE_ENGINE == 'mysql':
+            return 'longblob'
+        return 'blob'
+
+if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('simple://') or FTS_BACKEND.startswith('blocks://'):
     class Word(models.Model):
         word = models.CharField(unique=True, db_index=True, blank=False, max_length=100)
+        # number of objects (of any content type and namespace) indexed with the word
+        doc_count = models.IntegerField(default=0)
         
         def __unicode__(self):
             return u"%s" % (self.word)
@@ -45,6 +59,100 @@ if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('simple://'):
         content_type = models.ForeignKey(ContentType)
         object_id = models.PositiveIntegerField(db_index=True)
         content_object = generic.GenericForeignKey('content_type', 'object_id')
+        # number of times the word occurs in the object
+        tf = models.IntegerField(default=1)
         
         def __unicode__(self):
             return u'%s [%s]' % (self.content_object, self.word.word)
+
+    class DocumentLength(models.Model):
+        """
+        Number of words indexed for an object, for BM25 ranking.
+        """
+        namespace = models.ForeignKey(Namespace, null=True, blank=True)
+
+        content_type = models.ForeignKey(ContentType)
+        object_id = models.PositiveIntegerField(db_index=True)
+        length = models.IntegerField()
+
+        class Meta:
+            unique_together = (('content_type', 'namespace', 'object_id'),)
+
+    class WordStat(models.Model):
+        """
+        Number of objects of a content type (in a namespace) indexed with a word.
+        """
+        word = models.ForeignKey(Word)
+        content_type = models.ForeignKey(ContentType)
+        # the id of the namespace, 0 for none: NULLs are never equal, so rows without
+        # a namespace would not be unique
+        namespace = models.IntegerField(default=0, db_column='namespace_id')
+        doc_count = models.IntegerField(default=0)
+
+        class Meta:
+            unique_together = (('word', 'content_type', 'namespace'),)
+
+        def __unicode__(self):
+            return u'%s [%s] %d' % (self.content_type, self.word.word, self.doc_count)
+
+    class IndexStat(models.Model):
+        """
+        Number of objects of a content type (in a namespace) in the index, of their
+        postings and of the words indexed for them (the sum of their lengths).
+        """
+        content_type = models.ForeignKey(ContentType)
+        # the id of the namespace, 0 for none (see WordStat)
+        namespace = models.IntegerField(default=0, db_column='namespace_id')
+        documents = models.IntegerField(default=0)
+        postings = models.IntegerField(default=0)
+        length = models.IntegerField(default=0)
+
+        class Meta:
+            unique_together = (('content_type', 'namespace'),)
+
+        def __unicode__(self):
+            return u'%s %d/%d' % (self.content_type, self.documents, self.postings)
+
+if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('blocks://'):
+    class PostingBlock(models.Model):
+        """
+        The postings of a word for the objects of a content type (in a namespace) with
+        ids from first_id to last_id, for the blocks backend: the count ids, ascending and
+        delta varint encoded, followed by their weights, one byte each.
+        """
+        word = models.ForeignKey(Word)
+        content_type = models.ForeignKey(ContentType)
+        namespace = models.ForeignKey(Namespace, null=True, blank=True)
+        first_id = models.PositiveIntegerField()
+        last_id = models.PositiveIntegerField()
+        count = models.IntegerField()
+        postings = BlobField()
+
+        def __unicode__(self):
+            return u'%s [%s] %d-%d' % (self.content_type, self.word.word, self.first_id, self.last_id)
+
+    class BlockDocument(models.Model):
+        """
+        The words of an object, for the blocks backend to know which postings to change
+        when it is updated: the ids of its count words and their weights, encoded like
+        the postings of a PostingBlock.
+        """
+        content_type = models.ForeignKey(ContentType)
+        namespace = models.ForeignKey(Namespace, null=True, blank=True)
+        object_id = models.PositiveIntegerField()
+        count = models.IntegerField()
+        words = BlobField()
+
+        class Meta:
+            unique_together = (('content_type', 'namespace', 'object_id'),)
+
+if FTS_INDEX_QUEUE == 'db':
+    class IndexQueue(models.Model):
+        """
+        An instance whose indexes are to be updated (see fts.queue).
+        """
+        content_type = models.ForeignKey(ContentType)
+        object_id = models.PositiveIntegerField()
+
+        def __unicode__(self):
+            return u'%s %s' % (self.content_type, self.object_id)
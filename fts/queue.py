@@ -0,0 +1,112 @@
+"""
+Deferred index updates. With FTS_INDEX_QUEUE set, saving a searchable instance only
+queues it, and the indexes of the queued instances are updated later in batches,
+once per instance however many times it was saved:
+
+    'local'     each thread queues its instances in memory; they are flushed when
+                the request finishes (after the transaction middleware commits),
+                dropped if it fails, or flushed by calling flush(). A thread with
+                FTS_INDEX_QUEUE_LIMIT instances queued flushes them as soon as a
+                save commits (never in the middle of its transaction).
+    'db'        the instances are queued in the fts_indexqueue table, in the same
+                transaction as the changes, and flushed by process_queue(), e.g.
+                from a worker: python ./manage.py fts_process_queue --loop=5
+
+With FTS_INDEX_QUEUE = None (the default) the indexes are updated synchronously.
+"""
+import threading
+
+from django.core import signals
+from django.db import transaction
+from django.contrib.contenttypes.models import ContentType
+
+from fts.settings import FTS_INDEX_QUEUE, FTS_INDEX_QUEUE_LIMIT, FTS_INDEX_QUEUE_BATCH
+from fts.loaders import _chunks, MAX_PARAMS
+
+_local = threading.local()
+
+def _pending():
+    pending = getattr(_local, 'pending', None)
+    if pending is None:
+        pending = _local.pending = {}
+    return pending
+
+def enqueue(model, pk):
+    """
+    Queues the instance of model with primary key pk for its indexes to be updated.
+    """
+    if FTS_INDEX_QUEUE == 'db':
+        from fts.models import IndexQueue
+        IndexQueue.objects.create(content_type=ContentType.objects.get_for_model(model), object_id=pk)
+        return
+    pending = _pending()
+    pending.setdefault(model, set()).add(pk)
+    _local.count = getattr(_local, 'count', 0) + 1
+
+def flush_full():
+    """
+    Flushes the instances queued by this thread if there are FTS_INDEX_QUEUE_LIMIT
+    of them, once their changes are committed (see fts.backends.base, which calls it
+    right after the commits of the saves). Returns the number of instances updated.
+    """
+    if getattr(_local, 'count', 0) >= FTS_INDEX_QUEUE_LIMIT:
+        return flush()
+    return 0
+
+def discard():
+    """
+    Forgets the instances queued by this thread.
+    """
+    _local.pending = {}
+    _local.count = 0
+
+def _update(model, pks, batch_size):
+    from fts.backends.base import get_search_managers
+    for sm in get_search_managers(model):
+        if sm.updated_on_save:
+            continue
+        for chunk in _chunks(sorted(pks), batch_size):
+            sm.update_index(pk=chunk)
+
+def flush(batch_size=FTS_INDEX_QUEUE_BATCH):
+    """
+    Updates the indexes of the instances queued by this thread, batch_size instances
+    at a time. Returns the number of instances updated.
+    """
+    pending = _pending()
+    discard()
+    count = 0
+    for model, pks in pending.items():
+        _update(model, pks, batch_size)
+        count += len(pks)
+    return count
+
+@transaction.commit_on_success
+def process_queue(batch_size=FTS_INDEX_QUEUE_BATCH):
+    """
+    Updates the indexes of the instances in the fts_indexqueue table queued first, up
+    to batch_size rows, and removes their rows. Returns the number of rows processed.
+    """
+    from fts.models import IndexQueue
+    rows = list(IndexQueue.objects.order_by('id').values_list('id', 'content_type', 'object_id')[:batch_size])
+    queued = {}
+    for id, content_type_id, pk in rows:
+        queued.setdefault(content_type_id, set()).add(pk)
+    for content_type_id, pks in queued.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is not None:
+            _update(model, pks, batch_size)
+    for chunk in _chunks([id for id, content_type_id, pk in rows], MAX_PARAMS):
+        IndexQueue.objects.filter(id__in=chunk).delete()
+    return len(rows)
+
+def _request_finished(sender, **kwargs):
+    if getattr(_local, 'count', 0):
+        flush()
+
+def _request_failed(sender, **kwargs):
+    discard()
+
+if FTS_INDEX_QUEUE == 'local':
+    signals.request_finished.connect(_request_finished)
+    signals.got_request_exception.connect(_request_failed)
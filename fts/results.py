@@ -0,0 +1,161 @@
+"""
+Caching of search results. Popular queries are repeated over and over, so a
+manager created with cache_results ('local' for an LRU cache within the process,
+'django' for Django's cache) keeps the primary keys (and ranks) of the results of
+each query, model, namespace, ranking and slice instead of searching again:
+
+    Blog.objects = fts.SearchManager(cache_results='django')
+    Blog.objects.search('simple article', rank_field='rank')[:10] # searches
+    Blog.objects.search('simple article', rank_field='rank')[:10] # cached
+
+Nothing is ever purged: the entries are keyed by a generation counter of the index
+of the model (in a namespace), kept in Django's cache and bumped whenever the index
+is updated, so the stale ones are simply not looked for any more. With several
+processes, Django's cache must be shared by them (memcached...) for the counters
+to be.
+"""
+import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.core.cache import cache
+
+from fts.lru import LRUCache
+from fts.settings import FTS_RESULT_CACHE_SIZE, FTS_RESULT_CACHE_TIMEOUT
+
+_LOCAL = LRUCache(FTS_RESULT_CACHE_SIZE)
+
+def _generation_key(label, namespace):
+    return 'fts-generation:%s:%s' % (label, namespace or '')
+
+def _new_generation():
+    # a lost counter (evicted or expired) starts again past every value it had,
+    # unless it was bumped more than once per microsecond
+    return int(time.time() * 1000000)
+
+def get_generation(label, namespace=None):
+    """
+    Returns the generation of the index of the model label ('app_label.model') in
+    namespace.
+    """
+    key = _generation_key(label, namespace)
+    generation = cache.get(key)
+    if generation is None:
+        generation = _new_generation()
+        if not cache.add(key, generation, FTS_RESULT_CACHE_TIMEOUT * 2):
+            generation = cache.get(key, generation)
+    return generation
+
+def bump_generation(label, namespace=None):
+    """
+    Starts a new generation of the index of the model label in namespace, so the
+    results cached until now are not used any more.
+    """
+    key = _generation_key(label, namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_generation(), FTS_RESULT_CACHE_TIMEOUT * 2)
+
+def get_results(mode, key):
+    if mode == 'local':
+        return _LOCAL.get(key)
+    return cache.get(key)
+
+def set_results(mode, key, value):
+    if mode == 'local':
+        _LOCAL.set(key, value)
+    else:
+        cache.set(key, value, FTS_RESULT_CACHE_TIMEOUT)
+
+def stats():
+    """
+    Returns the statistics of the process local cache.
+    """
+    return _LOCAL.stats()
+
+class CachedSearch(object):
+    """
+    The results of a search by a manager with cache_results. Slicing it, iterating
+    over it or taking its len() returns (lists of) instances, with the rank set as
+    rank_field if given; count() counts them. The query set itself, if needed, is
+    returned by query_set(), and the other query set methods (filter(), exclude()...)
+    are run on it, without caching.
+    """
+    def __init__(self, manager, query, kwargs):
+        self.manager = manager
+        self.query = query
+        self.kwargs = kwargs
+        self.rank_field = kwargs.get('rank_field')
+        self._results = None
+
+    def query_set(self):
+        return self.manager._search(self.query, **self.kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError, name
+        return getattr(self.query_set(), name)
+
+    def _key(self, *args):
+        manager = self.manager
+        opts = manager.model._meta
+        label = '%s.%s' % (opts.app_label, opts.module_name)
+        namespace = getattr(manager, 'namespace', None)
+        parts = [label, manager.name, namespace, get_generation(label, namespace),
+                 manager._get_cache_query(self.query), sorted(self.kwargs.items())] + list(args)
+        return 'fts-results:%s' % md5(repr(parts)).hexdigest()
+
+    def _fetch(self, start, stop):
+        mode = self.manager.cache_results
+        key = self._key(start, stop)
+        rows = get_results(mode, key)
+        if rows is None:
+            items = list(self.query_set()[start:stop])
+            if self.rank_field is not None:
+                rows = [(item.pk, getattr(item, self.rank_field)) for item in items]
+            else:
+                rows = [(item.pk, None) for item in items]
+            set_results(mode, key, rows)
+            return items
+        instances = self.manager.in_bulk([pk for pk, rank in rows])
+        items = []
+        for pk, rank in rows:
+            if pk in instances:
+                item = instances[pk]
+                if self.rank_field is not None:
+                    setattr(item, self.rank_field, rank)
+                items.append(item)
+        return items
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step is not None:
+                raise ValueError, "Cached searches can not be sliced with a step"
+            return self._fetch(k.start, k.stop)
+        items = self._fetch(k, k + 1)
+        if not items:
+            raise IndexError, "list index out of range"
+        return items[0]
+
+    def _all(self):
+        if self._results is None:
+            self._results = self._fetch(None, None)
+        return self._results
+
+    def __iter__(self):
+        return iter(self._all())
+
+    def __len__(self):
+        return len(self._all())
+
+    def count(self):
+        mode = self.manager.cache_results
+        key = self._key('count')
+        count = get_results(mode, key)
+        if count is None:
+            count = self.query_set().count()
+            set_results(mode, key, count)
+        return count
@@ -0,0 +1,589 @@
+"""
+A small on-disk index engine, used by the segment backend (fts.backends.segment).
+
+An index is a directory of immutable segments. A segment file holds, for a set
+of documents (integer ids):
+
+    postings    the ids of the documents of each term, delta and varint encoded
+    weights     the weight of each posting, one byte each, in the same order
+    terms       the sorted term dictionary: each term (utf8) with its document
+                frequency and the position of its postings and weights
+    term index  every INDEX_INTERVAL-th term and its position in the dictionary,
+                loaded in memory to find a term by bisection
+    documents   the ids of the documents in the segment
+
+Segments are read through memory maps. Updating a document writes it to a new
+segment and adds its id to the tombstones (a .del file) of the older segment
+that held it; deleting it only adds the tombstone. The live segments and the
+generation of their tombstones are listed in the segments file, which is replaced
+atomically, so readers always see a consistent index. When there are more than
+merge_factor segments the smallest ones are merged, in a background thread,
+leaving out the deleted documents.
+"""
+import os
+import mmap
+import time
+import bisect
+import struct
+import threading
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = 'FTSSEG1\n'
+# offsets of the postings, weights, terms, term index, documents and end of the
+# file, and the number of terms
+FOOTER = struct.Struct('<6QI')
+INDEX_INTERVAL = 32
+MANIFEST = 'segments'
+
+def encode_varint(n, out):
+    """
+    Appends the varint encoding of n (7 bits per byte, least significant first,
+    high bit set on all but the last byte) to out, a list of strings.
+    """
+    while n > 0x7f:
+        out.append(chr(n & 0x7f | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+def decode_varint(buf, pos):
+    """
+    Returns the number encoded at pos in buf and the position after it.
+    """
+    n = shift = 0
+    while True:
+        b = ord(buf[pos])
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def encode_ids(ids, out):
+    """
+    Appends the varint encoding of the ascending ids, as deltas, to out.
+    """
+    last = 0
+    for id in ids:
+        encode_varint(id - last, out)
+        last = id
+
+def decode_ids(buf, pos, count):
+    """
+    Returns a list of the count ids encoded by encode_ids at pos and the position after them.
+    """
+    ids = []
+    last = 0
+    for i in xrange(count):
+        n = shift = 0
+        while True:
+            b = ord(buf[pos])
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        last += n
+        ids.append(last)
+    return ids, pos
+
+def write_segment(path, postings):
+    """
+    Writes a segment to path. postings maps each term (a utf8 string) to a list of
+    (id, weight) tuples sorted by id; weights must fit in a byte.
+    """
+    terms = sorted(postings)
+    postings_out, weights_out, terms_out, index_out = [], [], [], []
+    docs = set()
+    postings_size = terms_size = ordinal = 0
+    for n, term in enumerate(terms):
+        pairs = postings[term]
+        if n % INDEX_INTERVAL == 0:
+            encode_varint(len(term), index_out)
+            index_out.append(term)
+            encode_varint(terms_size, index_out)
+        entry = []
+        encode_varint(len(term), entry)
+        entry.append(term)
+        encode_varint(len(pairs), entry)
+        encode_varint(postings_size, entry)
+        encode_varint(ordinal, entry)
+        entry = ''.join(entry)
+        terms_out.append(entry)
+        terms_size += len(entry)
+        chunk = []
+        encode_ids([id for id, weight in pairs], chunk)
+        chunk = ''.join(chunk)
+        postings_out.append(chunk)
+        postings_size += len(chunk)
+        weights_out.append(array('B', [weight for id, weight in pairs]).tostring())
+        ordinal += len(pairs)
+        docs.update([id for id, weight in pairs])
+    docs_out = []
+    encode_varint(len(docs), docs_out)
+    encode_ids(sorted(docs), docs_out)
+
+    sections = [''.join(postings_out), ''.join(weights_out), ''.join(terms_out), ''.join(index_out), ''.join(docs_out)]
+    offsets = []
+    offset = len(MAGIC)
+    for section in sections:
+        offsets.append(offset)
+        offset += len(section)
+    offsets.append(offset)
+    tmp = '%s.tmp' % path
+    f = open(tmp, 'wb')
+    try:
+        f.write(MAGIC)
+        for section in sections:
+            f.write(section)
+        f.write(FOOTER.pack(*(offsets + [len(terms)])))
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def _read_ids_file(path):
+    f = open(path, 'rb')
+    try:
+        buf = f.read()
+    finally:
+        f.close()
+    count, pos = decode_varint(buf, 0)
+    return decode_ids(buf, pos, count)[0]
+
+def _write_ids_file(path, ids):
+    out = []
+    encode_varint(len(ids), out)
+    encode_ids(sorted(ids), out)
+    tmp = '%s.tmp' % path
+    f = open(tmp, 'wb')
+    try:
+        f.write(''.join(out))
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+class Segment(object):
+    """
+    Read access to a segment file through a memory map.
+    """
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        buf = self._map
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError, "%s is not an index segment" % path
+        values = FOOTER.unpack(buf[len(buf)-FOOTER.size:])
+        self._postings, self._weights, self._terms, self._index, self._docs, self._end = values[:6]
+        self.term_count = values[6]
+        # the sparse term index:
+        self._index_terms = []
+        self._index_offsets = []
+        pos = self._index
+        while pos < self._docs:
+            size, pos = decode_varint(buf, pos)
+            self._index_terms.append(buf[pos:pos+size])
+            offset, pos = decode_varint(buf, pos + size)
+            self._index_offsets.append(self._terms + offset)
+        count, pos = decode_varint(buf, self._docs)
+        self.docs = array('l', decode_ids(buf, pos, count)[0])
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, id):
+        i = bisect.bisect_left(self.docs, id)
+        return i < len(self.docs) and self.docs[i] == id
+
+    def _scan(self, pos):
+        """
+        Yields the (term, df, postings position, weights position) entries of the
+        dictionary from pos on.
+        """
+        buf = self._map
+        end = self._index
+        while pos < end:
+            size, pos = decode_varint(buf, pos)
+            term = buf[pos:pos+size]
+            df, pos = decode_varint(buf, pos + size)
+            offset, pos = decode_varint(buf, pos)
+            ordinal, pos = decode_varint(buf, pos)
+            yield term, df, self._postings + offset, self._weights + ordinal
+
+    def _block(self, term):
+        i = bisect.bisect_right(self._index_terms, term) - 1
+        return self._index_offsets[max(i, 0)]
+
+    def lookup(self, term):
+        """
+        Returns the dictionary entry of term, or None.
+        """
+        if not self.term_count:
+            return None
+        for entry in self._scan(self._block(term)):
+            if entry[0] >= term:
+                if entry[0] == term:
+                    return entry
+                return None
+        return None
+
+    def prefixed(self, prefix):
+        """
+        Returns the dictionary entries of the terms starting with prefix.
+        """
+        entries = []
+        if not self.term_count:
+            return entries
+        for entry in self._scan(self._block(prefix)):
+            if entry[0] < prefix:
+                continue
+            if not entry[0].startswith(prefix):
+                break
+            entries.append(entry)
+        return entries
+
+    def terms(self):
+        if not self.term_count:
+            return iter(())
+        return self._scan(self._terms)
+
+    def postings(self, entry):
+        """
+        Returns the ids and the weights (an array of bytes) of a dictionary entry.
+        """
+        term, df, pos, wpos = entry
+        ids = decode_ids(self._map, pos, df)[0]
+        return ids, array('B', self._map[wpos:wpos+df])
+
+    def close(self):
+        self._map.close()
+
+class SegmentIndex(object):
+    """
+    An index stored in directory (created if needed). Several processes can search
+    it while one of them writes; writers are serialized with a lock file.
+    """
+    def __init__(self, directory, merge_factor=10, background_merge=True):
+        self.directory = directory
+        self.merge_factor = merge_factor
+        self.background_merge = background_merge
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+        self._stat = None
+        self._open = {} # segment name -> Segment
+        self._live = [] # [(Segment, deleted ids)] as listed in the manifest
+        self._merging = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Writers
+
+    def _acquire(self):
+        self._write_lock.acquire()
+        self._lock_depth += 1
+        if fcntl is not None and self._lock_depth == 1:
+            self._lock_file = open(self._path('write.lock'), 'w')
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _release(self):
+        self._lock_depth -= 1
+        if self._lock_file is not None and not self._lock_depth:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        self._write_lock.release()
+
+    def _read_manifest(self):
+        """
+        Returns the generation and the [name, tombstones generation] of each live segment.
+        """
+        try:
+            f = open(self._path(MANIFEST), 'rb')
+        except IOError:
+            return 0, []
+        try:
+            lines = f.read().split()
+        finally:
+            f.close()
+        return int(lines[0]), [[lines[i], int(lines[i+1])] for i in range(1, len(lines), 2)]
+
+    def _write_manifest(self, generation, segments):
+        tmp = self._path('%s.tmp' % MANIFEST)
+        f = open(tmp, 'wb')
+        try:
+            f.write('%d\n' % generation)
+            for name, del_gen in segments:
+                f.write('%s %d\n' % (name, del_gen))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, self._path(MANIFEST))
+
+    def _remove_files(self, segments):
+        for name, del_gen in segments:
+            for path in (self._path('%s.seg' % name), self._path('%s_%d.del' % (name, del_gen))):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _new_segment(self, generation, postings):
+        name = 'seg%06d' % generation
+        write_segment(self._path('%s.seg' % name), postings)
+        return name
+
+    def _deleted(self, name, del_gen):
+        if not del_gen:
+            return set()
+        return set(_read_ids_file(self._path('%s_%d.del' % (name, del_gen))))
+
+    def write(self, docs, deletes=()):
+        """
+        Stores docs, a dictionary mapping document ids to dictionaries of their
+        terms (unicode) and weights, replacing the previous version of the documents,
+        and deletes the documents with the ids in deletes.
+        """
+        if not docs and not deletes:
+            return
+        self._acquire()
+        try:
+            generation, segments = self._read_manifest()
+            generation += 1
+            removed = set(docs) | set(deletes)
+            replaced = []
+            for segment in segments:
+                name, del_gen = segment
+                reader = self._segment(name)
+                deleted = self._deleted(name, del_gen)
+                hits = [id for id in removed if id not in deleted and id in reader]
+                if hits:
+                    deleted.update(hits)
+                    _write_ids_file(self._path('%s_%d.del' % (name, generation)), deleted)
+                    segment[1] = generation
+                    if del_gen:
+                        replaced.append(self._path('%s_%d.del' % (name, del_gen)))
+            if docs:
+                segments.append([self._new_segment(generation, _postings(docs)), 0])
+            self._write_manifest(generation, segments)
+            for path in replaced:
+                os.remove(path)
+        finally:
+            self._release()
+        self.maybe_merge()
+
+    def rebuild(self, batches):
+        """
+        Replaces the whole index with the documents of batches, an iterable of
+        dictionaries like the ones given to write(); each batch is written to its
+        own segment, and the old segments are dropped once they are all written.
+        """
+        self._acquire()
+        try:
+            generation, old = self._read_manifest()
+            segments = []
+            for docs in batches:
+                if docs:
+                    generation += 1
+                    segments.append([self._new_segment(generation, _postings(docs)), 0])
+            self._write_manifest(generation + 1, segments)
+            self._remove_files(old)
+        finally:
+            self._release()
+        self.maybe_merge()
+
+    def clear(self):
+        self.rebuild([])
+
+    def maybe_merge(self):
+        """
+        Merges the smallest segments when there are more than merge_factor of them,
+        in a background thread if background_merge.
+        """
+        if len(self._read_manifest()[1]) <= self.merge_factor:
+            return
+        if self.background_merge:
+            self._lock.acquire()
+            try:
+                if self._merging is not None and self._merging.isAlive():
+                    return
+                self._merging = threading.Thread(target=self._merge_all)
+                self._merging.setDaemon(True)
+                self._merging.start()
+            finally:
+                self._lock.release()
+        else:
+            self.merge()
+
+    def _merge_all(self):
+        while len(self._read_manifest()[1]) > self.merge_factor:
+            if not self.merge():
+                break
+
+    def merge(self, count=None):
+        """
+        Merges the count (by default merge_factor) smallest segments into one; with
+        count=0 all of them. Writers are not blocked while the new segment is written.
+        Returns whether the segments were merged.
+        """
+        generation, segments = self._read_manifest()
+        count = count is None and self.merge_factor or count or len(segments)
+        if len(segments) < 2:
+            return False
+        postings = {}
+        merged_deleted = {} # segment name -> the ids left out of the merge
+        try:
+            sources = sorted(segments, key=lambda (name, del_gen): len(self._segment(name)))[:count]
+            for name, del_gen in sources:
+                reader = self._segment(name)
+                deleted = merged_deleted[name] = self._deleted(name, del_gen)
+                for entry in reader.terms():
+                    ids, weights = reader.postings(entry)
+                    pairs = [(id, weight) for id, weight in zip(ids, weights) if id not in deleted]
+                    if pairs:
+                        postings.setdefault(entry[0], []).extend(pairs)
+        except (IOError, OSError):
+            return False # the index was rebuilt meanwhile
+        for pairs in postings.values():
+            pairs.sort()
+
+        self._acquire()
+        try:
+            generation, segments = self._read_manifest()
+            current = dict([(name, del_gen) for name, del_gen in segments])
+            if [name for name, del_gen in sources if name not in current]:
+                return False # the index was rebuilt meanwhile
+            generation += 1
+            merged = postings and [self._new_segment(generation, postings), 0] or None
+            # documents deleted while merging (the tombstones read above may be gone):
+            deleted = set()
+            for name, del_gen in sources:
+                if current[name] != del_gen:
+                    deleted.update(self._deleted(name, current[name]) - merged_deleted[name])
+            if merged and deleted:
+                _write_ids_file(self._path('%s_%d.del' % (merged[0], generation)), deleted)
+                merged[1] = generation
+            names = set([name for name, del_gen in sources])
+            segments = [s for s in segments if s[0] not in names] + (merged and [merged] or [])
+            self._write_manifest(generation, segments)
+            self._remove_files([(name, current[name]) for name in names])
+        finally:
+            self._release()
+        return True
+
+    def optimize(self):
+        """
+        Merges all the segments into one, synchronously.
+        """
+        self.merge(0)
+
+    # Readers
+
+    def _segment(self, name):
+        self._lock.acquire()
+        try:
+            try:
+                return self._open[name]
+            except KeyError:
+                segment = self._open[name] = Segment(self._path('%s.seg' % name))
+                return segment
+        finally:
+            self._lock.release()
+
+    def segments(self):
+        """
+        Returns the live segments, each with the set of ids of its deleted documents,
+        reloading them if the manifest changed.
+        """
+        for attempt in range(10):
+            try:
+                st = os.stat(self._path(MANIFEST))
+                stat = (st.st_ino, st.st_mtime, st.st_size)
+            except OSError:
+                stat = None
+            if stat == self._stat:
+                return self._live
+            try:
+                generation, segments = self._read_manifest()
+                live = [(self._segment(name), self._deleted(name, del_gen)) for name, del_gen in segments]
+            except (IOError, OSError):
+                # files removed by a merge before we read them, try again:
+                time.sleep(0.01)
+                continue
+            self._lock.acquire()
+            try:
+                names = set([name for name, del_gen in segments])
+                for name in self._open.keys():
+                    if name not in names:
+                        del self._open[name]
+                self._live = live
+                self._stat = stat
+            finally:
+                self._lock.release()
+            return live
+        raise IOError, "Cannot read the index in %s" % self.directory
+
+    def search(self, query_words):
+        """
+        Returns a dictionary mapping the ids of the documents matching all of
+        query_words, a list of (word, exact) tuples, to their rank: the sum of the
+        weights of each query word (the best one among the terms starting with it,
+        if not exact).
+        """
+        segments = self.segments()
+        matches = []
+        for word, exact in query_words:
+            term = word.encode('utf8')
+            entries = []
+            for segment, deleted in segments:
+                if exact:
+                    entry = segment.lookup(term)
+                    found = entry and [entry] or []
+                else:
+                    found = segment.prefixed(term)
+                entries.extend([(segment, deleted, entry) for entry in found])
+            matches.append(entries)
+        # start with the rarest words:
+        matches.sort(key=lambda entries: sum([entry[1] for segment, deleted, entry in entries]))
+        ranks = None
+        for entries in matches:
+            scores = {}
+            for segment, deleted, entry in entries:
+                ids, weights = segment.postings(entry)
+                for id, weight in zip(ids, weights):
+                    if (ranks is None or id in ranks) and id not in deleted and weight > scores.get(id, 0):
+                        scores[id] = weight
+            if ranks is not None:
+                for id in scores:
+                    scores[id] += ranks[id]
+            ranks = scores
+            if not ranks:
+                break
+        return ranks or {}
+
+    def stats(self):
+        segments = self.segments()
+        return {
+            'segments': len(segments),
+            'documents': sum([len(segment) - len(deleted) for segment, deleted in segments]),
+            'deleted': sum([len(deleted) for segment, deleted in segments]),
+        }
+
+def _postings(docs):
+    postings = {}
+    for id in sorted(docs):
+        for term, weight in docs[id].items():
+            postings.setdefault(term.encode('utf8'), []).append((id, weight))
+    return postings
@@ -2,3 +2,77 @@ from django.conf import settings
 
 FTS_BACKEND = getattr(settings, 'FTS_BACKEND', 'simple://')
 FTS_CONFIGURE_ALL_BACKENDS = getattr(settings, 'FTS_CONFIGURE_ALL_BACKENDS', True)
+
+# Number of instances the simple backend analyzes before writing their words
+# and index rows to the database in bulk.
+FTS_BATCH_SIZE = getattr(settings, 'FTS_BATCH_SIZE', 100)
+
+# Number of instances loaded at a time (and committed together) when walking a
+# whole table to rebuild its index.
+FTS_CHUNK_SIZE = getattr(settings, 'FTS_CHUNK_SIZE', 1000)
+
+# Number of rows a loader buffers per table before writing them (see fts.loaders).
+FTS_LOADER_BUFFER_SIZE = getattr(settings, 'FTS_LOADER_BUFFER_SIZE', 10000)
+
+# Number of stems cached per language (see fts.words.cache), 0 disables the cache.
+FTS_STEM_CACHE_SIZE = getattr(settings, 'FTS_STEM_CACHE_SIZE', 10000)
+
+# Search results cache of the managers without a cache_results argument: None (no
+# cache), 'local' (an LRU cache of FTS_RESULT_CACHE_SIZE searches in each process) or
+# 'django' (Django's cache, for FTS_RESULT_CACHE_TIMEOUT seconds). See fts.results.
+FTS_RESULT_CACHE = getattr(settings, 'FTS_RESULT_CACHE', None)
+FTS_RESULT_CACHE_SIZE = getattr(settings, 'FTS_RESULT_CACHE_SIZE', 1000)
+FTS_RESULT_CACHE_TIMEOUT = getattr(settings, 'FTS_RESULT_CACHE_TIMEOUT', 300)
+
+# Deferred index updates (see fts.queue): None to update the indexes of an instance
+# when it is saved, 'local' to queue it in the process until the end of the request
+# or 'db' to queue it in the fts_indexqueue table for fts_process_queue.
+FTS_INDEX_QUEUE = getattr(settings, 'FTS_INDEX_QUEUE', None)
+# Number of instances a thread queues ('local') before updating their indexes anyway,
+# once the save that reaches it commits.
+FTS_INDEX_QUEUE_LIMIT = getattr(settings, 'FTS_INDEX_QUEUE_LIMIT', 1000)
+# Number of queued instances updated at a time.
+FTS_INDEX_QUEUE_BATCH = getattr(settings, 'FTS_INDEX_QUEUE_BATCH', 500)
+
+# Number of objects (or words) whose rows fts_vacuum deletes at a time.
+FTS_VACUUM_BATCH_SIZE = getattr(settings, 'FTS_VACUUM_BATCH_SIZE', 1000)
+
+# Number of word ids the simple backend keeps in each process (shared by all the
+# managers), and how many of the most frequent words are loaded when it is first used.
+FTS_WORD_ID_CACHE_SIZE = getattr(settings, 'FTS_WORD_ID_CACHE_SIZE', 100000)
+FTS_WORD_ID_CACHE_WARM = getattr(settings, 'FTS_WORD_ID_CACHE_WARM', 0)
+
+# Document frequency (postings) of the rarest word of a query up to which the simple
+# backend searches joining the index once per word; past it, the objects of each
+# word are intersected instead.
+FTS_JOIN_DF_LIMIT = getattr(settings, 'FTS_JOIN_DF_LIMIT', 10000)
+
+# Maximum number of words a query word that is not exact (a prefix) expands to in the
+# simple backend; the ones indexed for the most objects are kept.
+FTS_PREFIX_EXPANSIONS = getattr(settings, 'FTS_PREFIX_EXPANSIONS', 1000)
+
+# BM25 parameters of the simple backend's 'bm25' ranking: term frequency saturation
+# (k1) and document length normalization (b).
+FTS_BM25_K1 = getattr(settings, 'FTS_BM25_K1', 1.2)
+FTS_BM25_B = getattr(settings, 'FTS_BM25_B', 0.75)
+
+# Whether the pgsql backend's vectors are computed by a trigger of each table, so
+# saving an instance does not update them from Python.
+FTS_PGSQL_TRIGGER = getattr(settings, 'FTS_PGSQL_TRIGGER', False)
+
+# Maximum number of results of a search of the memory, segment and blocks backends,
+# which search outside the database: the best ranked are fetched by primary key.
+FTS_MAX_RESULTS = getattr(settings, 'FTS_MAX_RESULTS', 1000)
+
+# Maximum number of postings of a word in each block of the blocks backend.
+FTS_BLOCK_SIZE = getattr(settings, 'FTS_BLOCK_SIZE', 1024)
+
+# Directory where the segment backend keeps the indexes (one directory per manager).
+FTS_SEGMENT_DIR = getattr(settings, 'FTS_SEGMENT_DIR', None)
+
+# Number of segments an index of the segment backend can have before the smallest
+# ones are merged.
+FTS_SEGMENT_MERGE_FACTOR = getattr(settings, 'FTS_SEGMENT_MERGE_FACTOR', 10)
+
+# Number of postings written to each segment when rebuilding a whole index.
+FTS_SEGMENT_BUFFER_SIZE = getattr(settings, 'FTS_SEGMENT_BUFFER_SIZE', 1000000)
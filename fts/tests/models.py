@@ -21,3 +21,49 @@ class Blog(fts.SearchableModel):
 
     def __unicode__(self):
         return u"%s" % (self.title)
+
+class DummyBlog(fts.DummySearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    def __unicode__(self):
+        return u"%s" % (self.title)
+
+class TaggedBlog(Blog):
+    """
+    A Blog (multi-table inheritance) with its own search manager.
+    """
+    tags = models.CharField(max_length=100)
+
+    # managers of the same model need their own namespace
+    tagged = fts.SearchManager(fields=('tags',), namespace='tags')
+
+class DummyComment(fts.DummySearchableModel):
+    blog = models.ForeignKey(Blog)
+    text = models.TextField()
+
+class MemoryBlog(fts.MemorySearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+class SegmentBlog(fts.SegmentSearchableModel):
+    """
+    The tests set the directory of its index.
+    """
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+class BlocksBlog(fts.BlocksSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+class Headline(fts.SearchableModel):
+    title = models.CharField(max_length=100)
+
+    objects = fts.SearchManager(fields=('title',), stem_words=False, prefix_index=True, min_gram=3)
+
+class CachedBlog(fts.SearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.SearchManager(fields=('title', 'body'), cache_results='local')
@@ -1,3 +1,1164 @@
 # -*- coding: utf-8 -*-
 r"""
 """
+import os
+import shutil
+import tempfile
+import itertools
+import math
+import sys
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, TransactionTestCase
+
+from fts.words.porter import Stemmer
+from fts.words.analyzer import Analyzer, MAX_WORD_LENGTH
+from fts.words.cache import CachedStemmer, get_stemmer
+from fts.lru import LRUCache
+from fts.segments import SegmentIndex, encode_ids, decode_ids
+from fts.backends.memory import MemoryIndex
+from fts import indexes, loaders, results, queue
+from fts.backends import base, simple, pgsql, blocks
+from fts.backends.base import InvalidFtsBackendError, get_search_managers
+from fts.management.commands import fts_reindex
+from fts.models import Word, Index, WordStat, IndexStat
+from fts.tests.models import Blog, DummyBlog, TaggedBlog, DummyComment, MemoryBlog, SegmentBlog, BlocksBlog, Headline, \
+    CachedBlog
+
+class IndexTestCase(TestCase):
+    """
+    Starts every test with empty indexes: the test database is rolled back, but the
+    memory and segment indexes and the word id cache (with the words created by the
+    transaction) are not.
+    """
+    def setUp(self):
+        simple._WORD_IDS.clear()
+        simple._WORD_IDS_LOCAL.created = set()
+        MemoryBlog.objects.get_index().clear()
+        self.directory = tempfile.mkdtemp()
+        SegmentBlog.objects.directory = self.directory
+        SegmentBlog.objects._index = None
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+class BulkWriteTest(IndexTestCase):
+    def _queries(self, function, *args, **kwargs):
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        start = len(connection.queries)
+        try:
+            function(*args, **kwargs)
+            return [query['sql'] for query in connection.queries[start:]]
+        finally:
+            settings.DEBUG = debug
+
+    def test_update_pks(self):
+        blogs = []
+        for i in range(5):
+            blog = Blog(title=u'bulk %d' % i, body=u'written words')
+            blog.save(update_index=False)
+            blogs.append(blog)
+        queries = self._queries(Blog.objects.update_index, [b.pk for b in blogs])
+        # executemany is logged as '<n> times: <sql>'
+        inserts = [sql for sql in queries if 'INSERT INTO %s ' % connection.ops.quote_name(Index._meta.db_table) in sql]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Index.objects.filter(object_id__in=[b.pk for b in blogs]).count(), 5 * 4)
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'bulk written')]), [b.pk for b in blogs])
+        self.assertEqual(Word.objects.filter(word=u'written').count(), 1)
+
+    def test_batches(self):
+        blogs = [Blog.objects.create(title=u'batched', body=u'words') for i in range(5)]
+        batch_size = Blog.objects.batch_size
+        Blog.objects.batch_size = 2
+        try:
+            queries = self._queries(Blog.objects.update_index, [b.pk for b in blogs])
+        finally:
+            Blog.objects.batch_size = batch_size
+        selects = [sql for sql in queries if sql.startswith('SELECT id, object_id, word_id')]
+        self.assertEqual(len(selects), 3)
+        self.assertEqual(Blog.objects.search(u'batched').count(), 5)
+
+class ChunkTest(IndexTestCase):
+    def setUp(self):
+        super(ChunkTest, self).setUp()
+        self.blogs = [Blog.objects.create(title=u'chunked %d' % i, body=u'walked') for i in range(5)]
+        self.chunk_size = Blog.objects.chunk_size
+        Blog.objects.chunk_size = 2
+
+    def tearDown(self):
+        Blog.objects.chunk_size = self.chunk_size
+        super(ChunkTest, self).tearDown()
+
+    def test_iter_chunks(self):
+        pks = [b.pk for b in self.blogs]
+        self.assertEqual([[b.pk for b in chunk] for chunk in Blog.objects._iter_chunks()], [pks[:2], pks[2:4], pks[4:]])
+        self.assertEqual([[b.pk for b in chunk] for chunk in Blog.objects._iter_chunks(pks[2])], [pks[3:]])
+        self.assertEqual(list(Blog.objects._iter_chunks(pks[-1])), [])
+
+    def test_pk_ranges(self):
+        pks = [b.pk for b in self.blogs]
+        self.assertEqual(Blog.objects._pk_ranges(), [(None, pks[1]), (pks[1], pks[3]), (pks[3], pks[4])])
+        self.assertEqual(Blog.objects._pk_ranges(pks[3]), [(pks[3], pks[4])])
+
+    def test_progress(self):
+        calls = []
+        stats = Blog.objects.update_index(progress=lambda last_pk, count: calls.append((last_pk, count)))
+        pks = [b.pk for b in self.blogs]
+        self.assertEqual(calls, [(pks[1], 2), (pks[3], 2), (pks[4], 1)])
+        self.assertEqual(stats['documents'], 5)
+
+    def test_resume(self):
+        pks = [b.pk for b in self.blogs]
+        Index.objects.all().delete()
+        Blog.objects.update_index(since_pk=pks[1])
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'walked')]), pks[2:])
+
+class DiffUpdateTest(IndexTestCase):
+    def _postings(self, blog):
+        return dict([(word, (id, weight, tf)) for id, word, weight, tf in
+                     Index.objects.filter(object_id=blog.pk).values_list('id', 'word__word', 'weight', 'tf')])
+
+    def test_update(self):
+        blog = Blog.objects.create(title=u'diffed', body=u'kept removed changed')
+        before = self._postings(blog)
+        blog.body = u'kept added kept changed changed'
+        blog.save()
+        after = self._postings(blog)
+        self.assertEqual(sorted(after.keys()), [u'ad', u'chang', u'dif', u'kept'])
+        # unchanged postings are left alone, changed ones are updated in place
+        self.assertEqual(after[u'kept'][0], before[u'kept'][0])
+        self.assertEqual(after[u'kept'][2], 2)
+        self.assertEqual(after[u'chang'][0], before[u'chang'][0])
+        self.assertEqual(after[u'chang'][2], 2)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'removed')], [])
+        self.assertEqual([b.pk for b in Blog.objects.search(u'added')], [blog.pk])
+
+    def test_unchanged(self):
+        blog = Blog.objects.create(title=u'same', body=u'same words')
+        before = self._postings(blog)
+        stats = Blog.objects.index_stats()
+        blog.save()
+        self.assertEqual(self._postings(blog), before)
+        self.assertEqual(Blog.objects.index_stats(), stats)
+
+class LoaderTest(TransactionTestCase):
+    def setUp(self):
+        simple._WORD_IDS.clear()
+        self.blogs = [Blog.objects.create(title=u'loaded', body=u'loaded words') for i in range(3)]
+
+    def assertIndexes(self):
+        if loaders.ENGINE != 'sqlite3':
+            return
+        names = [name for name, sql in loaders.secondary_indexes(Index)]
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s", [Index._meta.db_table])
+        existing = [loaders.qn(name) for name, in cursor.fetchall()]
+        self.assertEqual(sorted([name for name in existing if name in names]), sorted(names))
+
+    def test_dump(self):
+        loader = loaders.get_loader(buffer_size=2)
+        dumping = simple.dump_indexes([Blog.objects], loader=loader)
+        self.assertEqual(dumping['updates'][0]['documents'], 3)
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'loaded')]), [b.pk for b in self.blogs])
+        self.assertIndexes()
+
+    def test_failed_dump(self):
+        loader = loaders.get_loader()
+        def write(model, rows):
+            raise ValueError
+        loader.write = write
+        self.assertRaises(ValueError, simple.dump_indexes, [Blog.objects], loader=loader)
+        self.assertIndexes()
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'loaded')]), [b.pk for b in self.blogs])
+
+    def test_composite_indexes(self):
+        names = [name for name, sql in loaders.secondary_indexes(Index)]
+        self.assertTrue(loaders.qn('fts_index_word') in names)
+        self.assertTrue(loaders.qn('fts_index_object') in names)
+
+    def test_file_loader(self):
+        directory = tempfile.mkdtemp()
+        try:
+            simple.dump_indexes([Blog.objects], loader=loaders.FileLoader(directory))
+            lines = open(os.path.join(directory, '%s.txt' % Index._meta.db_table)).read().splitlines()
+            self.assertEqual(len(lines), 3 * 2)
+            self.assertEqual(len(lines[0].split('\t')), len(loaders.columns(Index)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_copy_rows(self):
+        self.assertEqual(loaders._copy_rows([(1, None, u'tab\there\\'), (2, 'new\nline', u'\xe9')]),
+                         '1\t\\N\ttab\\there\\\\\n2\tnew\\nline\t\xc3\xa9\n')
+
+    def test_keep_indexes(self):
+        loader = loaders.get_loader(drop_indexes=False)
+        self.assertFalse(loader.drop_indexes)
+        simple.dump_indexes([Blog.objects], loader=loader)
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'loaded')]), [b.pk for b in self.blogs])
+
+class SerialPool(object):
+    """
+    Runs the tasks of a process pool in this process: the test database is in memory.
+    """
+    def imap(self, function, tasks):
+        return itertools.imap(function, tasks)
+
+    def terminate(self):
+        pass
+
+class ParallelTest(IndexTestCase):
+    def setUp(self):
+        super(ParallelTest, self).setUp()
+        self.blogs = [Blog.objects.create(title=u'parallel %d' % i, body=u'analyzed words') for i in range(5)]
+        self.chunk_size = Blog.objects.chunk_size
+        Blog.objects.chunk_size = 2
+
+    def tearDown(self):
+        Blog.objects.chunk_size = self.chunk_size
+        super(ParallelTest, self).tearDown()
+
+    def test_analyze_range(self):
+        pks = [b.pk for b in self.blogs]
+        hi, pairs = simple._analyze_range(('tests', 'Blog', 'objects', pks[0], pks[2]))
+        self.assertEqual(hi, pks[2])
+        self.assertEqual([pair[0] for pair in pairs], pks[1:3])
+        self.assertEqual(pairs[0][1:], Blog.objects._get_item_terms(self.blogs[1]))
+
+    def test_analyze_parallel(self):
+        self.assertEqual(list(Blog.objects._analyze_parallel(SerialPool())), list(Blog.objects._analyze_chunks()))
+        self.assertEqual(list(Blog.objects._analyze_parallel(SerialPool(), self.blogs[2].pk)),
+                         list(Blog.objects._analyze_chunks(self.blogs[2].pk)))
+
+    def test_update_index(self):
+        open_pool = simple._open_pool
+        simple._open_pool = lambda processes: SerialPool()
+        try:
+            Index.objects.all().delete()
+            self.assertEqual(Blog.objects.update_index(processes=2)['documents'], 5)
+            self.assertEqual(Blog.objects.search(u'analyzed').count(), 5)
+            simple.dump_indexes([Blog.objects], loader=loaders.get_loader(drop_indexes=False), processes=2)
+            self.assertEqual(Blog.objects.search(u'analyzed').count(), 5)
+        finally:
+            simple._open_pool = open_pool
+
+    def test_dumping_without_pool(self):
+        # opening a pool would commit the dump part-way through
+        open_pool = simple._open_pool
+        simple._open_pool = lambda processes: self.fail('pool opened')
+        try:
+            self.assertRaises(ValueError, Blog.objects._update_index, None, {}, processes=2)
+        finally:
+            simple._open_pool = open_pool
+        self.assertEqual(Blog.objects.search(u'analyzed').count(), 5)
+
+class AnalyzerTest(TestCase):
+    def test_fold(self):
+        analyzer = Analyzer('en')
+        self.assertEqual(analyzer.fold(u'Caf\xe9 \u0391\u03b8\u03ae\u03bd\u03b1'), u'cafe \u03b1\u03b8\u03b7\u03bd\u03b1')
+        self.assertEqual(analyzer.fold('Plain'), u'plain')
+        self.assertEqual(Analyzer('en', strip_accents=False).fold(u'Caf\xc9'), u'caf\xe9')
+
+    def test_analyze(self):
+        analyzer = Analyzer('en')
+        self.assertEqual(analyzer.analyze(u'The running dogs, (caf\xe9s)'), set([u'run', u'dog', u'cafe']))
+        self.assertEqual(analyzer.analyze(u'a bb ccc', minlen=1), set([u'bb', u'ccc']))
+        self.assertEqual(analyzer.analyze(u'x' * (MAX_WORD_LENGTH + 1)), set())
+        self.assertEqual(Analyzer('en', stem_words=False).analyze(u'running dogs'), set([u'running', u'dogs']))
+        self.assertEqual(analyzer.analyze_many([u'dogs', u'the']), [set([u'dog']), set()])
+
+    def test_count(self):
+        self.assertEqual(Analyzer('en').count(u'Dogs dog, the DOG'), {u'dog': 3})
+
+class LRUCacheTest(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertFalse('b' in cache)
+        self.assertEqual((cache.get('a'), cache.get('c'), cache.get('b')), (1, 3, None))
+        self.assertEqual(cache.stats(), {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+        cache.delete('a')
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), None)
+
+class CountingStemmer(object):
+    calls = 0
+
+    def __init__(self, language):
+        pass
+
+    def __call__(self, word):
+        CountingStemmer.calls += 1
+        return word[:3]
+
+class StemCacheTest(TestCase):
+    def test_cache(self):
+        CountingStemmer.calls = 0
+        stem = CachedStemmer('en', 2, CountingStemmer)
+        self.assertEqual([stem(word) for word in ['running', 'running', 'jumped', 'running']], ['run', 'run', 'jum', 'run'])
+        self.assertEqual(CountingStemmer.calls, 2)
+        stem('walked')
+        stem('jumped')
+        self.assertEqual(CountingStemmer.calls, 4)
+
+    def test_shared(self):
+        self.assertTrue(get_stemmer('en') is get_stemmer('en'))
+        self.assertEqual(get_stemmer('en')(u'running'), u'run')
+
+class PorterStemmerTest(TestCase):
+    def test_vocabulary(self):
+        """
+        The stems of porter_voc.txt (word stem per line) were made by the original
+        implementation of the Porter stemmer.
+        """
+        stemmer = Stemmer('en')
+        for line in open(os.path.join(os.path.dirname(__file__), 'porter_voc.txt')):
+            word, stem = line.split()
+            self.assertEqual(stemmer(word), stem, word)
+            self.assertEqual(stemmer(unicode(word)), stem, word)
+
+    def test_calls(self):
+        stemmer = Stemmer('en')
+        self.assertEqual(stemmer('as'), 'as')
+        self.assertEqual(stemmer('Running'), 'run')
+        self.assertEqual(stemmer(u'caf\xe9s'), u'caf\xe9')
+        self.assertEqual(stemmer.stem('xxrunningyy', 2, 8), 'run')
+        self.assertEqual(Stemmer()('Running'), 'running')
+
+class PrefixIndexTest(IndexTestCase):
+    def test_grams(self):
+        self.assertEqual(Headline.objects._get_grams(u'ox'), [u'ox'])
+        self.assertEqual(Headline.objects._get_grams(u'oxen'), [u'oxe', u'oxen'])
+
+    def test_short_words(self):
+        short = Headline.objects.create(title=u'Ox on TV')
+        long = Headline.objects.create(title=u'Oxford')
+        self.assertEqual(sorted([h.pk for h in Headline.objects.search(u'ox')]), [short.pk, long.pk])
+        self.assertEqual([h.pk for h in Headline.objects.search(u'tv')], [short.pk])
+        self.assertEqual([h.pk for h in Headline.objects.search(u'oxfo')], [long.pk])
+        self.assertEqual([h.pk for h in Headline.objects.search(u'tvs')], [])
+
+    def test_long_words(self):
+        max_gram = Headline.objects.max_gram
+        Headline.objects.max_gram = 5
+        try:
+            self.assertEqual(Headline.objects._get_grams(u'oxfordshire'), [u'oxf', u'oxfo', u'oxfor'])
+            headline = Headline.objects.create(title=u'Oxfordshire')
+            self.assertEqual([h.pk for h in Headline.objects.search(u'oxfordian')], [headline.pk])
+            self.assertEqual(sorted(Headline.objects._get_query_words(u'oxfordian ox oxf')), [(u'ox', False), (u'oxf', True), (u'oxfor', True)])
+        finally:
+            Headline.objects.max_gram = max_gram
+
+class MemoryIndexTest(TestCase):
+    def setUp(self):
+        self.index = MemoryIndex()
+        self.index.update(1, {u'apple': 'A', u'pear': 'C'})
+        self.index.update(2, {u'apple': 'C', u'apricot': 'A'})
+
+    def test_search(self):
+        self.assertEqual(self.index.search([(u'apple', True)]), {1: 10, 2: 2})
+        self.assertEqual(self.index.search([(u'apple', True), (u'pear', True)]), {1: 12})
+        self.assertEqual(self.index.search([(u'ap', False)]), {1: 10, 2: 10})
+        self.assertEqual(self.index.search([(u'ap', True)]), {})
+
+    def test_update(self):
+        self.index.update(1, {u'pear': 'A'})
+        self.assertEqual(self.index.search([(u'apple', True)]), {2: 2})
+        self.assertEqual(self.index.search([(u'pear', True)]), {1: 10})
+        self.index.remove(2)
+        self.assertEqual(len(self.index), 1)
+        self.assertEqual(self.index.search([(u'ap', False)]), {})
+        self.assertFalse(u'apricot' in self.index.words)
+
+    def test_save(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'index')
+            self.index.save(path)
+            index = MemoryIndex()
+            index.load(path)
+            self.assertEqual(index.docs, self.index.docs)
+            self.assertEqual(index.search([(u'ap', False)]), {1: 10, 2: 10})
+        finally:
+            shutil.rmtree(directory)
+
+class MemoryBackendTest(IndexTestCase):
+    def test_search(self):
+        first = MemoryBlog.objects.create(title=u'memory', body=u'kept in memory')
+        second = MemoryBlog.objects.create(title=u'other', body=u'kept too')
+        self.assertEqual(sorted([(b.pk, b.rank) for b in MemoryBlog.objects.search(u'kept', rank_field='rank')]), [(first.pk, 10), (second.pk, 10)])
+        self.assertEqual([b.pk for b in MemoryBlog.objects.search(u'kept memory')], [first.pk])
+        second.body = u'memory lost'
+        second.save()
+        self.assertEqual([b.pk for b in MemoryBlog.objects.search(u'kept')], [first.pk])
+
+    def test_limit(self):
+        blogs = [MemoryBlog.objects.create(title=u'common', body=u'word') for i in range(5)]
+        blogs.append(MemoryBlog.objects.create(title=u'other', body=u'common'))
+        max_results = base.FTS_MAX_RESULTS
+        base.FTS_MAX_RESULTS = 3
+        try:
+            # the best ranked (then the first) matches only are fetched
+            self.assertEqual(sorted([b.pk for b in MemoryBlog.objects.search(u'common')]), [b.pk for b in blogs[:3]])
+            self.assertEqual(MemoryBlog.objects.search(u'common', rank_field='rank', limit=6).count(), 6)
+        finally:
+            base.FTS_MAX_RESULTS = max_results
+
+    def test_update_index(self):
+        blogs = [MemoryBlog(title=u'rebuilt', body=u'index') for i in range(3)]
+        for blog in blogs:
+            blog.save(update_index=False)
+        self.assertEqual(MemoryBlog.objects.search(u'rebuilt').count(), 0)
+        stats = MemoryBlog.objects.update_index()
+        self.assertEqual((stats['documents'], stats['postings']), (3, 6))
+        self.assertEqual(MemoryBlog.objects.search(u'rebuilt').count(), 3)
+
+class InterleavedSegmentIndex(SegmentIndex):
+    """
+    Writes the documents of interleave when a merge (or anything else) takes the write
+    lock, as a concurrent writer would.
+    """
+    interleave = None
+
+    def _acquire(self):
+        if self.interleave is not None:
+            docs, self.interleave = self.interleave, None
+            self.write(docs)
+        SegmentIndex._acquire(self)
+
+class SegmentIndexTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_during_merge(self):
+        index = InterleavedSegmentIndex(self.directory, merge_factor=100, background_merge=False)
+        index.write({1: {u'apple': 1}, 2: {u'apple': 1}})
+        index.write({3: {u'apple': 1}})
+        index.write({2: {u'apple': 2}}) # tombstones 2 in the first segment
+        # replaces 1, tombstoned again in the first segment while it is merged:
+        index.interleave = {1: {u'pear': 1}, 2: {u'apple': 3}}
+        self.assertTrue(index.merge(0))
+        self.assertEqual(index.search([(u'apple', True)]), {2: 3, 3: 1})
+        self.assertEqual(index.search([(u'pear', True)]), {1: 1})
+        self.assertEqual(index.stats()['documents'], 3)
+
+    def test_encoding(self):
+        ids = [1, 2, 130, 20000, 2 ** 40]
+        out = []
+        encode_ids(ids, out)
+        self.assertEqual(decode_ids(''.join(out), 0, len(ids)), (ids, len(''.join(out))))
+
+    def test_write(self):
+        index = SegmentIndex(self.directory, background_merge=False)
+        index.write({1: {u'apple': 10, u'pear': 2}, 2: {u'apricot': 10}})
+        index.write({3: {u'apple': 4}}, deletes=[2])
+        self.assertEqual(index.search([(u'apple', True)]), {1: 10, 3: 4})
+        self.assertEqual(index.search([(u'ap', False)]), {1: 10, 3: 4})
+        self.assertEqual(index.search([(u'apple', True), (u'pear', True)]), {1: 12})
+        self.assertEqual(index.stats(), {'segments': 2, 'documents': 2, 'deleted': 1})
+        # another process sees the same index
+        self.assertEqual(SegmentIndex(self.directory).search([(u'apple', True)]), {1: 10, 3: 4})
+
+    def test_merge(self):
+        index = SegmentIndex(self.directory, merge_factor=2, background_merge=False)
+        for id in range(1, 5):
+            index.write({id: {u'word': id}})
+        self.assertTrue(index.stats()['segments'] <= 2)
+        index.write({}, deletes=[4])
+        index.optimize()
+        self.assertEqual(index.stats(), {'segments': 1, 'documents': 3, 'deleted': 0})
+        self.assertEqual(index.search([(u'word', True)]), {1: 1, 2: 2, 3: 3})
+
+    def test_rebuild(self):
+        index = SegmentIndex(self.directory, background_merge=False)
+        index.write({1: {u'old': 1}})
+        index.rebuild([{2: {u'new': 1}}, {3: {u'new': 2}}])
+        self.assertEqual(index.search([(u'old', True)]), {})
+        self.assertEqual(index.search([(u'new', True)]), {2: 1, 3: 2})
+        index.clear()
+        self.assertEqual(index.stats()['documents'], 0)
+
+class SegmentBackendTest(IndexTestCase):
+    def test_search(self):
+        blog = SegmentBlog.objects.create(title=u'segmented', body=u'stored on disk')
+        other = SegmentBlog.objects.create(title=u'other', body=u'stored too')
+        self.assertEqual(sorted([b.pk for b in SegmentBlog.objects.search(u'stored')]), [blog.pk, other.pk])
+        other.body = u'moved'
+        other.save()
+        self.assertEqual([b.pk for b in SegmentBlog.objects.search(u'stored')], [blog.pk])
+        SegmentBlog.objects.get_index().clear()
+        self.assertEqual(SegmentBlog.objects.update_index()['documents'], 2)
+        self.assertEqual([b.pk for b in SegmentBlog.objects.search(u'moved')], [other.pk])
+
+    def test_uri_directory(self):
+        from fts import get_fts
+        from fts.backends import segment
+        directory = segment._SEGMENT_DIR
+        try:
+            fts, model, manager = get_fts('segment://%s/' % self.directory)
+            self.assertEqual(fts.directory, self.directory)
+            SegmentBlog.objects.directory = None
+            self.assertEqual(SegmentBlog.objects.get_index().directory,
+                os.path.join(self.directory, 'tests.segmentblog.objects'))
+            fts, model, manager = get_fts('segment://?directory=%s' % self.directory)
+            self.assertEqual(fts.directory, self.directory)
+        finally:
+            segment._SEGMENT_DIR = directory
+
+class PlannerTest(IndexTestCase):
+    def setUp(self):
+        super(PlannerTest, self).setUp()
+        self.blogs = [Blog.objects.create(title=u'planned', body=u'common words') for i in range(3)]
+        self.blogs.append(Blog.objects.create(title=u'planned rare', body=u'common words'))
+
+    def test_plan(self):
+        self.assertEqual(Blog.objects.plan(u'')['strategy'], 'all')
+        self.assertEqual(Blog.objects.plan(u'common missing')['strategy'], 'empty')
+        plan = Blog.objects.plan(u'common rare')
+        self.assertEqual(plan['strategy'], 'joins')
+        self.assertEqual([(w['word'], w['df']) for w in plan['words']], [(u'rare', 1), (u'common', 4)])
+
+    def test_strategies(self):
+        limit = simple.FTS_JOIN_DF_LIMIT
+        try:
+            for df_limit, strategy in ((1000, 'joins'), (0, 'intersect')):
+                simple.FTS_JOIN_DF_LIMIT = df_limit
+                self.assertEqual(Blog.objects.plan(u'common planned')['strategy'], strategy)
+                self.assertEqual(Blog.objects.search(u'common planned').count(), 4)
+                self.assertEqual([b.pk for b in Blog.objects.search(u'common rare')], [self.blogs[-1].pk])
+                self.assertEqual([b.pk for b in Blog.objects.search(u'common missing')], [])
+        finally:
+            simple.FTS_JOIN_DF_LIMIT = limit
+
+class StatsTest(IndexTestCase):
+    def _stats(self):
+        return (sorted(WordStat.objects.values_list('word__word', 'content_type', 'namespace', 'doc_count')),
+                sorted(IndexStat.objects.values_list('content_type', 'namespace', 'documents', 'postings', 'length')),
+                sorted(Word.objects.values_list('word', 'doc_count')))
+
+    def test_live(self):
+        first = Blog.objects.create(title=u'counted', body=u'words words')
+        second = Blog.objects.create(title=u'counted', body=u'others')
+        self.assertEqual(Blog.objects.word_stats([u'count', u'word', u'other', u'missing']), {u'count': 2, u'word': 1, u'other': 1})
+        self.assertEqual(Blog.objects.index_stats(), {'documents': 2, 'postings': 4, 'length': 5})
+        self.assertEqual(Word.objects.get(word=u'count').doc_count, 2)
+        second.delete()
+        self.assertEqual(Blog.objects.word_stats([u'count', u'other']), {u'count': 1, u'other': 0})
+        self.assertEqual(Blog.objects.index_stats(), {'documents': 1, 'postings': 2, 'length': 3})
+        self.assertEqual(Word.objects.get(word=u'count').doc_count, 1)
+
+    def test_namespaces(self):
+        TaggedBlog.objects.create(title=u'inherited', body=u'words', tags=u'words tag')
+        self.assertEqual(TaggedBlog.tagged.word_stats([u'word', u'tag']), {u'word': 1, u'tag': 1})
+        self.assertEqual(TaggedBlog.tagged.index_stats()['documents'], 1)
+        self.assertEqual(Blog.objects.word_stats([u'word', u'tag']), {u'word': 1})
+
+    def test_concurrent_insert(self):
+        Blog.objects.create(title=u'counted', body=u'words')
+        stat = IndexStat.objects.get()
+        self.assertEqual(stat.namespace, 0)
+        # as if another transaction inserted the row after _apply_stats found it missing
+        def update(row):
+            updated.append(row)
+            return IndexStat.objects.filter(pk=stat.pk).update(documents=stat.documents + row[2])
+        updated = []
+        rows = [(stat.content_type_id, 0, 1, 0, 0)]
+        simple._insert_or_update(IndexStat._meta.db_table, ('content_type_id', 'namespace_id', 'documents', 'postings', 'length'), rows, update)
+        self.assertEqual(updated, rows)
+        self.assertEqual(IndexStat.objects.get().documents, stat.documents + 1)
+
+    def test_rebuild_stats(self):
+        for i in range(3):
+            Blog.objects.create(title=u'rebuilt %d' % i, body=u'statistics')
+        Blog.objects.create(title=u'rebuilt', body=u'statistics').delete()
+        stats = self._stats()
+        WordStat.objects.all().delete()
+        IndexStat.objects.all().update(documents=0, postings=0, length=0)
+        Word.objects.all().update(doc_count=100)
+        call_command('fts_rebuild_stats')
+        self.assertEqual(self._stats(), stats)
+
+class BM25Test(IndexTestCase):
+    def setUp(self):
+        super(BM25Test, self).setUp()
+        self.repeated = Blog.objects.create(title=u'fruit', body=u'apple apple apple')
+        self.short = Blog.objects.create(title=u'fruit', body=u'apple')
+        self.long = Blog.objects.create(title=u'fruit', body=u'apple banana cherry date elderberry fig')
+        self.other = Blog.objects.create(title=u'vegetable', body=u'leek')
+
+    def _ranks(self, query, **kwargs):
+        return [(b.pk, b.rank) for b in Blog.objects.search(query, rank_field='rank', **kwargs)]
+
+    def test_ranking(self):
+        self.assertEqual(set([rank for pk, rank in self._ranks(u'apple')]), set([10]))
+        self.assertEqual([pk for pk, rank in self._ranks(u'apple', ranking='bm25')], [self.repeated.pk, self.short.pk, self.long.pk])
+
+    def test_score(self):
+        # 4 documents of 4, 2, 7 and 2 words, apple in 3 of them
+        idf = math.log(1 + (4 - 3 + 0.5) / (3 + 0.5))
+        norm = simple.FTS_BM25_K1 * (1 - simple.FTS_BM25_B + simple.FTS_BM25_B * 2 / (15 / 4.0))
+        score = idf * 10 * 1 * (simple.FTS_BM25_K1 + 1) / (1 + norm)
+        self.assertAlmostEqual(dict(self._ranks(u'apple', ranking='bm25'))[self.short.pk], score, 5)
+
+    def test_strategies(self):
+        limit = simple.FTS_JOIN_DF_LIMIT
+        ranking = Blog.objects.ranking
+        Blog.objects.ranking = 'bm25'
+        try:
+            ranks = []
+            for df_limit in (1000, 0):
+                simple.FTS_JOIN_DF_LIMIT = df_limit
+                ranks.append(self._ranks(u'apple fruit'))
+            self.assertEqual([pk for pk, rank in ranks[0]], [self.repeated.pk, self.short.pk, self.long.pk])
+            self.assertEqual([pk for pk, rank in ranks[1]], [pk for pk, rank in ranks[0]])
+            for (pk, rank), (pk1, rank1) in zip(ranks[0], ranks[1]):
+                self.assertAlmostEqual(rank, rank1, 5)
+        finally:
+            simple.FTS_JOIN_DF_LIMIT = limit
+            Blog.objects.ranking = ranking
+
+class PrefixSearchTest(IndexTestCase):
+    def setUp(self):
+        super(PrefixSearchTest, self).setUp()
+        self.apple = Blog.objects.create(title=u'apple', body=u'applications')
+        self.apples = [Blog.objects.create(title=u'apple', body=u'fruit') for i in range(2)]
+        self.apricot = Blog.objects.create(title=u'apricot', body=u'fruit')
+        self.exact_search = Blog.objects.exact_search
+        Blog.objects.exact_search = False
+
+    def tearDown(self):
+        Blog.objects.exact_search = self.exact_search
+        super(PrefixSearchTest, self).tearDown()
+
+    def test_prefix_range(self):
+        self.assertEqual(simple._prefix_range(u'ab'), (u'ab', u'ac'))
+        self.assertEqual(simple._prefix_range(u'a' + unichr(sys.maxunicode)), (u'a', u'b'))
+        self.assertEqual(simple._prefix_range(u''), (u'', None))
+
+    def test_expand_prefix(self):
+        ids = dict(Word.objects.values_list('word', 'id'))
+        self.assertEqual(sorted(Blog.objects._expand_prefix(u'ap')), sorted([ids[u'appl'], ids[u'applic'], ids[u'apricot']]))
+        expansions = simple.FTS_PREFIX_EXPANSIONS
+        simple.FTS_PREFIX_EXPANSIONS = 1
+        try:
+            self.assertEqual(Blog.objects._expand_prefix(u'ap'), [ids[u'appl']])
+        finally:
+            simple.FTS_PREFIX_EXPANSIONS = expansions
+
+    def test_search(self):
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'appl')]), [self.apple.pk] + [b.pk for b in self.apples])
+        self.assertEqual(Blog.objects.search(u'ap').count(), 4)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'ap fr apr')], [self.apricot.pk])
+        self.assertEqual([b.pk for b in Blog.objects.search(u'apz')], [])
+
+class ResultCacheTest(TransactionTestCase):
+    # the loaders of the dumps drop indexes, which commits on SQLite
+    def setUp(self):
+        simple._WORD_IDS.clear()
+        self.blogs = [CachedBlog.objects.create(title=u'cached', body=u'cached words') for i in range(2)]
+
+    def test_dump(self):
+        self.assertEqual(CachedBlog.objects.search(u'cached').count(), 2)
+        CachedBlog(title=u'cached', body=u'not indexed yet').save(update_index=False)
+        self.assertEqual(CachedBlog.objects.search(u'cached').count(), 2)
+        simple.dump_indexes([CachedBlog.objects])
+        self.assertEqual(CachedBlog.objects.search(u'cached').count(), 3)
+
+    def test_cached(self):
+        search = CachedBlog.objects.search(u'cached', rank_field='rank')
+        self.assertEqual(len(search), 2)
+        stats = results.stats()
+        # served from the cache until the index changes
+        CachedBlog.objects.filter(pk=self.blogs[0].pk).update(title=u'changed', body=u'behind its back')
+        self.assertEqual(sorted([b.pk for b in CachedBlog.objects.search(u'  CACHED ', rank_field='rank')]), [b.pk for b in self.blogs])
+        self.assertEqual(results.stats()['hits'], stats['hits'] + 1)
+        self.assertEqual([b.rank for b in CachedBlog.objects.search(u'cached', rank_field='rank')[:1]], [10])
+        CachedBlog.objects.update_index(self.blogs[0].pk)
+        self.assertEqual([b.pk for b in CachedBlog.objects.search(u'cached', rank_field='rank')], [self.blogs[1].pk])
+
+    def test_search_before_commit(self):
+        # as another process could between the update of the index and its commit, with
+        # the old index: its results must not be used once the update is committed
+        commit = transaction.commit
+        def search_and_commit(*args, **kwargs):
+            len(CachedBlog.objects.search(u'cached'))
+            commit(*args, **kwargs)
+        CachedBlog.objects.filter(pk=self.blogs[0].pk).update(title=u'changed', body=u'behind its back')
+        transaction.commit = search_and_commit
+        try:
+            CachedBlog.objects.update_index(self.blogs[0].pk)
+        finally:
+            transaction.commit = commit
+        hits = results.stats()['hits']
+        self.assertEqual([b.pk for b in CachedBlog.objects.search(u'cached')], [self.blogs[1].pk])
+        self.assertEqual(results.stats()['hits'], hits)
+
+    def test_generations(self):
+        generation = results.get_generation('tests.cachedblog')
+        self.assertEqual(results.get_generation('tests.cachedblog'), generation)
+        results.bump_generation('tests.cachedblog')
+        self.assertNotEqual(results.get_generation('tests.cachedblog'), generation)
+        self.assertNotEqual(results.get_generation('tests.cachedblog', 'other'), results.get_generation('tests.cachedblog'))
+
+    def test_query_set_methods(self):
+        results = CachedBlog.objects.search(u'cached')
+        self.assertEqual([b.pk for b in results.filter(pk=self.blogs[0].pk)], [self.blogs[0].pk])
+        self.assertEqual(results.exclude(pk=self.blogs[0].pk).count(), 1)
+
+class WordIdCacheTest(IndexTestCase):
+    def test_shared(self):
+        word = Word.objects.create(word=u'shared')
+        self.assertEqual(Blog.objects._find_word_ids([u'shared', u'missing']), {u'shared': word.id})
+        self.assertEqual(simple._WORD_IDS.get(u'shared'), word.id)
+        stats = simple.word_ids_stats()
+        self.assertEqual(TaggedBlog.tagged._find_word_ids([u'shared']), {u'shared': word.id})
+        self.assertEqual(simple.word_ids_stats()['hits'], stats['hits'] + 1)
+
+    def test_created(self):
+        # the words created by an open transaction could still be rolled back
+        Blog.objects.create(title=u'uncommitted', body=u'words')
+        self.assertEqual(simple._WORD_IDS.get(u'uncommit'), None)
+        self.assertTrue(u'uncommit' in Blog.objects._find_word_ids([u'uncommit']))
+        self.assertEqual(simple._WORD_IDS.get(u'uncommit'), None)
+
+    def test_deleted(self):
+        word = Word.objects.create(word=u'vacuumed')
+        self.assertEqual(Blog.objects._find_word_ids([u'vacuumed']), {u'vacuumed': word.id})
+        # by vacuum, in another process
+        word.delete()
+        simple._words_deleted()
+        self.assertEqual(Blog.objects._find_word_ids([u'vacuumed']), {})
+        self.assertEqual(simple._WORD_IDS.get(u'vacuumed'), None)
+
+    def test_warm(self):
+        for word, doc_count in ((u'rare', 1), (u'common', 10), (u'frequent', 5)):
+            Word.objects.create(word=word, doc_count=doc_count)
+        simple.warm_word_ids(2)
+        self.assertEqual(sorted([w for w in (u'rare', u'common', u'frequent') if w in simple._WORD_IDS]), [u'common', u'frequent'])
+
+class QueueTest(IndexTestCase):
+    def setUp(self):
+        super(QueueTest, self).setUp()
+        self.settings = base.FTS_INDEX_QUEUE, queue.FTS_INDEX_QUEUE, queue.FTS_INDEX_QUEUE_LIMIT
+        base.FTS_INDEX_QUEUE = queue.FTS_INDEX_QUEUE = 'local'
+        queue.discard()
+
+    def tearDown(self):
+        queue.discard()
+        base.FTS_INDEX_QUEUE, queue.FTS_INDEX_QUEUE, queue.FTS_INDEX_QUEUE_LIMIT = self.settings
+        super(QueueTest, self).tearDown()
+
+    def test_flush(self):
+        blog = Blog.objects.create(title=u'queued', body=u'later')
+        blog.body = u'twice'
+        blog.save()
+        self.assertEqual(Blog.objects.search(u'queued').count(), 0)
+        self.assertEqual(queue.flush(), 1)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'twice')], [blog.pk])
+        self.assertEqual(queue.flush(), 0)
+
+    def test_models(self):
+        blog = Blog.objects.create(title=u'queued', body=u'blog')
+        memory = MemoryBlog.objects.create(title=u'queued', body=u'memory')
+        self.assertEqual(MemoryBlog.objects.search(u'queued').count(), 0)
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'queued')], [blog.pk])
+        self.assertEqual([b.pk for b in MemoryBlog.objects.search(u'queued')], [memory.pk])
+
+    def test_limit(self):
+        queue.FTS_INDEX_QUEUE_LIMIT = 2
+        first = Blog.objects.create(title=u'limited', body=u'one')
+        self.assertEqual(Blog.objects.search(u'limited').count(), 0)
+        second = Blog.objects.create(title=u'limited', body=u'two')
+        # not in the middle of the transaction (the test's) that could still roll back
+        self.assertEqual(Blog.objects.search(u'limited').count(), 0)
+        # as right after the commit of a save
+        base._commit_index_changes()
+        self.assertEqual(sorted([b.pk for b in Blog.objects.search(u'limited')]), [first.pk, second.pk])
+
+    def test_request(self):
+        blog = Blog.objects.create(title=u'finished', body=u'request')
+        queue._request_finished(None)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'finished')], [blog.pk])
+        Blog.objects.create(title=u'failed', body=u'request')
+        queue._request_failed(None)
+        queue._request_finished(None)
+        self.assertEqual(Blog.objects.search(u'failed').count(), 0)
+
+class SearchManagersTest(TestCase):
+    def test_lookup(self):
+        self.assertEqual(get_search_managers(Blog), [Blog.objects])
+        self.assertEqual(get_search_managers(DummyBlog), [DummyBlog.objects])
+        # the managers of abstract models are copied to every subclass, with its own index
+        self.assertEqual(get_search_managers(TaggedBlog), [TaggedBlog.tagged, TaggedBlog.objects, Blog.objects])
+
+    def test_inherited_indexes(self):
+        tagged = TaggedBlog.objects.create(title=u'parent', body=u'text', tags=u'child')
+        self.assertEqual([b.pk for b in Blog.objects.search(u'parent')], [tagged.pk])
+        self.assertEqual([b.pk for b in TaggedBlog.tagged.search(u'child')], [tagged.pk])
+        tagged.title = u'father'
+        tagged.save()
+        self.assertEqual([b.pk for b in Blog.objects.search(u'parent')], [])
+        self.assertEqual([b.pk for b in Blog.objects.search(u'father')], [tagged.pk])
+        tagged.update_index()
+        self.assertEqual([b.pk for b in Blog.objects.search(u'father')], [tagged.pk])
+        tagged.delete()
+        self.assertEqual([b.pk for b in Blog.objects.search(u'father')], [])
+        self.assertEqual([b.pk for b in TaggedBlog.tagged.search(u'child')], [])
+
+class ReindexCommandTest(TestCase):
+    def setUp(self):
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'fts_reindex.checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.checkpoint))
+
+    def test_all_managers(self):
+        Blog.objects.create(title=u'reindexing', body=u'about reindexing')
+        DummyBlog.objects.create(title=u'reindexing', body=u'about reindexing')
+        call_command('fts_reindex', checkpoint=self.checkpoint, verbosity=0)
+        self.assertEqual([b.title for b in Blog.objects.search(u'reindexing')], [u'reindexing'])
+        self.assertEqual([b.title for b in DummyBlog.objects.search(u'reindexing')], [u'reindexing'])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume(self):
+        done = Blog(title=u'resumed', body=u'before')
+        done.save(update_index=False)
+        todo = Blog(title=u'resumed', body=u'after')
+        todo.save(update_index=False)
+        open(self.checkpoint, 'w').write('tests.Blog.objects %d\n' % done.pk)
+        call_command('fts_reindex', 'tests.Blog', checkpoint=self.checkpoint, verbosity=0)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'resumed')], [todo.pk])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_not_resumable(self):
+        DummyBlog.objects.create(title=u'dummy', body=u'blog')
+        # call_command exits on the errors of the commands
+        command = fts_reindex.Command()
+        self.assertRaises(CommandError, command.handle, 'tests.DummyBlog', checkpoint=self.checkpoint,
+            since_pk=1, batch_size=None, sleep=0, mode='live', verbosity=0)
+        self.assertRaises(CommandError, command.handle, 'tests.Missing', checkpoint=self.checkpoint,
+            since_pk=None, batch_size=None, sleep=0, mode='live', verbosity=0)
+
+    def test_report(self):
+        Blog.objects.create(title=u'reported', body=u'throughput')
+        stdout, chunk_size = sys.stdout, Blog.objects.chunk_size
+        sys.stdout = StringIO()
+        try:
+            call_command('fts_reindex', 'tests.Blog', checkpoint=self.checkpoint, batch_size=10)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            Blog.objects.chunk_size = chunk_size
+        self.assertTrue('tests.Blog.objects: 1/1 documents' in output, output)
+        self.assertTrue('tests.Blog.objects: 1 documents in 0:00:00' in output, output)
+        self.assertTrue('docs/s' in output, output)
+
+class DeleteTest(IndexTestCase):
+    def _test_delete(self, model):
+        kept = model.objects.create(title=u'kept deleted', body=u'deleted words')
+        deleted = model.objects.create(title=u'gone deleted', body=u'deleted words')
+        self.assertEqual(sorted([b.pk for b in model.objects.search(u'deleted')]), [kept.pk, deleted.pk])
+        deleted.delete()
+        self.assertEqual([b.pk for b in model.objects.search(u'deleted')], [kept.pk])
+        model.objects.all().delete()
+        self.assertEqual([b.pk for b in model.objects.search(u'deleted')], [])
+
+    def test_simple(self):
+        self._test_delete(Blog)
+
+    def test_dummy(self):
+        self._test_delete(DummyBlog)
+
+    def test_memory(self):
+        self._test_delete(MemoryBlog)
+
+    def test_segment(self):
+        self._test_delete(SegmentBlog)
+
+    def test_blocks(self):
+        self._test_delete(BlocksBlog)
+
+    def test_batched(self):
+        blogs = [MemoryBlog.objects.create(title=u'batched', body=u'deleted') for i in range(3)]
+        calls = []
+        def _update_index(pk, **kwargs):
+            calls.append(pk)
+            return update_index(pk, **kwargs)
+        update_index = MemoryBlog.objects._update_index
+        MemoryBlog.objects._update_index = _update_index
+        try:
+            MemoryBlog.objects.filter(title=u'batched').delete()
+        finally:
+            del MemoryBlog.objects._update_index
+        self.assertEqual([sorted(pks) for pks in calls], [sorted([b.pk for b in blogs])])
+        self.assertEqual([b.pk for b in MemoryBlog.objects.search(u'batched')], [])
+
+    def test_managed(self):
+        # the transaction of the caller (the one of the test) is not committed
+        blog = Blog.objects.create(title=u'managed', body=u'deleted')
+        commits = []
+        commit = transaction.commit
+        transaction.commit = lambda *args, **kwargs: commits.append(args)
+        try:
+            blog.delete()
+            Blog.objects.create(title=u'managed', body=u'saved')
+        finally:
+            transaction.commit = commit
+        self.assertEqual(commits, [])
+
+    def test_cascade(self):
+        blog = Blog.objects.create(title=u'commented', body=u'text')
+        DummyComment.objects.create(blog=blog, text=u'text')
+        blog.delete()
+        self.assertEqual(DummyComment.objects.count(), 0)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'commented')], [])
+
+    def test_pgsql(self):
+        # the vector is stored in the deleted row itself
+        self.assertFalse(pgsql.SearchManager.separate_index)
+
+class VacuumTest(IndexTestCase):
+    def setUp(self):
+        super(VacuumTest, self).setUp()
+        self.kept = Blog.objects.create(title=u'kept', body=u'shared words')
+        self.orphan = Blog.objects.create(title=u'orphaned', body=u'shared words')
+        postings = Index.objects.filter(object_id=self.orphan.pk)
+        self.postings = postings.count()
+        kept_ids = set(Index.objects.filter(object_id=self.kept.pk).values_list('word_id', flat=True))
+        self.word_ids = set(postings.values_list('word_id', flat=True)) - kept_ids
+        # deleted without post_delete, as a raw DELETE or a dropped signal would
+        connection.cursor().execute('DELETE FROM %s WHERE %s = %%s' % (connection.ops.quote_name(Blog._meta.db_table),
+            connection.ops.quote_name(Blog._meta.pk.column)), [self.orphan.pk])
+
+    def test_vacuum(self):
+        reclaimed = simple.vacuum(batch_size=1)
+        self.assertEqual(reclaimed['documents'], 1)
+        self.assertEqual(reclaimed['postings'], self.postings)
+        self.assertEqual(reclaimed['words'], len(self.word_ids))
+        self.assertEqual(Index.objects.filter(object_id=self.orphan.pk).count(), 0)
+        self.assertEqual(Word.objects.filter(id__in=self.word_ids).count(), 0)
+        self.assertEqual([b.pk for b in Blog.objects.search(u'shared')], [self.kept.pk])
+        reclaimed = simple.vacuum()
+        self.assertEqual((reclaimed['documents'], reclaimed['postings'], reclaimed['words']), (0, 0, 0))
+
+    def test_keep_words(self):
+        call_command('fts_vacuum', words=False, verbosity=0)
+        self.assertEqual(Index.objects.filter(object_id=self.orphan.pk).count(), 0)
+        self.assertEqual(Word.objects.filter(id__in=self.word_ids).count(), len(self.word_ids))
+
+class CompositeIndexesTest(TransactionTestCase):
+    def test_created(self):
+        # by the post_syncdb receiver, along with the tables
+        self.assertEqual(indexes.missing_indexes(), [])
+
+    def test_create(self):
+        if indexes.ENGINE != 'sqlite3':
+            return
+        # SQLite commits before running DDL, so the index is created again in any case
+        connection.cursor().execute('DROP INDEX %s' % connection.ops.quote_name('fts_index_object'))
+        try:
+            self.assertEqual([name for name, table, columns in indexes.missing_indexes()], ['fts_index_object'])
+        finally:
+            self.assertEqual(indexes.create_indexes(online=True, verbosity=0), ['fts_index_object'])
+        self.assertEqual(indexes.missing_indexes(), [])
+
+    def test_sql(self):
+        sql = indexes.create_sql('fts_index_object', Index._meta.db_table, ('content_type_id', 'namespace_id', 'object_id'))
+        self.assertEqual(len(sql), 1)
+        self.assertTrue(sql[0].startswith('CREATE INDEX %s ON ' % connection.ops.quote_name('fts_index_object')), sql)
+
+    def test_online_sql(self):
+        engine, invalid_indexes = indexes.ENGINE, indexes.invalid_indexes
+        indexes.ENGINE = 'postgresql_psycopg2'
+        try:
+            for invalid, drops in ((set(), []), (set(['fts_index_object']), ['DROP INDEX CONCURRENTLY IF EXISTS'])):
+                indexes.invalid_indexes = lambda table: invalid
+                sql = indexes.create_sql('fts_index_object', Index._meta.db_table, ('content_type_id', 'namespace_id', 'object_id'), online=True)
+                # a plain DROP INDEX would lock the table
+                self.assertEqual([s.split(' %s' % connection.ops.quote_name('fts_index_object'))[0] for s in sql],
+                                 drops + ['CREATE INDEX CONCURRENTLY'])
+        finally:
+            indexes.ENGINE, indexes.invalid_indexes = engine, invalid_indexes
+
+class BlocksTest(IndexTestCase):
+    def test_ranking(self):
+        self.assertRaises(ImproperlyConfigured, blocks.SearchManager, ranking='bm25')
+
+    def test_expand_prefix(self):
+        for i in range(3):
+            BlocksBlog.objects.create(title=u'apple', body=u'fruit')
+        BlocksBlog.objects.create(title=u'apricot', body=u'fruit')
+        # the simple backend counts the documents of its own models only
+        Word.objects.filter(word=u'apricot').update(doc_count=10)
+        expansions = blocks.FTS_PREFIX_EXPANSIONS
+        blocks.FTS_PREFIX_EXPANSIONS = 1
+        try:
+            self.assertEqual(BlocksBlog.objects._expand_prefix(u'ap'), [Word.objects.get(word=u'appl').id])
+        finally:
+            blocks.FTS_PREFIX_EXPANSIONS = expansions
+        self.assertEqual(len(BlocksBlog.objects._expand_prefix(u'ap')), 2)
+
+    def test_search_ranking(self):
+        self.assertRaises(ValueError, BlocksBlog.objects.search, u'apple', ranking='bm25')
+
+    def test_stats(self):
+        for i in range(3):
+            BlocksBlog.objects.create(title=u'apple', body=u'fruit')
+        BlocksBlog.objects.create(title=u'apricot', body=u'apricot')
+        self.assertEqual(BlocksBlog.objects.word_stats([u'appl', u'apricot', u'fruit', u'pear']),
+            { u'appl': 3, u'apricot': 1, u'fruit': 3 })
+        stats = BlocksBlog.objects.index_stats()
+        self.assertEqual((stats['documents'], stats['postings']), (4, 7))
+        self.assertTrue(stats['blocks'] >= 3)
+        plan = BlocksBlog.objects.plan(u'apple fruit')
+        self.assertEqual(plan['strategy'], 'blocks')
+        self.assertEqual(sorted([(w['word'], w['df']) for w in plan['words']]), [(u'appl', 3), (u'fruit', 3)])
+        self.assertEqual(BlocksBlog.objects.plan(u'pear')['strategy'], 'empty')
+
+class RecordingCursor(object):
+    """
+    Records the UPDATE statements of table instead of running them: the test database
+    is not PostgreSQL.
+    """
+    def __init__(self, cursor, table, statements):
+        self.cursor = cursor
+        self.table = table
+        self.statements = statements
+
+    def execute(self, sql, params=()):
+        if sql.startswith('UPDATE %s ' % connection.ops.quote_name(self.table)):
+            self.statements.append((sql, params))
+        else:
+            return self.cursor.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class PgsqlUpdateTest(TestCase):
+    def setUp(self):
+        self.blogs = [Blog.objects.create(title=u'title %d' % i, body=u'body') for i in range(5)]
+        self.manager = pgsql.SearchManager(fields={'title': 'A', 'body': 'C'}, chunk_size=2)
+        self.manager.model = Blog
+        self.manager._fields = self.manager.fields
+        self.manager._vector_field_cache = Blog._meta.get_field('title')
+        self.commits = []
+        self.manager._commit_chunk = lambda: self.commits.append(len(self.statements))
+        self.statements = []
+        self.cursor = connection.cursor
+        connection.cursor = lambda: RecordingCursor(self.cursor(), Blog._meta.db_table, self.statements)
+
+    def tearDown(self):
+        connection.cursor = self.cursor
+
+    def test_pks(self):
+        self.manager._update_index_update([b.pk for b in self.blogs[:3]])
+        self.assertEqual(len(self.statements), 2)
+        self.assertEqual(self.statements[0][1][-2:], (self.blogs[0].pk, self.blogs[1].pk))
+        self.assertEqual(self.statements[1][1][-1:], (self.blogs[2].pk,))
+        self.assertEqual(self.commits, [1, 2])
+
+    def test_ranges(self):
+        def progress(last_pk, count):
+            calls.append((last_pk, count))
+            # the last range is emptied before it is updated
+            Blog.objects.filter(pk__gt=self.blogs[3].pk).delete()
+        calls = []
+        self.manager._update_index_update(progress=progress)
+        self.assertEqual(calls, [(self.blogs[1].pk, 2), (self.blogs[3].pk, 2), (self.blogs[4].pk, 0)])
+        self.assertEqual(self.commits, [1, 2, 3])
+
+class CatalogCursor(object):
+    """
+    Answers the queries on pg_proc with prosrc and finds the trigger in pg_trigger.
+    """
+    def __init__(self, cursor, prosrc):
+        self.cursor = cursor
+        self.prosrc = prosrc
+        self.row = None
+
+    def execute(self, sql, params=()):
+        if 'pg_proc' in sql:
+            self.row = (self.prosrc,)
+        elif 'pg_trigger' in sql:
+            self.row = (1,)
+        else:
+            return self.cursor.execute(sql, params)
+
+    def fetchone(self):
+        return self.row
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+class PgsqlTriggerTest(TestCase):
+    def _model(self, fields):
+        class TriggerBlog(models.Model):
+            title = models.CharField(max_length=100)
+            blog = models.ForeignKey(Blog)
+
+            objects = pgsql.SearchManager(fields=fields, trigger=True)
+
+            class Meta:
+                app_label = 'tests'
+        return TriggerBlog
+
+    def test_fields(self):
+        self.assertRaises(InvalidFtsBackendError, self._model, ('title', 'subtitle'))
+        self.assertRaises(InvalidFtsBackendError, self._model, ('title', 'blog__title'))
+        self.assertRaises(InvalidFtsBackendError, self._model, {'title': 'A', (lambda blog: blog.title): 'B'})
+
+    def test_missing_trigger(self):
+        manager = pgsql.SearchManager(fields=('title', 'body'), trigger=True)
+        manager.model = Blog
+        manager._fields = dict([(f, 'A') for f in manager.fields])
+        manager._vector_field_cache = Blog._meta.get_field('title')
+        index_name, trigger_name = manager._db_object_names()
+        cursor = connection.cursor
+        try:
+            # as PostgreSQL gives it back, with the indentation of the CREATE FUNCTION statement
+            prosrc = '\n' + '\n'.join(['  ' + line for line in manager._trigger_body().strip().split('\n')]) + '\n'
+            connection.cursor = lambda: CatalogCursor(cursor(), prosrc)
+            self.assertFalse(trigger_name in manager.missing_db_objects())
+            connection.cursor = lambda: CatalogCursor(cursor(), prosrc.replace('RETURN', 'RETURN NULL; --'))
+            self.assertTrue(trigger_name in manager.missing_db_objects())
+        finally:
+            connection.cursor = cursor
+
+    def test_verify(self):
+        manager = pgsql.SearchManager(fields=('title', 'body'), trigger=True)
+        manager.model = Blog
+        manager.name = 'objects'
+        manager._vector_field_cache = Blog._meta.get_field('title')
+        index_name, trigger_name = manager._db_object_names()
+        manager.missing_db_objects = lambda: [trigger_name]
+        warned = []
+        warn = pgsql.warnings.warn
+        pgsql.warnings.warn = lambda message, category: warned.append((message, category))
+        try:
+            # searching (lazily) checks the objects once, so the stale results do not go unnoticed
+            manager._search(u'stale')
+            manager._search(u'stale')
+        finally:
+            pgsql.warnings.warn = warn
+        self.assertEqual(len(warned), 1)
+        self.assertTrue(trigger_name in warned[0][0], warned)
+        self.assertEqual(warned[0][1], RuntimeWarning)
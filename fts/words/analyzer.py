@@ -0,0 +1,97 @@
+"""
+Text analysis shared by the backends that index or search words themselves:
+accent folding, lowercasing, splitting, stop word filtering and stemming.
+"""
+import re
+import unicodedata
+
+from fts.words.stop import FTS_STOPWORDS
+from fts.words.cache import get_stemmer
+
+SEP = re.compile(r'[\s,.()\[\]|]')
+ASCII = re.compile(r'^[\x00-\x7f]*$')
+
+# Longer words are not indexed (Word.word has max_length=100)
+MAX_WORD_LENGTH = 100
+
+class AccentTable(dict):
+    """
+    Translation table for unicode.translate() that removes accents: each character
+    maps to its NFD decomposition without the nonspacing marks (category Mn). The
+    Latin ranges are computed up front, any other character the first time it is seen.
+    """
+    def __init__(self):
+        super(AccentTable, self).__init__()
+        for code in range(0x80, 0x250) + range(0x300, 0x370):
+            self[code]
+
+    def __missing__(self, code):
+        char = unichr(code)
+        folded = u''.join([c for c in unicodedata.normalize('NFD', char) if unicodedata.category(c) != 'Mn'])
+        if folded == char:
+            value = code
+        elif folded:
+            value = folded
+        else:
+            value = None
+        self[code] = value
+        return value
+
+ACCENTS = AccentTable()
+
+class Analyzer(object):
+    """
+    Turns text into the set of words to index or search for. An analyzer is built
+    once (per search manager) and uses the process wide cached stemmer of its language.
+    """
+    def __init__(self, language_code, stem_words=True, strip_accents=True):
+        self.language_code = language_code
+        self.stem_words = stem_words
+        self.strip_accents = strip_accents
+        self.stopwords = FTS_STOPWORDS.get(language_code, frozenset())
+        self.stemmer = get_stemmer(language_code)
+
+    def fold(self, text):
+        """
+        Returns text as a lowercase unicode string, without accents if strip_accents.
+        """
+        text = unicode(text)
+        if self.strip_accents and not ASCII.match(text):
+            text = text.translate(ACCENTS)
+        return text.lower()
+
+    def analyze(self, text, minlen=0):
+        """
+        Returns the set of (stemmed) words in text that are not stop words and whose
+        length is greater than minlen (and at most MAX_WORD_LENGTH).
+        """
+        stopwords = self.stopwords
+        stem = self.stem_words and self.stemmer or None
+        words = set()
+        for word in set(SEP.split(self.fold(text))):
+            if word and minlen < len(word) <= MAX_WORD_LENGTH and word not in stopwords:
+                if stem is not None:
+                    word = stem(word)
+                words.add(word)
+        return words
+
+    def count(self, text, minlen=0):
+        """
+        Like analyze, but returns a dictionary mapping each word to the number of
+        times it occurs in text.
+        """
+        stopwords = self.stopwords
+        stem = self.stem_words and self.stemmer or None
+        counts = {}
+        for word in SEP.split(self.fold(text)):
+            if word and minlen < len(word) <= MAX_WORD_LENGTH and word not in stopwords:
+                if stem is not None:
+                    word = stem(word)
+                counts[word] = counts.get(word, 0) + 1
+        return counts
+
+    def analyze_many(self, texts, minlen=0):
+        """
+        Returns a list with the set of words of each of texts.
+        """
+        return [self.analyze(text, minlen) for text in texts]
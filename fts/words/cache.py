@@ -0,0 +1,63 @@
+"""
+Memoization of stemmers. Text is highly repetitive, so the stem of each word
+is kept in a bounded LRU cache shared by every user of a language within the
+process (FTS_STEM_CACHE_SIZE words per language):
+
+    stem = get_stemmer('en')
+    stem('running')     # -> 'run'
+    stem.cache.stats()  # -> {'hits': 0, 'misses': 1, 'size': 1, 'maxsize': 10000}
+"""
+import threading
+
+from fts.lru import LRUCache
+from fts.settings import FTS_STEM_CACHE_SIZE
+try:
+    from fts.words.snowball import Stemmer
+except ImportError:
+    from fts.words.porter import Stemmer
+
+class CachedStemmer(object):
+    """
+    Wraps a stemmer class (instances called with a word return its stem). The cache
+    is shared by all threads, each of which gets its own stemmer instance.
+    """
+    def __init__(self, language, maxsize=FTS_STEM_CACHE_SIZE, stemmer_class=Stemmer):
+        self.language = language
+        self.stemmer_class = stemmer_class
+        self.cache = LRUCache(maxsize)
+        self._local = threading.local()
+
+    def __call__(self, word):
+        stem = self.cache.get(word)
+        if stem is None:
+            try:
+                stemmer = self._local.stemmer
+            except AttributeError:
+                stemmer = self._local.stemmer = self.stemmer_class(self.language)
+            stem = stemmer(word)
+            self.cache.set(word, stem)
+        return stem
+
+_STEMMERS = {}
+_STEMMERS_LOCK = threading.Lock()
+
+def get_stemmer(language):
+    """
+    Returns the process wide cached stemmer for language.
+    """
+    try:
+        return _STEMMERS[language]
+    except KeyError:
+        _STEMMERS_LOCK.acquire()
+        try:
+            if language not in _STEMMERS:
+                _STEMMERS[language] = CachedStemmer(language)
+            return _STEMMERS[language]
+        finally:
+            _STEMMERS_LOCK.release()
+
+def stats():
+    """
+    Returns the cache statistics of every language's stemmer.
+    """
+    return dict([(language, stemmer.cache.stats()) for language, stemmer in _STEMMERS.items()])
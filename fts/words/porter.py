@@ -1,358 +1,242 @@
 """Porter Stemming Algorithm
 
-This is the Porter stemming algorithm, ported to Python from the
-version coded up in ANSI C by the author. It may be be regarded
-as canonical, in that it follows the algorithm presented in
+This is the Porter stemming algorithm, as in the Python port of the ANSI C
+version coded up by the author done by Vivake Gupta (v@nano.com, Release 1:
+January 2001), which may be regarded as canonical, in that it follows the
+algorithm presented in
 
 Porter, 1980, An algorithm for suffix stripping, Program, Vol. 14,
 no. 3, pp 130-137,
 
-only differing from it at the points maked --DEPARTURE-- below.
+only differing from it at the points marked --DEPARTURE-- below.
 
 See also http://www.tartarus.org/~martin/PorterStemmer
 
-The algorithm as described in the paper could be exactly replicated
-by adjusting the points of DEPARTURE, but this is barely necessary,
-because (a) the points of DEPARTURE are definitely improvements, and
-(b) no encoding of the Porter stemmer I have seen is anything like
-as exact as this version, even with the points of DEPARTURE!
-
-Vivake Gupta (v@nano.com)
-
-Release 1: January 2001
+This implementation gives exactly the same results as that port, but keeps no
+state between calls (so a Stemmer can be shared by several threads), finds the
+candidate suffixes of each step in tables keyed by the last two letters of the
+word, and classifies the letters as consonants or vowels once per word instead
+of on every test. Run this module to time it: python porter.py [words file]
+(by default, the words of fts/tests/porter_voc.txt, whose stems the tests check).
 """
 
-class Stemmer(object):
-
-    def __init__(self, language=''):
-        """The main part of the stemming algorithm starts here.
-        b is a buffer holding a word to be stemmed. The letters are in b[k0],
-        b[k0+1] ... ending at b[k]. In fact k0 = 0 in this demo program. k is
-        readjusted downwards as the stemming progresses. Zero termination is
-        not in fact used in the algorithm.
-
-        Note that only lower case sequences are stemmed. Forcing to lower case
-        should be done before stem(...) is called.
-        """
-        self.language = language
-        self.b = ""  # buffer for word to be stemmed
-        self.k = 0
-        self.k0 = 0
-        self.j = 0   # j is a general offset into the string
-
-    def cons(self, i):
-        """cons(i) is TRUE <=> b[i] is a consonant."""
-        if self.b[i] == 'a' or self.b[i] == 'e' or self.b[i] == 'i' or self.b[i] == 'o' or self.b[i] == 'u':
-            return 0
-        if self.b[i] == 'y':
-            if i == self.k0:
-                return 1
+class _MaskTable(dict):
+    def __missing__(self, code):
+        return u'c'
+
+# translate() tables marking vowels as v, y as y and anything else as c
+MASK = ''.join([{'a': 'v', 'e': 'v', 'i': 'v', 'o': 'v', 'u': 'v', 'y': 'y'}.get(chr(code), 'c')
+                for code in range(256)])
+UMASK = _MaskTable([(ord(c), unicode(MASK[ord(c)])) for c in 'aeiouy'])
+
+# Suffixes of steps 2, 3 and 4 by their last two letters, in the order they are
+# tried, with their replacements (step 4 just removes them).
+STEP2 = {}
+for _suffix, _replacement in (
+        ('ational', 'ate'), ('tional', 'tion'),
+        ('enci', 'ence'), ('anci', 'ance'),
+        ('izer', 'ize'),
+        ('bli', 'ble'), # --DEPARTURE--
+        # To match the published algorithm, replace this with ('abli', 'able')
+        ('alli', 'al'), ('fulli', 'ful'), ('entli', 'ent'), ('eli', 'e'), ('ousli', 'ous'),
+        ('ization', 'ize'), ('ation', 'ate'), ('ator', 'ate'),
+        ('alism', 'al'), ('iveness', 'ive'), ('fulness', 'ful'), ('ousness', 'ous'),
+        ('aliti', 'al'), ('iviti', 'ive'), ('biliti', 'ble'),
+        ('logi', 'og')): # --DEPARTURE--, replaces -ogi, see stem()
+        # To match the published algorithm, delete this entry
+    STEP2.setdefault(_suffix[-2:], []).append((_suffix, _replacement))
+
+STEP3 = {}
+for _suffix, _replacement in (
+        ('icate', 'ic'), ('ative', ''), ('alize', 'al'),
+        ('iciti', 'ic'),
+        ('ical', 'ic'), ('ful', ''),
+        ('ness', '')):
+    STEP3.setdefault(_suffix[-2:], []).append((_suffix, _replacement))
+
+STEP4 = {}
+for _suffix in ('al', 'ance', 'ence', 'er', 'ic', 'able', 'ible', 'ant', 'ement',
+                'ment', 'ent', 'ion', 'ou', 'ism', 'ate', 'iti', 'ous', 'ive', 'ize'):
+    STEP4.setdefault(_suffix[-2:], []).append(_suffix)
+
+def _mask(b):
+    """
+    Returns a string with a 'c' for each consonant of b and a 'v' for each vowel.
+    y is a consonant at the start of the word or after a vowel, a vowel otherwise.
+    """
+    if isinstance(b, unicode):
+        mask = b.translate(UMASK)
+    else:
+        mask = b.translate(MASK)
+    if 'y' not in mask:
+        return mask
+    mask = list(mask)
+    for i, m in enumerate(mask):
+        if m == 'y':
+            mask[i] = i and mask[i-1] == 'c' and 'v' or 'c'
+    return ''.join(mask)
+
+def _cvc(mask, b, i):
+    """
+    True if i-2,i-1,i has the form consonant - vowel - consonant and the second
+    consonant is not w, x or y. This is used when trying to restore an e at the end
+    of a short word, e.g. cav(e), lov(e), hop(e), crim(e), but snow, box, tray.
+    (For i == 1, just vowel - consonant.)
+    """
+    if i == 1:
+        return mask[0] == 'v' and mask[1] == 'c'
+    if i == 0 or mask[i] != 'c' or mask[i-1] != 'v' or mask[i-2] != 'c':
+        return False
+    return b[i] not in 'wxy'
+
+def _doublec(mask, b, j):
+    """True if j,(j-1) contain a double consonant."""
+    return j >= 1 and b[j] == b[j-1] and mask[j] == 'c'
+
+def stem(b):
+    """
+    Returns the stem of b, a lower case word. Words of one or two letters are not
+    stemmed (--DEPARTURE--).
+
+    The stem being built is b[:k+1]. j is where the suffix being tested starts
+    (j+1), and m(j), the measure of the stem b[:j+1], counts its vowel-consonant
+    sequences: <c><v> gives 0, <c>vc<v> gives 1, <c>vcvc<v> gives 2...
+    """
+    k = len(b) - 1
+    if k <= 1:
+        return b
+    mask = _mask(b)
+
+    # Step 1ab: get rid of plurals and -ed or -ing. e.g.
+    # caresses -> caress, ponies -> poni, cats -> cat, feed -> feed,
+    # agreed -> agree, matting -> mat, mating -> mate, meetings -> meet
+    if b[k] == 's':
+        if b.endswith('sses', 0, k+1):
+            k -= 2
+        elif b.endswith('ies', 0, k+1):
+            if k == 3:
+                k -= 1
             else:
-                return (not self.cons(i - 1))
-        return 1
+                k -= 2
+        elif b[k-1] != 's':
+            k -= 1
 
-    def m(self):
-        """m() measures the number of consonant sequences between k0 and j.
-        if c is a consonant sequence and v a vowel sequence, and <..>
-        indicates arbitrary presence,
-
-           <c><v>       gives 0
-           <c>vc<v>     gives 1
-           <c>vcvc<v>   gives 2
-           <c>vcvcvc<v> gives 3
-           ....
-        """
-        n = 0
-        i = self.k0
-        while 1:
-            if i > self.j:
-                return n
-            if not self.cons(i):
+    if b.endswith('ied', 0, k+1):
+        if k == 3:
+            k -= 1
+        else:
+            k -= 2
+    elif b.endswith('eed', 0, k+1):
+        if mask.count('vc', 0, k-2) > 0:
+            k -= 1
+    else:
+        if b.endswith('ed', 0, k+1):
+            j = k - 2
+        elif b.endswith('ing', 0, k+1):
+            j = k - 3
+        else:
+            j = None
+        if j is not None and 'v' in mask[:j+1]:
+            k = j
+            if b.endswith('at', 0, k+1) or b.endswith('bl', 0, k+1) or b.endswith('iz', 0, k+1):
+                b = b[:k+1] + 'e' + b[k+2:]
+                k += 1
+                mask = _mask(b)
+            elif _doublec(mask, b, k):
+                if b[k-1] not in 'lsz':
+                    k -= 1
+            elif mask.count('vc', 0, k+1) == 1 and _cvc(mask, b, k):
+                b = b[:k+1] + 'e' + b[k+2:]
+                k += 1
+                mask = _mask(b)
+
+    # Step 1c: turn terminal y to i when there is another vowel in the stem.
+    if b[k] == 'y' and k > 1 and mask[k-1] == 'c':
+        b = b[:k] + 'i' + b[k+1:]
+        mask = _mask(b)
+
+    # Step 2: map double suffices to single ones, so -ization ( = -ize plus
+    # -ation) maps to -ize etc. The stem before the suffix must give m() > 0.
+    while True:
+        for suffix, replacement in STEP2.get(b[k-1:k+1], ()):
+            if b.endswith(suffix, 0, k+1):
+                j = k - len(suffix)
+                if suffix == 'logi':
+                    # the l is kept, as part of the stem to measure
+                    j += 1
+                if mask.count('vc', 0, j+1) > 0:
+                    b = b[:j+1] + replacement + b[j+len(replacement)+1:]
+                    k = j + len(replacement)
+                    mask = _mask(b)
+                    if suffix == 'alli':
+                        # step 2 again on the -al
+                        break
+                return _steps345(b, k, mask)
+        else:
+            return _steps345(b, k, mask)
+
+def _steps345(b, k, mask):
+    # Step 3: deal with -ic-, -full, -ness etc. similar strategy to step 2.
+    for suffix, replacement in STEP3.get(b[k-1:k+1], ()):
+        if b.endswith(suffix, 0, k+1):
+            j = k - len(suffix)
+            if mask.count('vc', 0, j+1) > 0:
+                b = b[:j+1] + replacement + b[j+len(replacement)+1:]
+                k = j + len(replacement)
+                mask = _mask(b)
+            break
+
+    # Step 4: take off -ant, -ence etc., in context <c>vcvc<v>.
+    for suffix in STEP4.get(b[k-1:k+1], ()):
+        if b.endswith(suffix, 0, k+1):
+            j = k - len(suffix)
+            if suffix == 'ion' and b[j] not in 'st':
                 break
-            i = i + 1
-        i = i + 1
-        while 1:
-            while 1:
-                if i > self.j:
-                    return n
-                if self.cons(i):
-                    break
-                i = i + 1
-            i = i + 1
-            n = n + 1
-            while 1:
-                if i > self.j:
-                    return n
-                if not self.cons(i):
-                    break
-                i = i + 1
-            i = i + 1
-
-    def vowelinstem(self):
-        """vowelinstem() is TRUE <=> k0,...j contains a vowel"""
-        for i in range(self.k0, self.j + 1):
-            if not self.cons(i):
-                return 1
-        return 0
-
-    def doublec(self, j):
-        """doublec(j) is TRUE <=> j,(j-1) contain a double consonant."""
-        if j < (self.k0 + 1):
-            return 0
-        if (self.b[j] != self.b[j-1]):
-            return 0
-        return self.cons(j)
-
-    def cvc(self, i):
-        """cvc(i) is TRUE <=> i-2,i-1,i has the form consonant - vowel - consonant
-        and also if the second c is not w,x or y. this is used when trying to
-        restore an e at the end of a short  e.g.
-
-           cav(e), lov(e), hop(e), crim(e), but
-           snow, box, tray.
-        """
-        if i == 1: return (not self.cons(0) and self.cons(1))
-        if i == 0 or not self.cons(i) or self.cons(i-1) or not self.cons(i-2):
-            return 0
-        ch = self.b[i]
-        if ch == 'w' or ch == 'x' or ch == 'y':
-            return 0
-        return 1
-
-    def ends(self, s):
-        """ends(s) is TRUE <=> k0,...k ends with the string s."""
-        length = len(s)
-        if s[length - 1] != self.b[self.k]: # tiny speed-up
-            return 0
-        if length > (self.k - self.k0 + 1):
-            return 0
-        if self.b[self.k-length+1:self.k+1] != s:
-            return 0
-        self.j = self.k - length
-        return 1
-
-    def setto(self, s):
-        """setto(s) sets (j+1),...k to the characters in the string s, readjusting k."""
-        length = len(s)
-        self.b = self.b[:self.j+1] + s + self.b[self.j+length+1:]
-        self.k = self.j + length
+            if mask.count('vc', 0, j+1) > 1:
+                k = j
+            break
+
+    # Step 5: remove a final -e if m() > 1, and change -ll to -l if m() > 1.
+    j = k
+    if b[k] == 'e':
+        a = mask.count('vc', 0, j+1)
+        if a > 1 or (a == 1 and not _cvc(mask, b, k-1)):
+            k -= 1
+    if b[k] == 'l' and _doublec(mask, b, k) and mask.count('vc', 0, j+1) > 1:
+        k -= 1
+    return b[:k+1]
 
-    def r(self, s):
-        """r(s) is used further down."""
-        if self.m() > 0:
-            self.setto(s)
-
-    def step1ab(self):
-        """step1ab() gets rid of plurals and -ed or -ing. e.g.
-
-           caresses  ->  caress
-           ponies    ->  poni
-           tie       ->  tie
-           sties     ->  sti
-           caress    ->  caress
-           cats      ->  cat
-
-           feed      ->  feed
-           agreed    ->  agree
-           disabled  ->  disable
-
-           matting   ->  mat
-           mating    ->  mate
-           meeting   ->  meet
-           milling   ->  mill
-           messing   ->  mess
-
-           meetings  ->  meet
-        """
-        if self.b[self.k] == 's':
-            if self.ends("sses"):
-                self.k = self.k - 2
-            elif self.ends("ies"):
-                if self.j == 0:
-                    self.k = self.k - 1
-                else:
-                    self.k = self.k - 2
-            elif self.b[self.k - 1] != 's':
-                self.k = self.k - 1
-
-        if self.ends("ied"):
-            if self.j == 0:
-                self.k = self.k - 1
-            else:
-                self.k = self.k - 2
-        elif self.ends("eed"):
-            if self.m() > 0:
-                self.k = self.k - 1
-        elif (self.ends("ed") or self.ends("ing")) and self.vowelinstem():
-            self.k = self.j
-            if self.ends("at"):   self.setto("ate")
-            elif self.ends("bl"): self.setto("ble")
-            elif self.ends("iz"): self.setto("ize")
-            elif self.doublec(self.k):
-                self.k = self.k - 1
-                ch = self.b[self.k]
-                if ch == 'l' or ch == 's' or ch == 'z':
-                    self.k = self.k + 1
-            elif (self.m() == 1 and self.cvc(self.k)):
-                self.setto("e")
-
-    def step1c(self):
-        """step1c() turns terminal y to i when there is another vowel in the stem."""
-        if self.ends("y") and self.j > 0 and self.cons(self.k - 1):
-            self.b = self.b[:self.k] + 'i' + self.b[self.k+1:]
-
-    def step2(self):
-        """step2() maps double suffices to single ones.
-        so -ization ( = -ize plus -ation) maps to -ize etc. note that the
-        string before the suffix must give m() > 0.
+class Stemmer(object):
+    def __init__(self, language=''):
         """
-        if self.b[self.k - 1] == 'a':
-            if self.ends("ational"):   self.r("ate")
-            elif self.ends("tional"):  self.r("tion")
-        elif self.b[self.k - 1] == 'c':
-            if self.ends("enci"):      self.r("ence")
-            elif self.ends("anci"):    self.r("ance")
-        elif self.b[self.k - 1] == 'e':
-            if self.ends("izer"):      self.r("ize")
-        elif self.b[self.k - 1] == 'l':
-            if self.ends("bli"):       self.r("ble") # --DEPARTURE--
-            # To match the published algorithm, replace this phrase with
-            #   if self.ends("abli"):      self.r("able")
-            elif self.ends("alli"):
-                if self.m() > 0:
-                    self.setto("al")
-                    self.step2()
-            elif self.ends("fulli"):   self.r("ful")
-            elif self.ends("entli"):   self.r("ent")
-            elif self.ends("eli"):     self.r("e")
-            elif self.ends("ousli"):   self.r("ous")
-        elif self.b[self.k - 1] == 'o':
-            if self.ends("ization"):   self.r("ize")
-            elif self.ends("ation"):   self.r("ate")
-            elif self.ends("ator"):    self.r("ate")
-        elif self.b[self.k - 1] == 's':
-            if self.ends("alism"):     self.r("al")
-            elif self.ends("iveness"): self.r("ive")
-            elif self.ends("fulness"): self.r("ful")
-            elif self.ends("ousness"): self.r("ous")
-        elif self.b[self.k - 1] == 't':
-            if self.ends("aliti"):     self.r("al")
-            elif self.ends("iviti"):   self.r("ive")
-            elif self.ends("biliti"):  self.r("ble")
-        elif self.b[self.k - 1] == 'g': # --DEPARTURE--
-            if self.ends("logi"):
-                self.j = self.j + 1
-                self.r("og")
-        # To match the published algorithm, delete this phrase
-
-    def step3(self):
-        """step3() dels with -ic-, -full, -ness etc. similar strategy to step2."""
-        if self.b[self.k] == 'e':
-            if self.ends("icate"):     self.r("ic")
-            elif self.ends("ative"):   self.r("")
-            elif self.ends("alize"):   self.r("al")
-        elif self.b[self.k] == 'i':
-            if self.ends("iciti"):     self.r("ic")
-        elif self.b[self.k] == 'l':
-            if self.ends("ical"):      self.r("ic")
-            elif self.ends("ful"):     self.r("")
-        elif self.b[self.k] == 's':
-            if self.ends("ness"):      self.r("")
-
-    def step4(self):
-        """step4() takes off -ant, -ence etc., in context <c>vcvc<v>."""
-        if self.b[self.k - 1] == 'a':
-            if self.ends("al"): pass
-            else: return
-        elif self.b[self.k - 1] == 'c':
-            if self.ends("ance"): pass
-            elif self.ends("ence"): pass
-            else: return
-        elif self.b[self.k - 1] == 'e':
-            if self.ends("er"): pass
-            else: return
-        elif self.b[self.k - 1] == 'i':
-            if self.ends("ic"): pass
-            else: return
-        elif self.b[self.k - 1] == 'l':
-            if self.ends("able"): pass
-            elif self.ends("ible"): pass
-            else: return
-        elif self.b[self.k - 1] == 'n':
-            if self.ends("ant"): pass
-            elif self.ends("ement"): pass
-            elif self.ends("ment"): pass
-            elif self.ends("ent"): pass
-            else: return
-        elif self.b[self.k - 1] == 'o':
-            if self.ends("ion") and (self.b[self.j] == 's' or self.b[self.j] == 't'): pass
-            elif self.ends("ou"): pass
-            # takes care of -ous
-            else: return
-        elif self.b[self.k - 1] == 's':
-            if self.ends("ism"): pass
-            else: return
-        elif self.b[self.k - 1] == 't':
-            if self.ends("ate"): pass
-            elif self.ends("iti"): pass
-            else: return
-        elif self.b[self.k - 1] == 'u':
-            if self.ends("ous"): pass
-            else: return
-        elif self.b[self.k - 1] == 'v':
-            if self.ends("ive"): pass
-            else: return
-        elif self.b[self.k - 1] == 'z':
-            if self.ends("ize"): pass
-            else: return
-        else:
-            return
-        if self.m() > 1:
-            self.k = self.j
-
-    def step5(self):
-        """step5() removes a final -e if m() > 1, and changes -ll to -l if
-        m() > 1.
+        The algorithm is for English; with no language words are just lowercased.
         """
-        self.j = self.k
-        if self.b[self.k] == 'e':
-            a = self.m()
-            if a > 1 or (a == 1 and not self.cvc(self.k-1)):
-                self.k = self.k - 1
-        if self.b[self.k] == 'l' and self.doublec(self.k) and self.m() > 1:
-            self.k = self.k -1
+        self.language = language
 
     def stem(self, p, i, j):
-        """In stem(p,i,j), p is a char pointer, and the string to be stemmed
-        is from p[i] to p[j] inclusive. Typically i is zero and j is the
-        offset to the last character of a string, (p[j+1] == '\0'). The
-        stemmer adjusts the characters p[i] ... p[j] and returns the new
-        end-point of the string, k. Stemming never increases word length, so
-        i <= k <= j. To turn the stemmer into a module, declare 'stem' as
-        extern, and delete the remainder of this file.
         """
-        # copy the parameters into statics
-        self.b = p
-        self.k = j
-        self.k0 = i
-        if self.k <= self.k0 + 1:
-            return self.b # --DEPARTURE--
-
-        # With this line, strings of length 1 or 2 don't go through the
-        # stemming process, although no mention is made of this in the
-        # published algorithm. Remove the line to match the published
-        # algorithm.
-
-        self.step1ab()
-        self.step1c()
-        self.step2()
-        self.step3()
-        self.step4()
-        self.step5()
-        return self.b[self.k0:self.k+1]
+        Returns the stem of p[i:j+1].
+        """
+        return stem(p[i:j+1])
 
     def __call__(self, word):
         word = word.lower()
         if not self.language:
             return word
-        return self.stem(word, 0, len(word)-1)
+        return stem(word)
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+    if len(sys.argv) > 1:
+        words = open(sys.argv[1]).read().split()
+    else:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'tests', 'porter_voc.txt')
+        words = [line.split()[0] for line in open(path)] * 10
+    stemmer = Stemmer('en')
+    start = time.time()
+    for word in words:
+        stemmer(word)
+    elapsed = time.time() - start
+    print '%d words in %.3fs (%.0f words/s)' % (len(words), elapsed, len(words) / (elapsed or 1))